@@ -58,6 +58,7 @@ class QTInstrumentFrame(gtk.VBox):
         self._cur_val = {}
         self._row_num = {}
         self._reorder_hid = None
+        self._subscribed = False
 
         # For formatting
         self._parameter_options = {}
@@ -139,6 +140,8 @@ class QTInstrumentFrame(gtk.VBox):
 
     def _parameter_added_cb(self, sender, name):
         self._add_parameter_by_name(name)
+        if self._subscribed:
+            self._instrument.subscribe_changed([name])
         self._delayed_reorder()
 
     def _reorder_table(self, ofs):
@@ -180,6 +183,8 @@ class QTInstrumentFrame(gtk.VBox):
         del self._cur_val[param]
         del self._row_num[param]
         del self._parameter_options[param]
+        if self._subscribed:
+            self._instrument.unsubscribe_changed([param])
 
         self._reorder_table(1)
 
@@ -235,6 +240,7 @@ class QTInstrumentFrame(gtk.VBox):
 
     def show_table(self, show):
         '''Show or hide the parameter info table.'''
+        self._set_subscribed(show)
         if show:
             self._table.show()
             self._label.set_markup('<b>- %s</b> [?]' % \
@@ -244,12 +250,24 @@ class QTInstrumentFrame(gtk.VBox):
             self._label.set_markup('<b>+ %s</b> [?]' % \
                     self._instrument_name)
 
+    def _set_subscribed(self, subscribe):
+        '''Only receive changes of the parameters while they are visible.'''
+        if self._instrument is None or subscribe == self._subscribed:
+            return
+        params = self._label_name.keys()
+        if subscribe:
+            self._instrument.subscribe_changed(params)
+        else:
+            self._instrument.unsubscribe_changed(params)
+        self._subscribed = subscribe
+
     def _label_clicked_cb(self, sender, param):
         self.show_table(not self._table.props.visible)
 
     def remove(self):
         #FIXME: required to kill all references to the instrument object.
         #This also suggests that InstrumentFrames are leaked.
+        self._set_subscribed(False)
         self._instrument = None
 
 class InstrumentWindow(qtwindow.QTWindow):
@@ -237,6 +237,7 @@ class WatchWindow(qtwindow.QTWindow):
         else:
             hid = ins.connect('changed', lambda sender, changes: \
                     self._ins_changed_cb(sender, changes, param, ins_param))
+            ins.subscribe_changed([param])
 
         self._watch[ins_param]['hid'] = hid
 
@@ -336,7 +337,8 @@ class WatchWindow(qtwindow.QTWindow):
             if info['delay'] != 0:
                 gobject.source_remove(info['hid'])
             else:
-                info['ins'].disconnect(info['hid'])
+                info['instrument'].disconnect(info['hid'])
+                info['instrument'].unsubscribe_changed([info['parameter']])
             del self._watch[ins_param]
 
     def _apply_clicked_cb(self, widget):
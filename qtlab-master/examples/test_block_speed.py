@@ -0,0 +1,33 @@
+# Script to compare parsing trace data sent as ASCII and as binary block
+#
+# Simulates the response of a network analyzer to a trace query (1601
+# complex points) and times the old ASCII parsing, the numpy ASCII parsing
+# and the binary block parsing of lib.visafunc. No instrument is needed.
+
+import numpy as np
+import time
+from lib import visafunc
+
+NPOINTS = 1601
+N = 200
+
+data = np.random.rand(2 * NPOINTS)
+ascii = ','.join(['%+.12E' % v for v in data])
+raw = data.astype('<f8').tostring()
+block = '#6%06d%s\n' % (len(raw), raw)
+
+def bench(label, func, nbytes):
+    start = time.time()
+    for i in xrange(N):
+        func()
+    stop = time.time()
+    msec = (stop - start) / N * 1e3
+    print '%-32s %8.3f msec/trace, %6d bytes' % (label, msec, nbytes)
+    return msec
+
+bench('map(float, split())',
+        lambda: np.array(map(float, ascii.split(','))), len(ascii))
+bench('visafunc.parse_ascii_values()',
+        lambda: visafunc.parse_ascii_values(ascii), len(ascii))
+bench('visafunc.parse_binary_block()',
+        lambda: visafunc.parse_binary_block(block, '<f8'), len(block))
@@ -0,0 +1,71 @@
+# Script to test the speed of the Data class: adding points (the time per
+# point should stay flat while the data set grows), writing, loading and
+# adding complete blocks.
+
+import numpy as np
+import qt
+import time
+
+N = 200000
+CHUNK = 20000
+
+d = qt.Data(name='speedtest', inmem=True, infile=False)
+d.add_coordinate('x')
+d.add_coordinate('y')
+d.add_value('z')
+
+i = 0
+while i < N:
+    start = time.time()
+    for j in xrange(CHUNK):
+        d.add_data_point(i, j, i * j)
+        i += 1
+    stop = time.time()
+    print 'points %d - %d: %.02f usec/point' % \
+            (i - CHUNK, i, (stop - start) / CHUNK * 1e6)
+
+# Time writing the complete data set to a .dat file
+start = time.time()
+d.write_file()
+stop = time.time()
+print 'write_file() of %d points: %.02f sec' % (d.get_npoints(), stop - start)
+
+# Compare loading the file line by line and in chunks
+for fast in (False, True):
+    qt.config.set('data_fast_load', fast, save=False)
+    start = time.time()
+    d2 = qt.Data(d.get_filepath(), name='speedtest_load')
+    stop = time.time()
+    print 'load with data_fast_load=%s: %.02f sec' % (fast, stop - start)
+qt.config.remove(['data_fast_load'], save=False)
+
+# Compare writing and loading the other file formats
+for fmt in ('binary', 'hdf5'):
+    d.set_file_format(fmt)
+    start = time.time()
+    d.write_file()
+    stop = time.time()
+    print 'write_file() in %s format: %.02f sec' % (fmt, stop - start)
+    start = time.time()
+    d2 = qt.Data(d.get_filepath(), name='speedtest_load')
+    d2.get_data().sum()
+    stop = time.time()
+    print 'load %s file: %.02f sec' % (fmt, stop - start)
+d.set_file_format('text')
+
+# Time adding traces with add_data_block()
+NTRACES = 100
+NPOINTS = 1601
+
+d3 = qt.Data(name='speedtest_block')
+d3.add_coordinate('frequency')
+d3.add_coordinate('trace')
+d3.add_value('amplitude')
+d3.create_file()
+f = np.linspace(1e9, 2e9, NPOINTS)
+start = time.time()
+for n in xrange(NTRACES):
+    d3.add_data_block(f, np.ones(NPOINTS) * n, np.random.rand(NPOINTS))
+stop = time.time()
+d3.close_file()
+print 'add_data_block(): %.0f rows/sec' % (NTRACES * NPOINTS / (stop - start))
@@ -0,0 +1,79 @@
+# Script to test the call rate of the object sharer
+#
+# Serves an object from an ObjectSharer in a thread and calls it over a
+# loopback socket pair: blocking calls one at a time, pipelined calls with
+# call_async() and batches with call_batch(). No server or client process
+# is needed.
+
+import socket
+import select
+import threading
+import time
+from lib.network import object_sharer as objsh
+
+N = 5000
+BATCH = 100
+
+class Server():
+
+    def __init__(self):
+        self._values = {'frequency': 1e9, 'power': -10.0}
+
+    def ins_get(self, insname, parname):
+        return self._values[parname]
+
+def serve(sharer, conn, stop):
+    while not stop.isSet():
+        if sharer.get_send_queue_size(conn) > 0:
+            wlist = [conn]
+        else:
+            wlist = []
+        lists = select.select([conn], wlist, [], 0.1)
+        if len(lists[0]) > 0:
+            try:
+                if sharer.recv(conn) == 0:
+                    break
+            except socket.error:
+                pass
+        sharer._process_send_queue()
+
+def bench(label, func, n=N):
+    start = time.time()
+    func(n)
+    stop = time.time()
+    usec = (stop - start) / n * 1e6
+    print '%-20s %8.1f usec/call %10.0f calls/s' % \
+            (label, usec, n / (stop - start))
+
+sconn, cconn = socket.socketpair()
+sconn.setblocking(0)
+cconn.setblocking(0)
+server = objsh.ObjectSharer()
+server._objects['srv'] = Server()
+client = objsh.ObjectSharer()
+stop = threading.Event()
+thread = threading.Thread(target=serve, args=(server, sconn, stop))
+thread.daemon = True
+thread.start()
+
+def blocking(n):
+    for i in xrange(n):
+        client.call(cconn, 'srv', 'ins_get', 'gen', 'frequency')
+
+def pipelined(n):
+    futures = [client.call_async(cconn, 'srv', 'ins_get', 'gen', 'frequency')
+            for i in xrange(n)]
+    for f in futures:
+        f.get_return_value()
+
+def batched(n):
+    calls = [('srv', 'ins_get', ('gen', 'frequency'))] * BATCH
+    for i in xrange(n / BATCH):
+        client.call_batch(cconn, calls)
+
+bench('call()', blocking)
+bench('call_async()', pipelined)
+bench('call_batch()', batched)
+
+stop.set()
+thread.join()
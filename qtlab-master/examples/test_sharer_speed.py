@@ -0,0 +1,104 @@
+# Script to test the throughput of the object sharer for numpy arrays
+#
+# Sends function return values containing a trace over a loopback socket
+# pair between two ObjectSharer instances and measures the throughput, both
+# with the arrays sent as raw data and with the arrays pickled. Also
+# measures the rate of small signal packets sent in bursts. No server or
+# client process is needed.
+
+import numpy as np
+import socket
+import select
+import time
+from lib.network import object_sharer as objsh
+
+SIZES = (1601, 100000, 1000000)
+N = 20
+NSIGNALS = (1000, 10000, 100000)
+
+def pump(sender, receiver, sconn, rconn, done):
+    '''Send and receive until done() returns True.'''
+
+    while not done():
+        if sender.get_send_queue_size(sconn) > 0:
+            select.select([rconn], [sconn], [], 0.1)
+            sender._process_send_queue()
+        else:
+            select.select([rconn], [], [], 0.1)
+        try:
+            receiver.recv(rconn)
+        except socket.error:
+            continue
+
+def transfer(sender, receiver, sconn, rconn, retval):
+    '''Send retval as a return value and wait until it is received.'''
+
+    receiver._last_call_id += 1
+    callid = receiver._last_call_id
+    result = []
+    receiver._return_cbs[callid] = result.append
+    sender._send_return(sconn, callid, retval)
+    pump(sender, receiver, sconn, rconn, lambda: len(result) > 0)
+    return result[0]
+
+def socket_pair():
+    sconn, rconn = socket.socketpair()
+    sconn.setblocking(0)
+    rconn.setblocking(0)
+    return sconn, rconn
+
+def bench(label, size, raw):
+    sconn, rconn = socket_pair()
+    sender = objsh.ObjectSharer()
+    receiver = objsh.ObjectSharer()
+
+    data = np.random.rand(size)
+    if raw:
+        minsize = objsh.ARRAY_MIN_SIZE
+    else:
+        minsize = data.nbytes + 1
+    oldsize = objsh.ARRAY_MIN_SIZE
+    objsh.ARRAY_MIN_SIZE = minsize
+
+    try:
+        start = time.time()
+        for i in xrange(N):
+            ret = transfer(sender, receiver, sconn, rconn, (data, data))
+        stop = time.time()
+    finally:
+        objsh.ARRAY_MIN_SIZE = oldsize
+        sconn.close()
+        rconn.close()
+
+    assert np.all(ret[0] == data)
+    msec = (stop - start) / N * 1e3
+    mbps = 2 * data.nbytes / 1e6 / (stop - start) * N
+    print '%-10s %8d points %8.3f msec/transfer %8.1f MB/s' % \
+            (label, size, msec, mbps)
+
+def bench_signals(n):
+    '''Send a burst of n small signals and receive them.'''
+
+    sconn, rconn = socket_pair()
+    sender = objsh.ObjectSharer()
+    receiver = objsh.ObjectSharer()
+    sender.set_send_queue_limit(1e12)
+    received = []
+    receiver._objects['obj'] = received
+
+    start = time.time()
+    for i in xrange(n):
+        sender.call(sconn, 'obj', 'append', {'value': i}, signal=True)
+    pump(sender, receiver, sconn, rconn, lambda: len(received) == n)
+    stop = time.time()
+    sconn.close()
+    rconn.close()
+
+    usec = (stop - start) / n * 1e6
+    print 'signals    %8d packets %8.2f usec/signal' % (n, usec)
+
+for size in SIZES:
+    bench('pickled', size, False)
+    bench('raw', size, True)
+for n in NSIGNALS:
+    bench_signals(n)
@@ -1,32 +1,53 @@
 # Script to test overhead of QTLab framework
+#
+# Measures the time per call of the different ways to get and set an
+# instrument parameter, and the overhead compared to calling the driver
+# function directly.
 
 import qt
 import time
 
 ins = qt.instruments['dsgen']
-N = 1e6
+if ins is None:
+    ins = qt.instruments.create('dsgen', 'dummy_signal_generator')
+N = 100000
 
-start = time.time()
-i = 0
-while i < N:
-    v = ins._ins.do_get_wave()
-    i += 1
-stop = time.time()
-print 'do_get_wave: %s sec' % (stop - start, )
+def bench(label, func, n=N, ref=None):
+    '''Call func n times and print the time per call.'''
+    start = time.time()
+    i = 0
+    while i < n:
+        func()
+        i += 1
+    stop = time.time()
 
-start = time.time()
-i = 0
-while i < N:
-    v = ins.get_wave(fast=True)
-    i += 1
-stop = time.time()
-print 'get_wave(fast=True): %s sec' % (stop - start, )
+    usec = (stop - start) / n * 1e6
+    if ref is None:
+        print '%-32s %8.2f usec/call' % (label, usec)
+    else:
+        print '%-32s %8.2f usec/call, overhead %8.2f usec' % \
+                (label, usec, usec - ref)
+    return usec
 
-start = time.time()
-i = 0
-while i < N:
-    v = ins.get_wave()
-    i += 1
-stop = time.time()
-print 'get_wave: %s sec' % (stop - start, )
+print 'Get:'
+ref = bench('_ins.do_get_wave()', ins._ins.do_get_wave)
+bench('_ins.get_wave(fast=True)', lambda: ins._ins.get_wave(fast=True), ref=ref)
+bench('_ins.get_wave()', ins._ins.get_wave, ref=ref)
+bench('get_wave(fast=True)', lambda: ins.get_wave(fast=True), ref=ref)
+bench('get_wave()', ins.get_wave, ref=ref)
+bench("get('wave')", lambda: ins.get('wave'), ref=ref)
+bench("get(['wave', 'wave_type'])",
+        lambda: ins.get(['wave', 'wave_type']), ref=ref)
+bench('get_wave(query=False)', lambda: ins.get_wave(query=False), ref=ref)
+bench('get_amplitude() (soft get)', ins.get_amplitude, ref=ref)
 
+print 'Set:'
+ref = bench('_ins.do_set_amplitude(1.0)',
+        lambda: ins._ins.do_set_amplitude(1.0))
+bench('_ins.set_amplitude(1.0)', lambda: ins._ins.set_amplitude(1.0), ref=ref)
+bench('set_amplitude(1.0, fast=True)',
+        lambda: ins.set_amplitude(1.0, fast=True), ref=ref)
+bench('set_amplitude(1.0)', lambda: ins.set_amplitude(1.0), ref=ref)
+bench("set('amplitude', 1.0)", lambda: ins.set('amplitude', 1.0), ref=ref)
+bench("set_wave_type('SIN') (option list)",
+        lambda: ins.set_wave_type('SIN'), ref=ref)
@@ -7,5 +7,9 @@ qt.flow.register_exit_handler(object_sharer.helper.close_sockets)
 qt.flow.register_exit_handler(temp.File.remove_all)
 qt.flow.register_exit_handler(lockfile.remove_lockfile)
 
+if len(qt.instruments.get_timing()) > 0:
+    logging.info('Instrument creation times:\n%s',
+            qt.instruments.get_timing_report())
+
 # Clear "starting" status
 qt.flow.finished_starting()
@@ -5,6 +5,7 @@ import visa
 import types
 import logging
 import numpy as np
+from lib import visafunc
 
 class Agilent_ENA_5071C(Instrument):
     '''
@@ -15,7 +16,7 @@ class Agilent_ENA_5071C(Instrument):
     <name> = instruments.create('<name>', 'Agilent_E5071C', address='<GBIP address>, reset=<bool>')
     '''
 
-    def __init__(self, name, address, reset=False):
+    def __init__(self, name, address, reset=False, binary=True):
         '''
         Initializes the Agilent_E5071C, and communicates with the wrapper.
 
@@ -23,6 +24,8 @@ class Agilent_ENA_5071C(Instrument):
           name (string)    : name of the instrument
           address (string) : GPIB address
           reset (bool)     : resets to default values, default=False
+          binary (bool)    : transfer traces in binary (REAL,64) format
+                             instead of ASCII, default=True
         '''
         logging.info(__name__ + ' : Initializing instrument Agilent_E5071C')
         Instrument.__init__(self, name, tags=['physical'])
@@ -30,6 +33,7 @@ class Agilent_ENA_5071C(Instrument):
         # Add some global constants
         self._address = address
         self._visainstrument = visa.instrument(self._address)
+        self._binary = binary
 
         self.add_parameter('power',
             flags=Instrument.FLAG_GETSET, units='dBm', minval=-80, maxval=10, type=types.FloatType)
@@ -115,9 +119,19 @@ class Agilent_ENA_5071C(Instrument):
             freqvalues array (Hz)
         '''
         logging.info(__name__ + ' : get f stim data')
-        strdata= str(self._visainstrument.ask(':SENS1:FREQ:DATA?'))
-        return np.array(map(float,strdata.split(',')))
-        
+        return self._ask_values(':SENS1:FREQ:DATA?')
+
+    def _ask_values(self, query):
+        '''
+        Query an array of values, as binary block (little-endian 64 bit
+        floats) if binary transfer is enabled, otherwise as ASCII.
+        '''
+        if self._binary:
+            return visafunc.ask_binary_block(self._visainstrument,
+                ':FORM:DATA REAL;:FORM:BORD SWAP;%s' % query, '<f8')
+        strdata = str(self._visainstrument.ask(':FORM:DATA ASC;%s' % query))
+        return visafunc.parse_ascii_values(strdata)
+
     def gettrace(self):
         '''
         Gets amp/phase stimulus data, returns 2 arrays
@@ -128,8 +142,7 @@ class Agilent_ENA_5071C(Instrument):
             mags (dB) phases (rad)
         '''
         logging.info(__name__ + ' : get amp, phase stim data')
-        strdata= str(self._visainstrument.ask(':CALC:DATA:FDATa?'))
-        data= np.array(map(float,strdata.split(',')))
+        data = self._ask_values(':CALC:DATA:FDATa?')
         data=data.reshape((len(data)/2,2))
         return data.transpose() # mags, phase
         
@@ -21,9 +21,9 @@ import visa
 import types
 import logging
 from time import sleep
-import struct
 import numpy
 import qt
+from lib import visafunc
 
 class HP_4195A(Instrument):
     '''
@@ -229,13 +229,12 @@ class HP_4195A(Instrument):
             None
 
         Output:
-            data (int)  : list of data points
+            data (numpy array)  : data points
         '''
     
-        data = self._visainstrument.ask('FMT2;A?')
-
-        d = [struct.unpack('>d', data[i:i+8])[0] for i in range(4, len(data),8)]
-        return d
+        # FMT2: 64 bit floats
+        return visafunc.ask_binary_block(self._visainstrument, 'FMT2;A?',
+                '>f8')
 
 #### Functions for doing measurements
 
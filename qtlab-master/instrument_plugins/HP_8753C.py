@@ -21,8 +21,8 @@ import visa
 import types
 import logging
 from time import sleep
-import struct
 import numpy
+from lib import visafunc
 
 import qt
 
@@ -196,11 +196,12 @@ class HP_8753C(Instrument):
             None
 
         Output:
-            data (int)  : list of data points
+            data (numpy array)  : data points
         '''
-        data = self._visainstrument.ask('FORM2;DISPDATA;OUTPFORM;')
-        d = [struct.unpack('>f', data[i:i+4])[0] for i in range(4, len(data),8)]
-        return d
+        # FORM2: 32 bit floats, two per point, of which the first is used
+        data = visafunc.ask_binary_block(self._visainstrument,
+                'FORM2;DISPDATA;OUTPFORM;', '>f4')
+        return data[::2]
 
 ### Functions for doing measurements
 
@@ -175,8 +175,7 @@ class IVVI(Instrument):
             None
         '''
         logging.info('Get all')
-        for i in range(self._numdacs):
-            self.get('dac%d' % (i+1))
+        self.get(['dac%d' % (i+1) for i in range(self._numdacs)])
 
     def set_dacs_zero(self):
         for i in range(self._numdacs):
@@ -224,6 +223,28 @@ class IVVI(Instrument):
         mvoltages = self._get_dacs()
         return mvoltages[channel - 1]
 
+    def _do_get_many(self, names):
+        '''
+        Returns the values of the requested dacs, reading all of them
+        from the device at once
+
+        Input:
+            names (list of strings) : parameter names
+
+        Output:
+            Dictionary of parameter -> dacvalue in mV for the dacs
+        '''
+        dacs = [n for n in names if n.startswith('dac')]
+        if len(dacs) == 0:
+            return {}
+
+        mvoltages = self._get_dacs()
+        ret = {}
+        for name in dacs:
+            channel = self.get_parameter_options(name)['channel']
+            ret[name] = mvoltages[channel - 1]
+        return ret
+
     def do_set_dac(self, mvoltage, channel):
         '''
         Sets the specified dac to the specified voltage
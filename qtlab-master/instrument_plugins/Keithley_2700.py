@@ -37,6 +37,12 @@ def bool_to_str(val):
     else:
         return "OFF"
 
+def str_to_bool(val):
+    '''
+    Function to convert '0' or '1' to boolean
+    '''
+    return bool(int(val))
+
 class Keithley_2700(Instrument):
     '''
     This is the driver for the Keithley 2700 Multimeter
@@ -50,6 +56,31 @@ class Keithley_2700(Instrument):
         change_autozero=<bool>)
     '''
 
+    # Parameters that can be combined in a single compound query / command:
+    # name -> (mode, parameter, conversion of the reply).
+    # A mode of None means the current mode.
+    _COMPOUND_PARS = {
+        'range': (None, 'RANG', float),
+        'digits': (None, 'DIG', int),
+        'integrationtime': (None, 'APER', float),
+        'nplc': (None, 'NPLC', float),
+        'trigger_continuous': ('INIT', 'CONT', str_to_bool),
+        'trigger_delay': ('TRIG', 'DEL', float),
+        'trigger_source': ('TRIG', 'SOUR', str),
+        'trigger_timer': ('TRIG', 'TIM', float),
+        'display': ('DISP', 'ENAB', str_to_bool),
+        'autozero': ('SYST', 'AZER:STAT', str_to_bool),
+        'averaging': (None, 'AVER:STAT', str_to_bool),
+        'averaging_window': (None, 'AVER:WIND', float),
+        'averaging_count': (None, 'AVER:COUN', int),
+        'autorange': (None, 'RANG:AUTO', str_to_bool),
+    }
+
+    # Parameters without side effects that can be set with _do_set_many()
+    _COMPOUND_SET_PARS = ('range', 'digits', 'trigger_delay', 'trigger_timer',
+        'display', 'autozero', 'averaging', 'averaging_window',
+        'averaging_count', 'autorange')
+
     def __init__(self, name, address, reset=False,
             change_display=True, change_autozero=True):
         '''
@@ -231,23 +262,13 @@ class Keithley_2700(Instrument):
         '''
         logging.info('Get all relevant data from device')
         self.get_mode()
-        self.get_range()
-        self.get_trigger_continuous()
         self.get_trigger_count()
-        self.get_trigger_delay()
-        self.get_trigger_source()
-        self.get_trigger_timer()
-        self.get_mode()
-        self.get_digits()
-        self.get_integrationtime()
-        self.get_nplc()
-        self.get_display()
-        self.get_autozero()
-        self.get_averaging()
-        self.get_averaging_window()
-        self.get_averaging_count()
         self.get_averaging_type()
-        self.get_autorange()
+        # Depend on the mode, so get these after the mode
+        self.get(['range', 'trigger_continuous', 'trigger_delay',
+            'trigger_source', 'trigger_timer', 'digits', 'integrationtime',
+            'nplc', 'display', 'autozero', 'averaging', 'averaging_window',
+            'averaging_count', 'autorange'])
 
 # Link old read and readlast to new routines:
     # Parameters are for states of the machnine and functions
@@ -544,6 +565,66 @@ class Keithley_2700(Instrument):
 
 
 
+    def _do_get_many(self, names):
+        '''
+        Read several parameters with a single compound query.
+
+        Input:
+            names (list of strings) : parameters to read
+
+        Output:
+            Dictionary of parameter -> value for the parameters read
+        '''
+        names = [n for n in names if n in self._COMPOUND_PARS]
+        if len(names) < 2:
+            return {}
+
+        queries = []
+        for name in names:
+            mode, par, conv = self._COMPOUND_PARS[name]
+            queries.append(':%s:%s?' % (self._determine_mode(mode), par))
+        string = ';'.join(queries)
+        ans = self._visainstrument.ask(string)
+        logging.debug('ask instrument for %s (result %s)' % \
+            (string, ans))
+
+        replies = ans.split(';')
+        if len(replies) != len(names):
+            logging.warning('Unexpected reply to compound query: %s', ans)
+            return {}
+
+        ret = {}
+        for name, reply in zip(names, replies):
+            conv = self._COMPOUND_PARS[name][2]
+            ret[name] = conv(reply.strip().strip('"'))
+        return ret
+
+    def _do_set_many(self, values):
+        '''
+        Set several parameters with a single compound command.
+
+        Input:
+            values (dict) : parameter -> value
+
+        Output:
+            List of parameters that were set
+        '''
+        names = [n for n in values if n in self._COMPOUND_SET_PARS]
+        if len(names) < 2:
+            return []
+
+        commands = []
+        for name in names:
+            mode, par, conv = self._COMPOUND_PARS[name]
+            val = values[name]
+            if type(val) is types.BooleanType:
+                val = bool_to_str(val)
+            commands.append(':%s:%s %s' % (self._determine_mode(mode), par, val))
+        string = ';'.join(commands)
+        logging.debug('Set instrument to %s' % string)
+        self._visainstrument.write(string)
+        return names
+
     def do_set_range(self, val, mode=None):
         '''
         Set range to the specified value for the
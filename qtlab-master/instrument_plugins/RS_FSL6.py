@@ -21,6 +21,7 @@ import types
 import logging
 import numpy
 import math
+from lib import visafunc
 
 class RS_FSL6(Instrument):
     '''
@@ -50,6 +51,7 @@ class RS_FSL6(Instrument):
         self._address = address
         self._visainstrument = visa.instrument(self._address)
         self._visainstrument.timeout = 1
+        self._binary = False
 
         # Add parameters
         self.add_parameter('centerfrequency', type=types.FloatType,
@@ -97,6 +99,7 @@ class RS_FSL6(Instrument):
         self.add_function('init_IQ_measurement')
         self.add_function('init_zero_span')
         self.add_function('init_trace_readout')
+        self.add_function('get_trace')
         self.add_function('start_sweep')
         self.add_function('stop_power_measurement')
         self.add_function('convert_dBuV_to_V')  # works but apparently not needed, device returns usually V by default
@@ -259,30 +262,48 @@ class RS_FSL6(Instrument):
         #self._visainstrument.write('*WAI')
 
 
-    def init_trace_readout(self):
+    def init_trace_readout(self, mode='ASCII'):
         '''
-        Read a trace
+        Select the format for reading traces
         p. 230 operating manual
 
         Input:
-            mode, either ASCII or binary
+            mode (string): 'ASCII' or 'binary' (REAL,32, much faster for
+                long traces)
 
         Output:
             None
         '''
         logging.debug(__name__ + ' : initialization of trace readout')
-        self._visainstrument.write('FORM ASC')
-        #if mode == 'ASCII':
-        #    self._visainstrument.write('FORM ASC')         
-        #elif mode == 'binary':
-        #    self._visainstrument.write('FORM REAL,32')      
-        #else: 
-        #    print 'Not a valid mode, function requires mode as argument, parameter either ASC for ASCII file or binary for binary file'
-        #    # ASCII file format, alternative: FORMat REAL,32 (binary file) / FORM ASC for ASCII
+        if mode == 'ASCII':
+            self._visainstrument.write('FORM ASC')
+            self._binary = False
+        elif mode == 'binary':
+            self._visainstrument.write('FORM REAL,32')
+            self._binary = True
+        else:
+            raise ValueError('Invalid mode %r, use ASCII or binary' % mode)
         ##self._visainstrument.write('MMEM:STOR:TRAC 1,'TEMPTRACE.DAT'')   
         #    #the previous command just creates a file locally on the analyer
-        ##self._visainstrument.write('TRAC? TRACE1')
-      
+
+    def get_trace(self):
+        '''
+        Start a sweep and read out trace 1, in the format selected with
+        init_trace_readout().
+
+        Input:
+            None
+
+        Output:
+            trace data (numpy array)
+        '''
+        logging.debug(__name__ + ' : reading trace from instrument')
+        self._visainstrument.write('INIT,*WAI')
+        if self._binary:
+            return visafunc.ask_binary_block(self._visainstrument,
+                    'TRAC? TRACE1', '<f4')
+        return visafunc.parse_ascii_values(
+                self._visainstrument.ask('TRAC? TRACE1'))
 
     def convert_dBuV_to_V(self,dBuV):
         '''
@@ -67,6 +67,22 @@ class Remote_Instrument(Instrument):
     def _get(self, channel, **kwargs):
         return self._srv.ins_get(self._remote_name, channel, **kwargs)
 
+    def _do_get_many(self, names):
+        # A local InstrumentServer has no call_batch()
+        if not hasattr(self._srv, 'call_batch'):
+            ret = {}
+            for name in names:
+                ret[name] = self._srv.ins_get(self._remote_name, name)
+            return ret
+
+        # Query all parameters in one round trip
+        calls = [('ins_get', (self._remote_name, name)) for name in names]
+        values = self._srv.call_batch(calls)
+        if values is None:
+            # Timed out, the parameters are read one by one
+            return {}
+        return dict(zip(names, values))
+
     def _set(self, val, channel, **kwargs):
         return self._srv.ins_set(self._remote_name, channel, val, **kwargs)
 
@@ -31,6 +31,13 @@ class SR830(Instrument):
         reset=<bool>)
     '''
 
+    # Parameter numbers of the SNAP? command
+    _SNAP_PARAMS = {
+        'X': 1, 'Y': 2, 'R': 3, 'P': 4,
+        'in1': 5, 'in2': 6, 'in3': 7, 'in4': 8,
+        'frequency': 9,
+    }
+
     def __init__(self, name, address, reset=False):
         '''
         Initializes the SR830.
@@ -210,10 +217,7 @@ class SR830(Instrument):
         self.get_frequency()
         self.get_amplitude()
         self.get_phase()
-        self.get_X()
-        self.get_Y()
-        self.get_R()
-        self.get_P()
+        self.get(['X', 'Y', 'R', 'P'])
         self.get_ref_input()
         self.get_ext_trigger()
         self.get_sync_filter()
@@ -286,6 +290,28 @@ class SR830(Instrument):
             print 'Wrong output requested.'
         return readvalue
 
+    def _do_get_many(self, names):
+        '''
+        Read up to 6 of X, Y, R, P, in1-4 and frequency simultaneously
+        with SNAP?.
+
+        Input:
+            names (list of strings) : parameters to read
+
+        Output:
+            Dictionary of parameter -> value for the parameters read
+        '''
+        snap = [n for n in names if n in self._SNAP_PARAMS][:6]
+        if len(snap) < 2:
+            return {}
+
+        self.direct_output()
+        cmd = 'SNAP?%s' % ','.join([str(self._SNAP_PARAMS[n]) for n in snap])
+        logging.info(__name__ + ' : Reading parameters from instrument: %s' % ', '.join(snap))
+        reply = self._visainstrument.ask(cmd)
+        values = [float(v) for v in reply.split(',')]
+        return dict(zip(snap, values))
+
     def do_get_X(self, ovl=False):
         '''
         Read out X of the Lock In
@@ -26,10 +26,13 @@ import re
 import logging
 import copy
 import shutil
+import threading
+import Queue
 
 from gettext import gettext as _L
 
 from lib import namedlist, temp
+from lib.file_support import binarydata, hdf5data
 from lib.misc import dict_to_ordered_tuples, get_arg_type
 from lib.config import get_config
 config = get_config()
@@ -151,6 +154,257 @@ class _DataList(namedlist.NamedList):
         else:
             return name
 
+class _RowBuffer:
+    '''
+    Preallocated 2D row storage. The capacity is doubled whenever it runs
+    out, so appending rows costs amortized O(1) instead of copying the
+    whole array for every new point.
+    '''
+
+    _MIN_CAPACITY = 64
+
+    def __init__(self, ncols, capacity=0, dtype=numpy.float64):
+        capacity = max(int(capacity), self._MIN_CAPACITY)
+        self._buf = numpy.empty((capacity, ncols), dtype=dtype)
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def get_ncols(self):
+        return self._buf.shape[1]
+
+    def get_capacity(self):
+        return self._buf.shape[0]
+
+    def reserve(self, capacity, dtype=None):
+        '''Make sure at least <capacity> rows fit without reallocating.'''
+
+        if dtype is None:
+            dtype = self._buf.dtype
+        if capacity <= self.get_capacity() and dtype == self._buf.dtype:
+            return
+
+        capacity = max(capacity, self.get_capacity())
+        newbuf = numpy.empty((capacity, self.get_ncols()), dtype=dtype)
+        newbuf[:self._len] = self._buf[:self._len]
+        self._buf = newbuf
+
+    def append(self, rows):
+        '''Append a 2D array of rows and return a view of all rows.'''
+
+        nrows = len(rows)
+        dtype = numpy.result_type(self._buf.dtype, rows.dtype)
+        if self._len + nrows > self.get_capacity() or dtype != self._buf.dtype:
+            capacity = self.get_capacity()
+            while capacity < self._len + nrows:
+                capacity *= 2
+            self.reserve(capacity, dtype)
+
+        self._buf[self._len:self._len + nrows] = rows
+        self._len += nrows
+        return self.get_view()
+
+    def get_view(self):
+        '''Return a view of the rows filled so far.'''
+        return self._buf[:self._len]
+
+class _LoopTracker:
+    '''
+    Detects the loop structure of the coordinate columns while points are
+    added. Only the first row and the rows at multiples of the size of the
+    loops found so far are inspected, so adding a point costs O(1).
+
+    The result is identical to detecting the loops over the complete data
+    set afterwards.
+    '''
+
+    def __init__(self, ncoords):
+        self._ncoords = ncoords
+        self._npoints = 0
+        self._first = None
+
+        # Closed loops: column numbers, sizes and start / end values
+        self._loopdims = []
+        self._loopsizes = []
+        self._loopinfo = []
+        self._mulsize = 1
+
+        # Loop being scanned: column, start value, next step to check and
+        # value at the last step checked
+        self._loopdim = None
+        self._loopstart = None
+        self._loopstep = 0
+        self._loopend = None
+
+        # Set when no further loops can be found
+        self._done = ncoords == 0
+
+    def get_npoints(self):
+        return self._npoints
+
+    def add_rows(self, rows):
+        '''Process new rows (a 2D array).'''
+
+        n0 = self._npoints
+        self._npoints += len(rows)
+        if self._first is None and len(rows) > 0:
+            # Copy, the caller may reuse the buffer for the next block
+            self._first = tuple(rows[0])
+
+        while not self._done:
+            m = self._mulsize
+            if self._loopdim is None:
+                if m >= self._npoints:
+                    break
+
+                row = rows[m - n0]
+                for colnum in range(self._ncoords):
+                    if row[colnum] != self._first[colnum]:
+                        break
+                else:
+                    self._done = True
+                    break
+
+                self._loopdim = colnum
+                self._loopstart = self._first[colnum]
+                self._loopstep = 2
+                self._loopend = row[colnum]
+                continue
+
+            i = self._loopstep
+            if i * m >= self._npoints:
+                break
+
+            val = rows[i * m - n0][self._loopdim]
+            if val != self._loopstart:
+                self._loopend = val
+                self._loopstep += 1
+                continue
+
+            # Loop closed
+            self._loopdims.append(self._loopdim)
+            self._loopsizes.append(i)
+            self._loopinfo.append((self._loopstart, self._loopend))
+            self._mulsize *= i
+            self._loopdim = None
+            if len(self._loopdims) == self._ncoords:
+                self._done = True
+
+    def get_loopdims(self):
+        '''Return the columns of all loops, innermost first.'''
+        loopdims = list(self._loopdims)
+        if self._loopdim is not None:
+            loopdims.append(self._loopdim)
+        return loopdims
+
+    def get_loopshape(self):
+        '''
+        Return the sizes of all loops, innermost first. The size of an
+        unfinished outer loop is the number of steps started.
+        '''
+
+        loopshape = list(self._loopsizes)
+        if self._loopdim is not None:
+            loopshape.append(self._loopstep)
+        return loopshape
+
+    def get_nloops_closed(self):
+        '''Return the number of loops that are finished.'''
+        return len(self._loopdims)
+
+    def get_loopinfo(self, closed_only=False):
+        '''
+        Return a list of (column, start, size, end) for all loops, or only
+        for the finished loops if closed_only is True.
+        '''
+
+        ret = []
+        for i, dim in enumerate(self._loopdims):
+            start, end = self._loopinfo[i]
+            ret.append((dim, start, self._loopsizes[i], end))
+        if self._loopdim is not None and not closed_only:
+            ret.append((self._loopdim, self._loopstart,
+                self.get_loopshape()[-1], self._loopend))
+        return ret
+
+    def is_complete(self):
+        '''Return whether the data forms a complete 'hyper-rectangle'.'''
+
+        size = self._mulsize
+        if self._loopdim is not None:
+            size *= self._loopstep
+        return self._npoints == size
+
+    def get_complete_shape(self):
+        '''
+        Return (nrows, loopdims, loopshape) describing the largest part of
+        the data that forms a complete 'hyper-rectangle', or None if there
+        is no such part.
+        '''
+
+        if self._loopdim is not None:
+            nsteps = self._npoints / self._mulsize
+            loopshape = self._loopsizes + [nsteps]
+            return nsteps * self._mulsize, self.get_loopdims(), loopshape
+        elif len(self._loopdims) > 0 and self._npoints == self._mulsize:
+            return self._npoints, self.get_loopdims(), list(self._loopsizes)
+        else:
+            return None
+
+class _AsyncWriter(threading.Thread):
+    '''
+    Thread that performs the file operations of a Data object, so that
+    formatting and writing data does not block the measurement.
+    Operations are executed in the order they are queued.
+    '''
+
+    def __init__(self, maxsize):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self._queue = Queue.Queue(maxsize)
+        self._lag = 0
+        self._max_lag = 0
+        self.start()
+
+    def put(self, func, *args):
+        '''Queue func(*args). Blocks when the queue is full.'''
+        self._queue.put((time.time(), func, args))
+
+    def run(self):
+        while True:
+            t, func, args = self._queue.get()
+            try:
+                if func is None:
+                    return
+                func(*args)
+            except Exception, e:
+                logging.error('Error writing data: %s', e)
+            finally:
+                self._lag = time.time() - t
+                if self._lag > self._max_lag:
+                    self._max_lag = self._lag
+                self._queue.task_done()
+
+    def drain(self):
+        '''Wait until all queued operations are done.'''
+        self._queue.join()
+
+    def stop(self):
+        '''Finish all queued operations and stop the thread.'''
+        self._queue.put((time.time(), None, ()))
+        self.join()
+
+    def get_queue_depth(self):
+        return self._queue.qsize()
+
+    def get_lag(self):
+        '''
+        Return the time between queueing and finishing the last operation
+        and the maximum of this time.
+        '''
+        return self._lag, self._max_lag
+
 class Data(SharedGObject):
     '''
     Data class
@@ -210,6 +464,22 @@ class Data(SharedGObject):
             numpy.int16, numpy.int32, numpy.int64,
     )
 
+    # Number of rows formatted with a single %-operation
+    _WRITE_CHUNK = 4096
+
+    _FLUSH_POLICIES = ('always', 'points', 'interval', 'block')
+
+    _FILE_FORMATS = ('text', 'binary', 'hdf5')
+
+    # File extensions of the formats that store the data as arrays
+    _ARRAY_FILE_EXTS = {
+        'binary': binarydata.EXT,
+        'hdf5': hdf5data.EXT,
+    }
+
+    # Approximate number of bytes read at once by the chunked file loader
+    _LOAD_CHUNK = 1 << 22
+
     def __init__(self, *args, **kwargs):
         '''
         Create data object. There are three different uses:
@@ -235,6 +505,35 @@ class Data(SharedGObject):
             tempfile (bool), default False. If True create a temporary file
                 for the data.
             binary (bool), default True. Whether tempfile should be binary.
+            flush (string), when to flush the data file to disk, default
+                is 'data_flush' from config, or 'always' if not defined:
+                'always': after every write of data point(s)
+                'points': every <flush_points> data points
+                'interval': at most every <flush_interval> seconds
+                'block': at new_block() and close_file()
+            flush_points (int), default 'data_flush_points' from config,
+                or 100 if not defined.
+            flush_interval (float), in seconds, default
+                'data_flush_interval' from config, or 1.0 if not defined.
+            flush_max_age (float), in seconds, for the 'points' and 'block'
+                policies the longest time data stays unflushed, default
+                'data_flush_max_age' from config, or 10.0 if not defined.
+            file_format (string), 'text' for .dat files, 'binary' for
+                memory-mappable .qtb files (see lib.file_support.binarydata)
+                or 'hdf5' for .hdf5 files (see lib.file_support.hdf5data),
+                default is 'data_file_format' from config, or 'text'.
+            hdf5_compression (string), compression filter for hdf5 files,
+                e.g. 'gzip' or 'lzf', default is 'data_hdf5_compression'
+                from config, or None.
+            async_write (bool), whether to format and write data in a
+                separate thread, default is 'data_async_write' from config,
+                or False if not defined.
+            write_queue_size (int), maximum number of queued write
+                operations when async_write is True, default is
+                'data_write_queue_size' from config, or 1000.
+            drain_on_block (bool), whether new_block() waits until all
+                queued writes are done when async_write is True, default
+                is 'data_drain_on_block' from config, or True.
         '''
 
         # Init SharedGObject a bit lower
@@ -248,15 +547,47 @@ class Data(SharedGObject):
         self._temp_binary = kwargs.get('binary', True)
         self._options = kwargs
         self._file = None
+        self.set_file_format(kwargs.get('file_format',
+            config.get('data_file_format', 'text')))
+        self._hdf5_compression = kwargs.get('hdf5_compression',
+            config.get('data_hdf5_compression', None))
         self._stop_req_hid = None
 
+        # Preallocated storage behind self._data when adding points
+        self._buffer = None
+
+        # Per-column format strings, built by _compile_formats()
+        self._col_formats = None
+
+        # Writer thread
+        self._async_write = kwargs.get('async_write',
+                config.get('data_async_write', False))
+        self._write_queue_size = kwargs.get('write_queue_size',
+                config.get('data_write_queue_size', 1000))
+        self._drain_on_block = kwargs.get('drain_on_block',
+                config.get('data_drain_on_block', True))
+        self._writer = None
+
+        # File flushing
+        self._flush_hid = None
+        self._unflushed_points = 0
+        self._unflushed_bytes = 0
+        self._last_flush_time = time.time()
+        self._nbytes_written = 0
+        self._nflushes = 0
+        self.set_flush_policy(
+            kwargs.get('flush', config.get('data_flush', 'always')),
+            points=kwargs.get('flush_points',
+                config.get('data_flush_points', 100)),
+            interval=kwargs.get('flush_interval',
+                config.get('data_flush_interval', 1.0)),
+            max_age=kwargs.get('flush_max_age',
+                config.get('data_flush_max_age', 10.0)))
+
         # Dimension info
         self._dimensions = []
         self._block_sizes = []
-        self._loopdims = None
-        self._loopshape = None
-        self._complete = False
-        self._reshaped_data = None
+        self._loop_tracker = None
 
         # Number of coordinate dimensions
         self._ncoordinates = 0
@@ -432,6 +763,7 @@ class Data(SharedGObject):
         '''
 
         if not self._inmem and self._infile:
+            self._drain_writer()
             self._load_file()
 
         if self._inmem:
@@ -495,6 +827,37 @@ class Data(SharedGObject):
         fn, ext = os.path.splitext(self.get_filepath())
         return fn + '.set'
 
+    def set_file_format(self, file_format):
+        '''
+        Set the format of the data file to create: 'text' (.dat),
+        'binary' (.qtb) or 'hdf5' (.hdf5).
+        '''
+
+        if file_format not in self._FILE_FORMATS:
+            raise ValueError('Unknown file format %r, should be one of %r' % \
+                (file_format, self._FILE_FORMATS))
+        self._file_format = file_format
+
+    def get_file_format(self):
+        '''Return the data file format, 'text', 'binary' or 'hdf5'.'''
+        return self._file_format
+
+    def _get_format_for_file(self, filepath):
+        '''Return the file format implied by the extension of filepath.'''
+        ext = os.path.splitext(filepath)[1]
+        for file_format, format_ext in self._ARRAY_FILE_EXTS.iteritems():
+            if ext == format_ext:
+                return file_format
+        return None
+
+    def _open_array_file(self, filepath, mode):
+        '''Open a data file of the current (non-text) format.'''
+        if self._file_format == 'hdf5':
+            return hdf5data.HDF5DataFile(filepath, mode,
+                    compression=self._hdf5_compression)
+        else:
+            return binarydata.BinaryDataFile(filepath, mode)
+
     def is_file_open(self):
         '''Return whether a file is open or not.'''
 
@@ -527,6 +890,8 @@ class Data(SharedGObject):
             kwargs['size'] = 0
         self._ncoordinates += 1
         self._dimensions.append(kwargs)
+        self._col_formats = None
+        self._loop_tracker = None
 
     def add_value(self, name, **kwargs):
         '''
@@ -547,20 +912,174 @@ class Data(SharedGObject):
         kwargs['type'] = 'value'
         self._nvalues += 1
         self._dimensions.append(kwargs)
+        self._col_formats = None
+        self._loop_tracker = None
 
     def add_comment(self, comment):
         '''Add comment to the Data object.'''
         self._comment.append(comment)
-        if self._file is not None:
-            self._file.write('# %s\n' % comment)
+        if self._file is not None and self._file_format == 'text':
+            self._queue_write(self._write, '# %s\n' % comment)
 
     def get_comment(self):
         '''Return the comment for the Data object.'''
         return self._comment
 
+### File flushing
+
+    def set_flush_policy(self, policy, points=None, interval=None,
+            max_age=None):
+        '''
+        Set when the data file is flushed to disk.
+
+        Input:
+            policy (string): one of
+                'always': after every write of data point(s)
+                'points': every <points> data points
+                'interval': at most every <interval> seconds
+                'block': at new_block() and close_file()
+            points (int): number of points for the 'points' policy
+            interval (float): time in seconds for the 'interval' policy
+            max_age (float): time in seconds after which unflushed data is
+                flushed anyway with the 'points' and 'block' policies
+        '''
+
+        if policy not in self._FLUSH_POLICIES:
+            raise ValueError('Unknown flush policy %r, should be one of %r' % \
+                (policy, self._FLUSH_POLICIES))
+
+        self._flush_policy = policy
+        if points is not None:
+            self._flush_points = int(points)
+        if interval is not None:
+            self._flush_interval = float(interval)
+        if max_age is not None:
+            self._flush_max_age = float(max_age)
+
+        if self._file is not None:
+            self._start_flush_timer()
+
+    def get_flush_policy(self):
+        '''Return the flush policy, see set_flush_policy().'''
+        return self._flush_policy
+
+    def get_write_stats(self):
+        '''
+        Return a dictionary with the number of bytes written, the number
+        of flushes done and the number of bytes not flushed yet.
+        When writing asynchronously it also contains the number of queued
+        operations and the writer lag (in seconds, last and maximum).
+        '''
+
+        ret = {
+            'bytes_written': self._nbytes_written,
+            'flushes': self._nflushes,
+            'unflushed_bytes': self._unflushed_bytes,
+            'queue_depth': 0,
+            'writer_lag': 0,
+            'max_writer_lag': 0,
+        }
+        if self._writer is not None:
+            ret['queue_depth'] = self._writer.get_queue_depth()
+            ret['writer_lag'], ret['max_writer_lag'] = self._writer.get_lag()
+        return ret
+
+    def flush(self):
+        '''Flush the data file to disk, after all queued writes.'''
+        self._queue_write(self._do_flush)
+        self._drain_writer()
+
+    def _do_flush(self):
+        if self._file is None:
+            return
+
+        self._file.flush()
+        self._nflushes += 1
+        self._unflushed_points = 0
+        self._unflushed_bytes = 0
+        self._last_flush_time = time.time()
+
+    def _write(self, text, npoints=0):
+        '''
+        Write text to the data file and flush it according to the flush
+        policy. <npoints> is the number of data points contained in text.
+        '''
+
+        self._file.write(text)
+        self._written(len(text), npoints)
+
+    def _written(self, nbytes, npoints):
+        '''
+        Account for <nbytes> written to the data file, containing <npoints>
+        data points, and flush according to the flush policy.
+        '''
+
+        self._nbytes_written += nbytes
+        self._unflushed_bytes += nbytes
+        if npoints == 0:
+            return
+
+        self._unflushed_points += npoints
+        policy = self._flush_policy
+        if policy == 'always':
+            self._do_flush()
+        elif policy == 'points':
+            if self._unflushed_points >= self._flush_points:
+                self._do_flush()
+        elif policy == 'interval':
+            if time.time() - self._last_flush_time >= self._flush_interval:
+                self._do_flush()
+
+    def _queue_write(self, func, *args):
+        '''
+        Execute file operation func(*args), in the writer thread if
+        writing asynchronously.
+        '''
+
+        if self._writer is not None:
+            self._writer.put(func, *args)
+        else:
+            func(*args)
+
+    def _drain_writer(self):
+        '''Wait until all queued file operations are done.'''
+        if self._writer is not None:
+            self._writer.drain()
+
+    def _start_flush_timer(self):
+        '''
+        Make sure data does not stay unflushed for long when no new points
+        arrive or when flushing depends on the number of points or blocks.
+        '''
+
+        self._stop_flush_timer()
+        if self._flush_policy == 'always':
+            return
+        elif self._flush_policy == 'interval':
+            delay = self._flush_interval
+        else:
+            delay = self._flush_max_age
+        self._flush_hid = gobject.timeout_add(int(delay * 1000),
+                self._flush_timer_cb)
+
+    def _stop_flush_timer(self):
+        if self._flush_hid is not None:
+            gobject.source_remove(self._flush_hid)
+            self._flush_hid = None
+
+    def _flush_timer_cb(self):
+        if self._file is None:
+            self._flush_hid = None
+            return False
+
+        if self._unflushed_bytes > 0:
+            self._queue_write(self._do_flush)
+        return True
+
 ### File writing
 
-    def create_file(self, name=None, filepath=None, settings_file=True):
+    def create_file(self, name=None, filepath=None, settings_file=True,
+            append=False):
         '''
         Create a new data file and leave it open. In addition a
         settings file is generated, unless settings_file=False is
@@ -568,6 +1087,10 @@ class Data(SharedGObject):
 
         This function should be called after adding the comment and the
         coordinate and value metadata, because it writes the file header.
+
+        If the file format is 'binary' or 'hdf5' (or filepath has the .qtb
+        or .hdf5 extension) and append is True, new data will be appended
+        to an existing file.
         '''
 
         if name is None and filepath is None:
@@ -575,18 +1098,37 @@ class Data(SharedGObject):
 
         if filepath is None:
             filepath = self._filename_generator.new_filename(self)
+            if self._file_format != 'text':
+                filepath = os.path.splitext(filepath)[0] + \
+                        self._ARRAY_FILE_EXTS[self._file_format]
+        elif self._get_format_for_file(filepath) is not None:
+            self._file_format = self._get_format_for_file(filepath)
 
         self._dir, self._filename = os.path.split(filepath)
-        if not os.path.isdir(self._dir):
+        if self._dir != '' and not os.path.isdir(self._dir):
             os.makedirs(self._dir)
 
         try:
-            self._file = open(self.get_filepath(), 'w+')
-        except:
-            logging.error('Unable to open file')
+            if self._file_format != 'text':
+                if append and os.path.exists(self.get_filepath()):
+                    self._file = self._open_array_file(
+                            self.get_filepath(), 'a')
+                    self._set_file_info(self._file.get_info(),
+                            self._file.get_nrows())
+                else:
+                    self._file = self._open_array_file(
+                            self.get_filepath(), 'w')
+            else:
+                self._file = open(self.get_filepath(), 'w+')
+        except Exception, e:
+            logging.error('Unable to open file: %s', e)
             return False
 
         self._write_header()
+        self._compile_formats()
+        self._start_flush_timer()
+        if self._async_write:
+            self._writer = _AsyncWriter(self._write_queue_size)
 
         if settings_file and in_qtlab:
             self._write_settings_file()
@@ -605,7 +1147,15 @@ class Data(SharedGObject):
         Close open data file.
         '''
 
+        self._stop_flush_timer()
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
         if self._file is not None:
+            if self._file_format != 'text':
+                self._write_header()
+            self._do_flush()
             self._file.close()
             self._file = None
 
@@ -628,62 +1178,165 @@ class Data(SharedGObject):
 
         f.close()
 
+    def _get_file_info(self):
+        '''Return the header info for a binary or hdf5 data file.'''
+
+        return {
+            'filename': self._filename,
+            'timestamp': self._timestamp,
+            'comment': self._comment,
+            'dimensions': self._dimensions,
+            'block_sizes': self._block_sizes,
+        }
+
+    def _set_file_info(self, info, nrows):
+        '''
+        Set the meta data from a binary or hdf5 data file header and the
+        number of rows in the file.
+        '''
+
+        self._comment = info.get('comment', [])
+        self._dimensions = info.get('dimensions', [])
+        self._block_sizes = info.get('block_sizes', [])
+        self._npoints = nrows
+        self._npoints_last_block = max(nrows - sum(self._block_sizes), 0)
+        self._npoints_max_block = max(self._block_sizes + \
+                [self._npoints_last_block])
+        self._count_coord_val_dims()
+
     def _write_header(self):
-        self._file.write('# Filename: %s\n' % self._filename)
-        self._file.write('# Timestamp: %s\n\n' % self._timestamp)
+        if self._file_format != 'text':
+            ncols = self._file.get_ncols()
+            if ncols == 0:
+                ncols = len(self._dimensions)
+            self._file.write_header(self._get_file_info(), ncols)
+            return
+
+        header = '# Filename: %s\n' % self._filename
+        header += '# Timestamp: %s\n\n' % self._timestamp
         for line in self._comment:
-            self._file.write('# %s\n' % line)
+            header += '# %s\n' % line
 
         i = 1
         for dim in self._dimensions:
-            self._file.write('# Column %d:\n' % i)
+            header += '# Column %d:\n' % i
             for key, val in dict_to_ordered_tuples(dim):
-                self._file.write('#\t%s: %s\n' % (key, val))
+                header += '#\t%s: %s\n' % (key, val)
             i += 1
 
-        self._file.write('\n')
+        header += '\n'
+        self._write(header)
 
-    def _format_data_value(self, val, colnum):
-        if type(val) in self._INT_TYPES:
-            return '%d' % val
+    def _compile_formats(self):
+        '''
+        Build the format string for every column from the dimension info.
+        Called when the file is created, so that writing a row only takes
+        a single %-format.
+        '''
 
-        if colnum < len(self._dimensions):
-            opts = self._dimensions[colnum]
+        precision = config.get('default_precision', 12)
+        self._col_formats = []
+        for opts in self._dimensions:
             if 'format' in opts:
-                return opts['format'] % val
+                fmt = opts['format']
             elif 'precision' in opts:
-                format = '%%.%de' % opts['precision']
-                return format % val
+                fmt = '%%.%de' % opts['precision']
+            else:
+                fmt = '%%.%de' % precision
+            self._col_formats.append(fmt)
+        self._default_format = '%%.%de' % precision
+        self._row_formats = {}
 
-        precision = config.get('default_precision', 12)
-        format = '%%.%de' % precision
-        return format % val
+    def _get_row_format(self, intcols):
+        '''
+        Return the format string for a complete line. <intcols> is a tuple
+        of booleans indicating which columns contain integers.
+        '''
 
-    def _write_data_line(self, args):
+        if self._col_formats is None:
+            self._compile_formats()
+
+        fmt = self._row_formats.get(intcols, None)
+        if fmt is None:
+            fmts = []
+            for colnum, isint in enumerate(intcols):
+                if isint:
+                    fmts.append('%d')
+                elif colnum < len(self._col_formats):
+                    fmts.append(self._col_formats[colnum])
+                else:
+                    fmts.append(self._default_format)
+            fmt = '\t'.join(fmts) + '\n'
+            self._row_formats[intcols] = fmt
+
+        return fmt
+
+    def _format_rows(self, rows, intcols=None):
         '''
-        Write a line of data.
-        Args can be a single value or a 1d numpy.array / list / tuple.
+        Format a 2D numpy.array or a sequence of row tuples to text.
+        For an array <intcols> optionally specifies which columns should be
+        formatted as integers.
         '''
 
-        if hasattr(args, '__len__'):
-            if len(args) > 0:
-                line = self._format_data_value(args[0], 0)
-                for colnum in range(1, len(args)):
-                    line += '\t%s' % \
-                            self._format_data_value(args[colnum], colnum)
-            else:
-                line = ''
-        else:
-            line = self._format_data_value(args, 0)
+        if isinstance(rows, numpy.ndarray):
+            if intcols is None:
+                intcols = (rows.dtype.kind in 'iu', ) * rows.shape[1]
+            fmt = self._get_row_format(intcols)
+            text = []
+            for i in range(0, len(rows), self._WRITE_CHUNK):
+                chunk = rows[i:i+self._WRITE_CHUNK]
+                text.append((fmt * len(chunk)) % tuple(chunk.ravel().tolist()))
+            return ''.join(text)
+
+        # A column is only written as integers if it is in every row
+        intcols = [True] * len(rows[0])
+        for row in rows:
+            for i, val in enumerate(row):
+                if intcols[i] and type(val) not in self._INT_TYPES:
+                    intcols[i] = False
+        fmt = self._get_row_format(tuple(intcols))
+        return ''.join([fmt % tuple(row) for row in rows])
+
+    def _write_rows(self, rows):
+        '''
+        Write a batch of lines with a single write.
+        Rows can be a 2d numpy.array or a sequence of 1d tuples / lists.
+        '''
 
-        line += '\n'
+        if len(rows) == 0:
+            return
 
         if self._file is None:
             logging.info('File not opened yet, doing now')
             self.create_file()
 
-        self._file.write(line)
-        self._file.flush()
+        if self._file_format != 'text':
+            self._write_array_rows(rows)
+            return
+
+        self._write(self._format_rows(rows), len(rows))
+
+    def _add_file_block(self, size):
+        if self._file is not None:
+            self._file.add_block(size)
+
+    def _write_array_rows(self, rows):
+        '''Append rows to a binary or hdf5 data file.'''
+        rows = numpy.asarray(rows, dtype=numpy.float64)
+        if rows.shape[1] != self._file.get_ncols():
+            self._file.write_header(self._get_file_info(), rows.shape[1])
+        self._file.append(rows)
+        self._written(rows.nbytes, len(rows))
+
+    def _write_data_line(self, args):
+        '''
+        Write a line of data.
+        Args can be a single value or a 1d numpy.array / list / tuple.
+        '''
+
+        if not hasattr(args, '__len__'):
+            args = (args, )
+        self._write_rows([args])
 
     def _get_block_columns(self):
         blockcols = []
@@ -702,17 +1355,34 @@ class Data(SharedGObject):
             logging.warning('Unable to _write_data() without having it memory')
             return False
 
-        blockcols = self._get_block_columns()
+        data = self._data
+        if len(data) == 0:
+            return
+        if data.ndim == 1:
+            data = data.reshape((len(data), 1))
+
+        if self._file_format != 'text':
+            self._write_array_rows(data)
+            return
+
+        # Start a new block when one of the block columns changes value
+        blockcols = numpy.array(self._get_block_columns()[:data.shape[1]],
+                dtype=bool)
+        if len(data) > 1 and blockcols.any():
+            changed = (data[1:, blockcols] != data[:-1, blockcols]).any(axis=1)
+            bounds = numpy.nonzero(changed)[0] + 1
+        else:
+            bounds = []
 
-        lastvals = None
-        for vals in self._data:
-            if type(vals) is numpy.ndarray and lastvals is not None:
-                for i in range(len(vals)):
-                    if blockcols[i] and vals[i] != lastvals[i]:
-                        self._file.write('\n')
+        text = []
+        start = 0
+        for end in bounds:
+            text.append(self._format_rows(data[start:end]))
+            text.append('\n')
+            start = end
+        text.append(self._format_rows(data[start:]))
 
-            self._write_data_line(vals)
-            lastvals = vals
+        self._write(''.join(text), len(data))
 
     def _write_binary(self):
         if not self._inmem:
@@ -732,7 +1402,7 @@ class Data(SharedGObject):
         if not self.create_file(name=name, filepath=filepath):
             return
 
-        self._write_data()
+        self._queue_write(self._write_data)
         self.close_file()
 
     def create_tempfile(self, path=None):
@@ -744,6 +1414,7 @@ class Data(SharedGObject):
             mode = 'wb'
         else:
             mode = 'w'
+        self._file_format = 'text'
         self._file = temp.File(path, mode=mode, binary=self._temp_binary)
         try:
             if self._temp_binary:
@@ -805,6 +1476,7 @@ class Data(SharedGObject):
         Notes:
         If providing >1 argument, all vectors should have same shape.
         String data is not compatible with 'inmem'.
+        Use add_data_block() to add a complete block of points faster.
 
         Input:
             *args:
@@ -857,38 +1529,30 @@ class Data(SharedGObject):
                 logging.warning('add_data_point(): addint >2d data not supported')
                 return
 
-        # Check if the number of columns is correct.
-        # If the number of columns is not yet specified, then it will be done
-        # (only the first time) according to the data
-
-        if len(self._dimensions) == 0:
-            logging.warning('add_data_point(): no dimensions specified, adding according to data')
-            self._add_missing_dimensions(ncols)
-
-        if ncols < len(self._dimensions):
-            logging.warning('add_data_point(): missing columns (%d < %d)' % \
-                (ncols, len(self._dimensions)))
-            return
-        elif ncols > len(self._dimensions):
-            logging.warning('add_data_point(): too many columns (%d > %d)' % \
-                (ncols, len(self._dimensions)))
+        if not self._check_ncols(ncols, 'add_data_point'):
             return
 
         # At this point 'args' is either:
         #   - a 1d tuple of numbers, for adding a single data point
         #   - a 2d tuple/list/array, for adding >1 data points
+        rows = numpy.reshape(args, (npoints, ncols))
+        self._track_loops(rows)
         if self._inmem:
-            if len(self._data) == 0:
-                self._data = numpy.atleast_2d(args)
-            else:
-                self._data = numpy.append(self._data, [args], axis=0)
+            self._append_rows(rows)
 
         if self._infile:
+            if self._file is None:
+                logging.info('File not opened yet, doing now')
+                self.create_file()
+
+            # Queued data should not change anymore
+            if self._writer is not None:
+                args = self._copy_args(args)
+
             if npoints == 1:
-                self._write_data_line(args)
+                self._queue_write(self._write_data_line, args)
             elif npoints > 1:
-                for i in range(npoints):
-                    self._write_data_line(args[i])
+                self._queue_write(self._write_rows, args)
 
         self._npoints += npoints
         self._npoints_last_block += npoints
@@ -900,15 +1564,174 @@ class Data(SharedGObject):
         else:
             self.emit('new-data-point')
 
+    def _copy_args(self, args):
+        '''
+        Return a copy of the values or rows in args that the caller can not
+        modify anymore, keeping the types of the values.
+        '''
+
+        if isinstance(args, numpy.ndarray):
+            return args.copy()
+        elif type(args) in (types.ListType, types.TupleType):
+            return [self._copy_args(i) for i in args]
+        return args
+
+    def _get_expected_npoints(self):
+        '''
+        Return the total number of points expected from the 'size' / 'steps'
+        info of the coordinate dimensions, or 0 if that is not known.
+        '''
+
+        npoints = 1
+        for info in self.get_coordinates():
+            size = info.get('size', 0) or info.get('steps', 0)
+            if size <= 0:
+                return 0
+            npoints *= size
+        return npoints
+
+    def _append_rows(self, rows):
+        '''
+        Append a 2D array of rows to the in-memory data. self._data is kept
+        as a view of the filled part of a preallocated buffer.
+        '''
+
+        if self._buffer is None or self._buffer.get_ncols() != rows.shape[1]:
+            capacity = max(self._get_expected_npoints(), len(rows))
+            self._buffer = _RowBuffer(rows.shape[1], capacity, rows.dtype)
+            if len(self._data) > 0:
+                self._buffer.append(numpy.atleast_2d(self._data))
+
+        self._data = self._buffer.append(rows)
+
+    def add_data_block(self, *args, **kwargs):
+        '''
+        Add a complete block of data points at once, e.g. a trace from a
+        digitizer or a network analyzer. The block is added to memory in
+        one step and written with a single write, and only a single
+        'new-data-block' signal is emitted.
+
+        provide the block as
+            - N 1d arrays of length M: d.add_data_block(a1, a2, a3)
+        OR
+            - a single MxN 2d array: d.add_data_block(arraydata)
+
+        Input:
+            *args:
+                n column arrays or a 2d array
+            **kwargs:
+                newblock (boolean): start a new block after these points,
+                    default True
+
+        Output:
+            None
+        '''
+
+        newblock = kwargs.get('newblock', True)
+
+        if len(args) == 0:
+            logging.warning('add_data_block(): no data specified')
+            return
+        elif len(args) == 1:
+            block = numpy.asarray(args[0])
+            if block.ndim == 1:
+                block = block.reshape((len(block), 1))
+            elif block.ndim != 2:
+                logging.warning('add_data_block(): adding >2d data not supported')
+                return
+            intcols = (block.dtype.kind in 'iu', ) * block.shape[1]
+        else:
+            cols = [numpy.asarray(a) for a in args]
+            for col in cols:
+                if col.ndim != 1 or len(col) != len(cols[0]):
+                    logging.warning('add_data_block(): columns should be 1d arrays of the same length')
+                    return
+            intcols = tuple([col.dtype.kind in 'iu' for col in cols])
+            block = numpy.column_stack(cols)
+
+        npoints, ncols = block.shape
+        if npoints == 0:
+            return
+        if not self._check_ncols(ncols, 'add_data_block'):
+            return
+
+        self._track_loops(block)
+        if self._inmem:
+            self._append_rows(block)
+
+        if self._infile:
+            if self._file is None:
+                logging.info('File not opened yet, doing now')
+                self.create_file()
+
+            # Queued data should not change anymore
+            if self._writer is not None and len(args) == 1:
+                block = block.copy()
+            self._queue_write(self._write_block, block, intcols, newblock)
+
+        self._npoints += npoints
+        self._npoints_last_block += npoints
+        if self._npoints_last_block > self._npoints_max_block:
+            self._npoints_max_block = self._npoints_last_block
+
+        if newblock:
+            self._close_block()
+        else:
+            self.emit('new-data-point')
+
+    def _write_block(self, block, intcols, newblock):
+        if self._file_format != 'text':
+            self._write_array_rows(block)
+        else:
+            text = self._format_rows(block, intcols)
+            if newblock:
+                text += '\n'
+            self._write(text, len(block))
+
+    def _check_ncols(self, ncols, funcname):
+        '''
+        Check if the number of columns is correct.
+        If the number of columns is not yet specified, then it will be done
+        (only the first time) according to the data
+        '''
+
+        if len(self._dimensions) == 0:
+            logging.warning('%s(): no dimensions specified, adding according to data', funcname)
+            self._add_missing_dimensions(ncols)
+
+        if ncols < len(self._dimensions):
+            logging.warning('%s(): missing columns (%d < %d)' % \
+                (funcname, ncols, len(self._dimensions)))
+            return False
+        elif ncols > len(self._dimensions):
+            logging.warning('%s(): too many columns (%d > %d)' % \
+                (funcname, ncols, len(self._dimensions)))
+            return False
+
+        return True
+
     def new_block(self):
         '''Start a new data block.'''
 
-        if self._infile:
-            self._file.write('\n')
+        if self._infile and self._file_format == 'text':
+            self._queue_write(self._write, '\n')
+        self._close_block()
 
-        self._block_sizes.append(self._npoints_last_block)
+    def _close_block(self):
+        size = self._npoints_last_block
+        self._block_sizes.append(size)
         self._npoints_last_block = 0
 
+        if self._infile:
+            # Binary files get the block sizes in the header on close,
+            # hdf5 files have a data set to append them to
+            if self._file_format == 'hdf5':
+                self._queue_write(self._add_file_block, size)
+            if self._flush_policy == 'block':
+                self._queue_write(self._do_flush)
+            if self._drain_on_block:
+                self._drain_writer()
+
         self.emit('new-data-block')
 
     def _add_missing_dimensions(self, nfields):
@@ -942,6 +1765,7 @@ class Data(SharedGObject):
         if not isinstance(data, numpy.ndarray):
             data = numpy.array(data)
         self._data = data
+        self._buffer = None
         self._inmem = True
         self._infile = False
         self._npoints = len(self._data)
@@ -981,6 +1805,8 @@ class Data(SharedGObject):
                         else:
                             break
 
+            self._loop_tracker = None
+
     def update_data(self, data):
         '''
         Update this Data object with a new data set.
@@ -988,6 +1814,8 @@ class Data(SharedGObject):
         If the data is associated with a temporary file, it will be updated.
         '''
         self._data = data
+        self._buffer = None
+        self._loop_tracker = None
         if self._tempfile:
             self.rewrite_tempfile()
 
@@ -1005,9 +1833,15 @@ class Data(SharedGObject):
             self._nvalues = 1
             self._ncoordinates -= 1
 
-    def _load_file(self):
+    def _load_file(self, fast=None):
         """
         Load data from file and store internally.
+
+        If fast is True the numerical data is parsed in chunks with numpy,
+        otherwise line by line. The default is 'data_fast_load' from config,
+        or True if not defined. If fast parsing fails (e.g. because not
+        all lines have the same number of columns), the file is parsed
+        line by line.
         """
 
         try:
@@ -1016,17 +1850,104 @@ class Data(SharedGObject):
             logging.warning('Unable to open file %s' % self.get_filepath())
             return False
 
+        if binarydata.is_binary_file(self.get_filepath()):
+            f.close()
+            return self._load_array_file('binary')
+        elif hdf5data.is_hdf5_file(self.get_filepath()):
+            f.close()
+            return self._load_array_file('hdf5')
+
+        if fast is None:
+            fast = config.get('data_fast_load', True)
+
+        try:
+            if fast:
+                try:
+                    data, nfields, blocksize = self._parse_file_chunked(f)
+                except ValueError, e:
+                    logging.warning('Fast loading of %s failed (%s), parsing line by line',
+                        self.get_filepath(), e)
+                    f.seek(0)
+                    fast = False
+
+            if not fast:
+                data, nfields, blocksize = self._parse_file_lines(f)
+        finally:
+            f.close()
+
+        self._add_missing_dimensions(nfields)
+        self._count_coord_val_dims()
+
+        self._data = data
+        self._npoints = len(self._data)
+        self._inmem = True
+
+        self._npoints_last_block = blocksize
+
+        try:
+            self._detect_dimensions_size()
+        except Exception, e:
+            logging.warning('Error while detecting dimension size')
+
+        return True
+
+    def _load_array_file(self, file_format):
+        '''
+        Load a binary or hdf5 data file. Binary data is memory-mapped, so
+        it is not read into memory until it is accessed.
+        '''
+
+        self._file_format = file_format
+        try:
+            f = self._open_array_file(self.get_filepath(), 'r')
+        except Exception, e:
+            logging.warning('Unable to open %s file %s: %s',
+                    file_format, self.get_filepath(), e)
+            return False
+
+        self._reset_load_info()
+        self._data = f.get_data()
+        self._buffer = None
+        self._set_file_info(f.get_info(), len(self._data))
+        f.close()
+
+        self._add_missing_dimensions(self._data.shape[1])
+        self._count_coord_val_dims()
+        self._inmem = True
+
+        try:
+            self._detect_dimensions_size()
+        except Exception, e:
+            logging.warning('Error while detecting dimension size')
+
+        return True
+
+    def _reset_load_info(self):
+        self._loop_tracker = None
         self._dimensions = []
+        self._col_formats = None
         self._values = []
         self._comment = []
-        data = []
-        nfields = 0
 
         self._block_sizes = []
         self._npoints = 0
         self._npoints_last_block = 0
         self._npoints_max_block = 0
 
+    def _end_block(self, blocksize):
+        self._block_sizes.append(blocksize)
+        if blocksize > self._npoints_max_block:
+            self._npoints_max_block = blocksize
+
+    def _parse_file_lines(self, f):
+        '''
+        Parse file f line by line.
+        Returns a tuple (data array, number of columns, size of last block).
+        '''
+
+        self._reset_load_info()
+        data = []
+        nfields = 0
         blocksize = 0
 
         for line in f:
@@ -1034,9 +1955,7 @@ class Data(SharedGObject):
 
             # Count blocks
             if len(line) == 0 and len(data) > 0:
-                self._block_sizes.append(blocksize)
-                if blocksize > self._npoints_max_block:
-                    self._npoints_max_block = blocksize
+                self._end_block(blocksize)
                 blocksize = 0
 
             # Strip comment
@@ -1054,21 +1973,73 @@ class Data(SharedGObject):
                 data.append(fields)
                 blocksize += 1
 
-        self._add_missing_dimensions(nfields)
-        self._count_coord_val_dims()
+        self._buffer = None
+        return numpy.array(data), nfields, blocksize
 
-        self._data = numpy.array(data)
-        self._npoints = len(self._data)
-        self._inmem = True
+    def _parse_file_chunked(self, f):
+        '''
+        Parse file f in chunks of lines. Only comment lines are handled
+        individually, the numerical lines of a chunk are converted with
+        a single numpy call into a preallocated float64 buffer. Block
+        boundaries are found in the same pass.
+
+        Returns a tuple (data array, number of columns, size of last block).
+        Raises ValueError if not all lines contain the same number of
+        columns.
+        '''
 
-        self._npoints_last_block = blocksize
+        self._reset_load_info()
+        filesize = os.fstat(f.fileno()).st_size
+        buf = None
+        nfields = 0
+        nrows = 0
+        blocksize = 0
 
-        try:
-            self._detect_dimensions_size()
-        except Exception, e:
-            logging.warning('Error while detecting dimension size')
+        while True:
+            lines = f.readlines(self._LOAD_CHUNK)
+            if len(lines) == 0:
+                break
 
-        return True
+            # Numerical lines; a block ends at index 'mark' of this list
+            numeric = []
+            mark = 0
+            for line in lines:
+                if line.isspace():
+                    if nrows + len(numeric) > 0:
+                        self._end_block(blocksize + len(numeric) - mark)
+                        blocksize = 0
+                        mark = len(numeric)
+
+                elif '#' in line:
+                    self._parse_meta_data(line.rstrip(' \n\t\r'))
+                    line = line[:line.find('#')]
+                    if len(line.strip()) > 0:
+                        numeric.append(line + '\n')
+
+                else:
+                    numeric.append(line)
+
+            blocksize += len(numeric) - mark
+            nrows += len(numeric)
+            if len(numeric) == 0:
+                continue
+
+            if buf is None:
+                nfields = len(numeric[0].split())
+                linesize = float(sum([len(l) for l in numeric])) / len(numeric)
+                buf = _RowBuffer(nfields, 1.05 * filesize / linesize)
+
+            vals = numpy.fromstring(''.join(numeric), sep=' ')
+            if len(vals) != len(numeric) * nfields:
+                raise ValueError('inconsistent number of columns')
+            buf.append(vals.reshape((len(numeric), nfields)))
+
+        if buf is None:
+            self._buffer = None
+            return numpy.array([]), nfields, blocksize
+
+        self._buffer = buf
+        return buf.get_view(), nfields, blocksize
 
     def _type_added(self, name):
         if name == 'coordinate':
@@ -1113,27 +2084,63 @@ class Data(SharedGObject):
         if m is not None:
             self._comment.append(m.group(1))
 
+    def _get_loop_tracker(self):
+        '''
+        Return the loop tracker, creating it from the data in memory if
+        necessary.
+        '''
+
+        if self._loop_tracker is None:
+            self._loop_tracker = _LoopTracker(self.get_ncoordinates())
+            if self._inmem and len(self._data) > 0:
+                self._loop_tracker.add_rows(numpy.atleast_2d(self._data))
+        return self._loop_tracker
+
+    def _track_loops(self, rows):
+        '''Update the loop structure with newly added rows.'''
+
+        tracker = self._get_loop_tracker()
+        nclosed = tracker.get_nloops_closed()
+        tracker.add_rows(rows)
+        if tracker.get_nloops_closed() == nclosed:
+            return
+
+        # Store sizes of loops that are finished
+        for colnum, start, size, end in tracker.get_loopinfo(closed_only=True):
+            opt = self._dimensions[colnum]
+            opt['start'] = start
+            opt['size'] = size
+            opt['end'] = end
+
     def _reshape_data(self):
         '''
         Return a reshaped version of the data. This is not guaranteed to be
         a view to the same data object.
+
+        While a measurement is running only the complete part of the
+        'hyper-rectangle' is returned, i.e. the outer loop contains only
+        the steps that are finished.
         '''
 
-        if self._reshaped_data is not None:
-            return self._reshaped_data
+        tracker = self._get_loop_tracker()
+        if tracker.get_npoints() != len(self._data):
+            self._loop_tracker = None
+            tracker = self._get_loop_tracker()
 
-        loopdims = copy.copy(self._loopdims)
-        newshape = copy.copy(self._loopshape)
-        if not self._complete or None in (loopdims, newshape):
+        shapeinfo = tracker.get_complete_shape()
+        if shapeinfo is None:
             return None
 
-        data = self._data
+        nrows, loopdims, newshape = shapeinfo
+        data = self._data[:nrows]
 
+        # Loops that are not detected yet are outside the detected ones
+        ncoords = self.get_ncoordinates()
         cshape_ok, fshape_ok = True, True
         for i in range(len(loopdims)):
             if loopdims[i] != i:
                 fshape_ok = False
-            if loopdims[i] != len(loopdims) - i -1:
+            if loopdims[i] != ncoords - i -1:
                 cshape_ok = False
 
         if not cshape_ok and not fshape_ok:
@@ -1145,11 +2152,10 @@ class Data(SharedGObject):
 
             # Swap axes if necessary
             if fshape_ok:
-                for i in range(self.get_ncoordinates() - 1):
+                for i in range(len(loopdims) - 1):
                     data = data.swapaxes(i, i + 1)
 
-        self._reshaped_data = data
-        return self._reshaped_data
+        return data
 
     def _detect_dimensions_size(self):
         data = self._data
@@ -1159,46 +2165,18 @@ class Data(SharedGObject):
                 self._dimensions[colnum]['size'] = len(data)
             return
 
-        loopdims = []
-        newshape = []
-        mulsize = 1
-        firstloopdim = None
-        for iter in range(ncoords):
-            loopdim = None
-            for colnum in range(ncoords):
-                if mulsize >= len(data):
-                    continue
-
-                if data[0, colnum] != data[mulsize, colnum]:
-                    loopdim = colnum
-                    loopdims.append(loopdim)
-                    loopstart = data[0, loopdim]
-                    break
-
-            if loopdim is None:
-                break
+        tracker = _LoopTracker(ncoords)
+        tracker.add_rows(data)
+        self._loop_tracker = tracker
 
+        firstloopdim = None
+        for colnum, start, size, end in tracker.get_loopinfo():
             if firstloopdim is None:
-                firstloopdim = loopdim
-
-            i = 1
-            while i * mulsize < len(data):
-                if data[i * mulsize, loopdim] == loopstart:
-                    break
-                i += 1
-
-            opt = self._dimensions[loopdim]
-            opt['start'] = loopstart
-            opt['size'] = i
-            opt['end'] = data[mulsize * (i - 1), loopdim]
-            newshape.append(i)
-
-            mulsize *= i
-
-        complete = len(self._data) == mulsize
-        self._loopdims = loopdims
-        self._loopshape = newshape
-        self._complete = complete
+                firstloopdim = colnum
+            opt = self._dimensions[colnum]
+            opt['start'] = start
+            opt['size'] = size
+            opt['end'] = end
 
         # Determine number of blocks
         bs = self._dimensions[firstloopdim]['size']
@@ -1208,7 +2186,7 @@ class Data(SharedGObject):
             else:
                 self._block_sizes = [bs] * (int(len(data) / bs) + 1)
 
-        return complete
+        return tracker.is_complete()
 
     def set_filepath(self, fp, inmem=True):
         '''
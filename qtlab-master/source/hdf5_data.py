@@ -59,8 +59,17 @@ class DataGroup(SharedGObject):
     At the moment this does not have too many improvements over using just the
     bare container, but the concept should be useful for plotting, ensuring
     correct dimensionalities, etc.
+
+    Dimensions added without data are chunked, resizable datasets that can
+    be filled while measuring with add_data_point(), in the same way as a
+    Data object.
     """
 
+    # Dataset creation options, the rest of the keywords is meta data
+    _DATASET_OPTIONS = ('chunks', 'compression', 'compression_opts', 'dtype')
+
+    _DEFAULT_CHUNK_SIZE = 1024
+
     def __init__(self, name, hdf5_data, base='/', **kw):
         self.name = name
         self.h5d = hdf5_data._file
@@ -70,7 +79,7 @@ class DataGroup(SharedGObject):
         self._folder = hdf5_data.get_folder()
 
         if self.name in self.h5d[base].keys():
-            self.group = self.h5d[base]
+            self.group = self.h5d[self.groupname]
         else:
             self.group = self.h5d.create_group(self.groupname)
 
@@ -78,18 +87,44 @@ class DataGroup(SharedGObject):
         for k in kw:
             self.group.attrs[k] = kw[k]
 
+        self._stream_options = {
+            'chunks': None,
+            'compression': None,
+            'compression_opts': None,
+        }
+
+        # Names of the dimensions filled by add_data_point()
+        self._stream_dims = [str(n) for n in
+                self.group.attrs.get('stream_dimensions', [])]
+
+        # Number of points in the completed blocks, see new_block()
+        self._block_points = None
+
     def __getitem__(self, name):
         return self.group[name].value
 
     def __setitem__(self, name, val):
         if name in self.group.keys():
+            dset = self.group[name]
+            val = np.asarray(val)
+
+            # Write in place if the shape fits and the data set can hold
+            # the type, e.g. not floats in an integer data set
+            if np.can_cast(val.dtype, dset.dtype, 'same_kind'):
+                if dset.shape == val.shape:
+                    dset[...] = val
+                    return True
+                elif self._is_resizable(dset, val.shape):
+                    dset.resize(val.shape)
+                    dset[...] = val
+                    return True
 
             # store old attributes
-            attrs = dict(self.group[name].attrs)
+            attrs = dict(dset.attrs)
 
-            # delete and re-create; overwrite doesn't work with hdf5
+            # delete and re-create as a resizable data set
             del self.group[name]
-            dim = self.group.create_dataset(name, data=val)
+            dim = self._create_dataset(name, val, {})
             for k, v in attrs.iteritems():
                 dim.attrs[k] = v
 
@@ -107,11 +142,70 @@ class DataGroup(SharedGObject):
     def get_folder(self):
         return self._folder
 
+    def set_stream_options(self, chunks=None, compression=None,
+            compression_opts=None):
+        '''
+        Set the default options for data sets created in this group.
+
+        Input:
+            chunks (tuple): chunk shape, default is (1024, ) for streaming
+                dimensions and automatic for others
+            compression (string): e.g. 'gzip' or 'lzf', default None
+            compression_opts: compression settings, e.g. level for 'gzip'
+        '''
+
+        self._stream_options['chunks'] = chunks
+        self._stream_options['compression'] = compression
+        self._stream_options['compression_opts'] = compression_opts
+
+    def _is_resizable(self, dset, shape):
+        # Only chunked data sets can be resized
+        if dset.chunks is None:
+            return False
+        if dset.maxshape is None or len(dset.maxshape) != len(shape):
+            return False
+        for maxsize, size in zip(dset.maxshape, shape):
+            if maxsize is not None and maxsize < size:
+                return False
+        return True
+
+    def _create_dataset(self, name, data, opts):
+        '''
+        Create a chunked data set that can be resized along the first axis.
+        If data is None an empty 1D data set is created.
+        '''
+
+        kwargs = dict(self._stream_options)
+        kwargs.update(opts)
+
+        if data is None:
+            if kwargs['chunks'] is None:
+                kwargs['chunks'] = (self._DEFAULT_CHUNK_SIZE, )
+            kwargs.setdefault('dtype', 'f8')
+            return self.group.create_dataset(name, shape=(0, ),
+                    maxshape=(None, ), **kwargs)
+
+        data = np.asarray(data)
+        if data.ndim == 0:
+            return self.group.create_dataset(name, data=data)
+
+        if kwargs['chunks'] is None:
+            kwargs['chunks'] = True
+        return self.group.create_dataset(name, data=data,
+                maxshape=(None, ) + data.shape[1:], **kwargs)
+
     def add_dimension(self, name, dim_type, data, **meta):
         '''
         Add a dimension to the data group.
         dim_type is not restricted, but 'coordinate' and 'value' should be
         used to specify what the dimension represents.
+
+        If data is None, an empty resizable data set is created that can be
+        filled with add_data_point(). Note that older versions stored a
+        single NaN in that case.
+
+        The keywords 'chunks', 'compression', 'compression_opts' and 'dtype'
+        are used as options for the data set (see also set_stream_options()).
         Extra keywords are added as meta data.
         '''
 
@@ -120,15 +214,21 @@ class DataGroup(SharedGObject):
                     % (name, self.name))
             return False
 
-        if data is None:
-            data = np.array([np.NaN])
+        opts = {}
+        for k in self._DATASET_OPTIONS:
+            if k in meta:
+                opts[k] = meta.pop(k)
 
-        dim = self.group.create_dataset(name, data=data)
+        dim = self._create_dataset(name, data, opts)
         dim.attrs['dim_type'] = dim_type
 
         for k in meta:
             dim.attrs[k] = meta[k]
 
+        if data is None:
+            self._stream_dims.append(name)
+            self.group.attrs['stream_dimensions'] = self._stream_dims
+
         return True
 
     def add(self, name, data=None, **meta):
@@ -152,6 +252,87 @@ class DataGroup(SharedGObject):
         '''
         return self.add_dimension(name, 'value', data, **meta)
 
+    def get_npoints(self):
+        '''Return the number of points added with add_data_point().'''
+        if len(self._stream_dims) == 0:
+            return 0
+        return len(self.group[self._stream_dims[0]])
+
+    def add_data_point(self, *args, **kwargs):
+        '''
+        Append data point(s) to the dimensions that were added without
+        data, in the order in which they were added. The data sets are
+        resized in place, so only the new points are written.
+
+        provide 1 data point
+            - N numbers: g.add_data_point(1, 2, 3)
+
+        OR
+
+        provide >1 data points.
+            - a single MxN 2d array: g.add_data_point(arraydata)
+            - N 1d arrays of length M: g.add_data_point(a1, a2, a3)
+
+        Input:
+            *args:
+                n column values or a 2d array
+            **kwargs:
+                newblock (boolean): marks a new 'block' starts after this point
+
+        Output:
+            True if successful, False otherwise
+        '''
+
+        if len(args) == 0:
+            logging.warning('add_data_point(): no data specified')
+            return False
+        elif len(args) == 1 and np.ndim(args[0]) == 2:
+            cols = list(np.asarray(args[0]).T)
+        else:
+            cols = [np.atleast_1d(a) for a in args]
+
+        if len(cols) != len(self._stream_dims):
+            logging.warning('add_data_point(): got %d columns, expected %d' \
+                    % (len(cols), len(self._stream_dims)))
+            return False
+
+        npoints = len(cols[0])
+        for col in cols:
+            if col.ndim != 1 or len(col) != npoints:
+                logging.warning('add_data_point(): not all provided data arguments have same shape')
+                return False
+
+        start = self.get_npoints()
+        for name, col in zip(self._stream_dims, cols):
+            dset = self.group[name]
+            dset.resize((start + npoints, ))
+            dset[start:] = col
+
+        if kwargs.get('newblock', False):
+            self.new_block()
+
+        return True
+
+    def new_block(self):
+        '''
+        Start a new data block. The block sizes are stored in the data set
+        'block_sizes' of the group.
+        '''
+
+        if 'block_sizes' not in self.group.keys():
+            self.group.create_dataset('block_sizes', shape=(0, ),
+                    maxshape=(None, ), dtype='i8', chunks=(256, ))
+
+        dset = self.group['block_sizes']
+        if self._block_points is None:
+            self._block_points = int(np.sum(dset[...]))
+
+        nblocks = len(dset)
+        size = self.get_npoints() - self._block_points
+        dset.resize((nblocks + 1, ))
+        dset[nblocks] = size
+        self._block_points += size
+
     def loop1d_data(self, *args, **kwargs):
         kwargs['group'] = self
         return loop1d_data(*args, **kwargs)
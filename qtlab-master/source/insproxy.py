@@ -95,3 +95,36 @@ class Proxy():
             if hasattr(self, func):
                 delattr(self, func)
 
+
+class LazyProxy():
+    '''
+    Stand-in for an instrument created with qt.instruments.create(...,
+    lazy=True). The driver is imported and the instrument is created on
+    first access of any function or attribute other than get_name() and
+    get_type().
+    '''
+
+    def __init__(self, name, instype):
+        self._name = name
+        self._instype = instype
+
+    def __repr__(self):
+        return "<Lazy instrument '%s' (%s)>" % (self._name, self._instype)
+
+    def get_name(self):
+        return self._name
+
+    def get_type(self):
+        return self._instype
+
+    def is_initialized(self):
+        '''Return whether the instrument has been created.'''
+        return not qt.instruments.is_pending(self._name)
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        proxy = qt.instruments.realize(self._name)
+        if proxy is None:
+            raise AttributeError('Instrument %s not available' % self._name)
+        return getattr(proxy, attr)
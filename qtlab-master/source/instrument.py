@@ -21,9 +21,12 @@ import copy
 import time
 import math
 import inspect
+import weakref
 from gettext import gettext as _L
-from lib import calltimer
+from lib import calltimer, callstats
+from lib.ramp import Ramp, get_ramp_scheduler
 from lib.network.object_sharer import SharedGObject, cache_result
+from lib.network import object_sharer as objsh
 
 import numpy as np
 import logging
@@ -32,6 +35,23 @@ import qt
 from lib.config import get_config
 config = get_config()
 
+# Instruments with subscriptions of remote connections
+_subscribed_instruments = weakref.WeakKeyDictionary()
+_subscription_cb_registered = False
+
+def _connection_closed_cb(conn):
+    for ins in _subscribed_instruments.keys():
+        ins._remove_connection_subscriptions(conn)
+
+def _track_subscriptions(ins):
+    '''Remove the subscriptions of ins when a connection is closed.'''
+    global _subscription_cb_registered
+    if not _subscription_cb_registered:
+        objsh.helper.register_event_callback('connection-closed',
+                _connection_closed_cb)
+        _subscription_cb_registered = True
+    _subscribed_instruments[ins] = True
+
 class Instrument(SharedGObject):
     """
     Base class for instruments.
@@ -43,6 +63,13 @@ class Instrument(SharedGObject):
     Implement an instrument:
     In __init__ call self.add_variable(<name>, <option dict>)
     Implement _do_get_<variable> and _do_set_<variable> functions
+
+    Optionally implement _do_get_many(names) and _do_set_many(values) to
+    get or set several parameters in a single transaction with the device.
+    _do_get_many(names) should return a dictionary of parameter -> value
+    for the parameters it could read, _do_set_many(values) receives a
+    dictionary of parameter -> value and should return a list of the
+    parameters it has set. The remaining parameters are handled one by one.
     """
 
     __gsignals__ = {
@@ -94,6 +121,15 @@ class Instrument(SharedGObject):
 
         self._changed = {}
         self._changed_hid = None
+        self._changed_last = 0
+        self._changed_interval = config.get('instrument_changed_interval', 0)
+        self._changed_stats = {'queued': 0, 'emitted': 0, 'coalesced': 0,
+                'filtered': 0}
+        self._subscriptions = {}
+        self._conn_subscriptions = {}
+
+        self._cache_hits = 0
+        self._cache_misses = 0
 
         self._options = kwargs
         if 'tags' not in self._options:
@@ -101,6 +137,16 @@ class Instrument(SharedGObject):
 
         self._parameters = {}
         self._parameter_groups = {}
+
+        # Compiled accessors, see _compile_accessors()
+        self._getters = {}
+        self._setters = {}
+
+        # Driver get / set functions, wrapped for statistics if enabled
+        self._drv_get = {}
+        self._drv_set = {}
+        self._stats = {}
+        self._stats_enabled = config.get('instrument_stats', False)
         self._functions = {}
         self._added_methods = []
         self._probe_ids = []
@@ -243,7 +289,8 @@ class Instrument(SharedGObject):
                 minval, maxval: values for bound checking
                 units (string): units for this parameter
                 maxstep (float): maximum step size when changing parameter
-                stepdelay (float): delay when setting steps (in milliseconds)
+                stepdelay (float): delay when setting steps (in milliseconds),
+                    default 50. Ramps are performed by lib.ramp.
                 tags (array): tags for this parameter
                 doc (string): documentation string to add to get/set functions
                 format_map (dict): map describing allowed options and the
@@ -255,6 +302,11 @@ class Instrument(SharedGObject):
                     to watch. If any of them changes, execute a get for this
                     parameter. Useful for a parameter that depends on one
                     (or more) other parameters.
+                cache_ttl (float): time in seconds that a value read from
+                    the instrument remains valid. Gets within this time
+                    return the stored value without querying the device.
+                    The value is invalidated by a set, by a change of a
+                    parameter in listen_to and by invalidate_cache().
 
         Output: None
         '''
@@ -308,12 +360,7 @@ class Instrument(SharedGObject):
         base_name = kwargs.get('base_name', name)
 
         if options['flags'] & Instrument.FLAG_GET:
-            if ch is not None:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=query, channel=ch, **lopts)
-            else:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=query, **lopts)
+            func = self._make_get_wrapper(name, ch, True)
 
             self._add_options_to_doc(options)
             func.__doc__ = 'Get variable %s' % name
@@ -337,22 +384,14 @@ class Instrument(SharedGObject):
                 self._get_not_implemented(base_name)
 
         if options['flags'] & Instrument.FLAG_SOFTGET:
-            if ch is not None:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=False, channel=ch, **lopts)
-            else:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=False, **lopts)
+            func = self._make_get_wrapper(name, ch, False)
 
             func.__doc__ = 'Get variable %s (internal stored value)' % name
             setattr(self, 'get_%s' % name,  func)
             self._added_methods.append('get_%s' % name)
 
         if options['flags'] & Instrument.FLAG_SET:
-            if ch is not None:
-                func = lambda val, **lopts: self.set(name, val, channel=ch, **lopts)
-            else:
-                func = lambda val, **lopts: self.set(name, val, **lopts)
+            func = self._make_set_wrapper(name, ch)
 
             func.__doc__ = 'Set variable %s' % name
             if 'doc' in options:
@@ -393,7 +432,7 @@ class Instrument(SharedGObject):
             for (ins, param) in options['listen_to']:
                 inshids.append(ins.connect('changed', \
                         self._listen_parameter_changed_cb,
-                        param, options['get_func']))
+                        param, options['get_func'], name))
             options['listed_hids'] = inshids
 
         if 'group' in options:
@@ -403,8 +442,214 @@ class Instrument(SharedGObject):
             else:
                 self._parameter_groups[g].append(name)
 
+        self._compile_accessors(name)
         self.emit('parameter-added', name)
 
+    def _make_get_wrapper(self, name, ch, query_default):
+        '''
+        Return the get_<name> function. Without extra options it calls the
+        compiled getter directly, otherwise it goes through get().
+        '''
+
+        getters = self._getters
+
+        def func(query=True, fast=False, **lopts):
+            if not query_default:
+                query = False
+            if lopts or Instrument.USE_ACCESS_LOCK:
+                if ch is not None:
+                    lopts['channel'] = ch
+                return self.get(name, query=query, fast=fast, **lopts)
+
+            value = getters[name](query)
+            if query and not fast:
+                self._queue_changed_value(name, value)
+            return value
+
+        return func
+
+    def _make_set_wrapper(self, name, ch):
+        '''
+        Return the set_<name> function. Without extra options it calls the
+        compiled setter directly, otherwise it goes through set().
+        '''
+
+        setters = self._setters
+
+        def func(val, fast=False, **lopts):
+            setter = setters.get(name, None)
+            if lopts or setter is None or self._locked or \
+                    Instrument.USE_ACCESS_LOCK:
+                if ch is not None:
+                    lopts['channel'] = ch
+                return self.set(name, val, fast=fast, **lopts)
+
+            val = setter(val)
+            if val is None:
+                return False
+            if not fast:
+                self._queue_changed_value(name, val)
+            return True
+
+        return func
+
+    # Cast functions for values returned by the driver
+    _CAST_MAP = {
+            types.IntType: int,
+            types.FloatType: float,
+            types.BooleanType: bool,
+            np.ndarray: np.array,
+    }
+
+    def _compile_accessors(self, name):
+        '''
+        Build the getter and setter functions for parameter <name>, with
+        the channel, type conversion, bounds, etc. resolved up front. This
+        is done when the parameter is added and when its options change.
+        '''
+
+        p = self._parameters[name]
+        self._drv_get[name] = self._wrap_stats(name, 'get',
+                p.get('get_func', None))
+        self._drv_set[name] = self._wrap_stats(name, 'set',
+                p.get('set_func', None))
+
+        self._getters[name] = self._compile_getter(name)
+        setter = self._compile_setter(name)
+        if setter is not None:
+            self._setters[name] = setter
+        elif name in self._setters:
+            del self._setters[name]
+
+    def _compile_getter(self, name):
+        '''
+        Return a function get(query) equivalent to _get_value(name, query)
+        without extra options.
+        '''
+
+        p = self._parameters[name]
+        flags = p['flags']
+        softget = bool(flags & Instrument.FLAG_SOFTGET)
+        canget = bool(flags & Instrument.FLAG_GET)
+        ptype = p['type']
+        cast = self._CAST_MAP.get(ptype, None)
+        ttl = p.get('cache_ttl', None)
+        getfunc = self._drv_get[name]
+        chkw = {}
+        if 'channel' in p:
+            chkw['channel'] = p['channel']
+        is_cache_valid = self._is_cache_valid
+        timefunc = time.time
+
+        if ptype == np.ndarray:
+            def get_stored():
+                return np.array(p['value'])
+        else:
+            def get_stored():
+                return p['value']
+
+        def getter(query=True):
+            if not query or softget:
+                return get_stored()
+
+            if ttl is not None:
+                if is_cache_valid(p):
+                    self._cache_hits += 1
+                    return get_stored()
+                self._cache_misses += 1
+
+            if not canget:
+                print 'Instrument does not support getting of %s' % name
+                return None
+
+            value = getfunc(**chkw)
+            if cast is not None and value is not None:
+                try:
+                    value = cast(value)
+                except:
+                    logging.warning('Unable to cast value "%s" to %s',
+                            value, ptype)
+
+            p['value'] = value
+            if ttl is not None:
+                p['cache_time'] = timefunc()
+            return value
+
+        return getter
+
+    def _compile_setter(self, name):
+        '''
+        Return a function set(value) equivalent to _set_value(name, value)
+        without extra options, or None if the parameter should use
+        _set_value() (e.g. when ramping).
+        '''
+
+        p = self._parameters[name]
+        flags = p['flags']
+        ptype = p['type']
+        if not flags & Instrument.FLAG_SET or \
+                p.get('maxstep', None) is not None or \
+                ptype not in self._CONVERT_MAP:
+            return None
+
+        setfunc = self._drv_set[name]
+        convert = self._CONVERT_MAP[ptype]
+        check_bool = ptype is not types.BooleanType
+        format_map = p.get('format_map', None)
+        option_list = p.get('option_list', None)
+        minval = p.get('minval', None)
+        maxval = p.get('maxval', None)
+        chkw = {}
+        if 'channel' in p:
+            chkw['channel'] = p['channel']
+
+        # Only store the value if nothing else needs to be done afterwards
+        simple_store = not flags & (Instrument.FLAG_GET_AFTER_SET | \
+                Instrument.FLAG_PERSIST) and 'cache_ttl' not in p
+        store = self._store_set_value
+
+        def setter(value):
+            if format_map is not None:
+                newval = self._val_from_option_dict(format_map, value)
+                if newval is None:
+                    logging.error('Value %s is not a valid option for "%s", valid options: %r',
+                        value, name, repr(format_map))
+                    return None
+                value = newval
+
+            if option_list is not None:
+                newval = self._val_from_option_list(option_list, value)
+                if newval is None:
+                    logging.error('Value %s is not a valid option for "%s", valid: %r',
+                        value, name, repr(option_list))
+                    return None
+                value = newval
+
+            if check_bool and type(value) is types.BooleanType:
+                logging.warning('Setting a boolean, but that is not the expected type')
+                return None
+            try:
+                value = convert(value)
+            except:
+                logging.warning('Conversion of %r to type %s failed',
+                        value, ptype)
+                return None
+
+            if minval is not None and value < minval:
+                print 'Trying to set too small value: %s' % value
+                return None
+            if maxval is not None and value > maxval:
+                print 'Trying to set too large value: %s' % value
+                return None
+
+            setfunc(value, **chkw)
+            if simple_store:
+                p['value'] = value
+                return value
+            return store(name, value)
+
+        return setter
+
     def _remove_parameters(self):
         '''
         Remove remaining references to bound methods so that the Instrument
@@ -416,6 +661,10 @@ class Instrument(SharedGObject):
                 if hasattr(self, fname):
                     delattr(self, fname)
         self._parameters = {}
+        self._getters.clear()
+        self._setters.clear()
+        self._drv_get.clear()
+        self._drv_set.clear()
 
     def remove_parameter(self, name):
         if name not in self._parameters:
@@ -426,6 +675,10 @@ class Instrument(SharedGObject):
                 delattr(self, func)
 
         del self._parameters[name]
+        self._getters.pop(name, None)
+        self._setters.pop(name, None)
+        self._drv_get.pop(name, None)
+        self._drv_set.pop(name, None)
         self.emit('parameter-removed', name)
 
     def has_parameter(self, name):
@@ -478,6 +731,7 @@ class Instrument(SharedGObject):
         for key, val in kwargs.iteritems():
             self._parameters[name][key] = val
 
+        self._compile_accessors(name)
         self.emit('parameter-changed', name)
 
     def get_parameter_tags(self, name):
@@ -680,6 +934,9 @@ class Instrument(SharedGObject):
         Output: value of parameter (whatever type the instrument driver returns)
         '''
 
+        if len(kwargs) == 0 and name in self._getters:
+            return self._getters[name](query)
+
         try:
             p = self._parameters[name]
         except:
@@ -691,27 +948,80 @@ class Instrument(SharedGObject):
 
         flags = p['flags']
         if not query or flags & 8: #self.FLAG_SOFTGET:
-            if 'value' in p:
-                if p['type'] == np.ndarray:
-                    return np.array(p['value'])
-                else:
-                    return p['value']
-            else:
-#                logging.debug('Trying to access cached value, but none available')
-                return None
+            return self._get_stored_value(p)
+
+        if 'cache_ttl' in p:
+            if self._is_cache_valid(p):
+                self._cache_hits += 1
+                return self._get_stored_value(p)
+            self._cache_misses += 1
 
         # Check this here; getting of cached values should work
         if not flags & 1: #Instrument.FLAG_GET:
             print 'Instrument does not support getting of %s' % name
             return None
 
-        if 'base_name' in p:
-            base_name = p['base_name']
+        func = self._drv_get[name]
+        value = self._cast_value(p, func(**kwargs))
+        self._store_value(p, value)
+        return value
+
+    def _get_stored_value(self, p):
+        if 'value' in p:
+            if p['type'] == np.ndarray:
+                return np.array(p['value'])
+            else:
+                return p['value']
         else:
-            base_name = name
+#            logging.debug('Trying to access cached value, but none available')
+            return None
+
+    def _store_value(self, p, value):
+        '''Store a value read from the instrument.'''
+        p['value'] = value
+        if 'cache_ttl' in p:
+            p['cache_time'] = time.time()
+
+    def _is_cache_valid(self, p):
+        t = p.get('cache_time', None)
+        return t is not None and time.time() - t < p['cache_ttl']
+
+    def invalidate_cache(self, names=None):
+        '''
+        Invalidate the cached values of parameters with a cache_ttl, so
+        that the next get queries the instrument.
+
+        Input:
+            names (string or list of strings): parameter(s), default all
+        '''
+
+        if names is None:
+            names = self._parameters.keys()
+        elif type(names) not in (types.ListType, types.TupleType):
+            names = [names]
+
+        for name in names:
+            p = self._parameters.get(name, None)
+            if p is not None and 'cache_time' in p:
+                p['cache_time'] = None
+
+    def get_cache_stats(self):
+        '''
+        Return a dictionary with the number of gets served from the cache
+        ('hits') and the number of gets that queried the instrument
+        ('misses') for parameters with a cache_ttl.
+        '''
+
+        return {'hits': self._cache_hits, 'misses': self._cache_misses}
+
+    def reset_cache_stats(self):
+        '''Reset the cache hit / miss counters.'''
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def _cast_value(self, p, value):
+        '''Cast a value returned by the driver to the parameter type.'''
 
-        func = p['get_func']
-        value = func(**kwargs)
         if 'type' in p and value is not None:
             try:
                 if p['type'] == types.IntType:
@@ -729,9 +1039,48 @@ class Instrument(SharedGObject):
             except:
                 logging.warning('Unable to cast value "%s" to %s', value, p['type'])
 
-        p['value'] = value
         return value
 
+    def _get_values(self, names, query=True, **kwargs):
+        '''
+        Private wrapper function to get several values. If the driver
+        implements _do_get_many() it is used to query the parameters in
+        one go (only if no extra options are specified).
+
+        Input:  (1) names of parameters (list of strings)
+                (2) query the instrument or return stored value (Boolean)
+                (3) optional list of extra options
+        Output: dictionary of parameter -> value
+        '''
+
+        result = {}
+        if query and len(kwargs) == 0 and hasattr(self, '_do_get_many'):
+            bulk = []
+            for name in names:
+                p = self._parameters.get(name)
+                if p is not None and p['flags'] & self.FLAG_GET and \
+                        not p['flags'] & self.FLAG_SOFTGET and \
+                        not ('cache_ttl' in p and self._is_cache_valid(p)):
+                    bulk.append(name)
+
+            if len(bulk) > 1:
+                values = self._do_get_many(bulk)
+                for name, value in values.iteritems():
+                    if name not in bulk:
+                        continue
+                    p = self._parameters[name]
+                    if 'cache_ttl' in p:
+                        self._cache_misses += 1
+                    value = self._cast_value(p, value)
+                    self._store_value(p, value)
+                    result[name] = value
+
+        for name in names:
+            if name not in result:
+                result[name] = self._get_value(name, query, **kwargs)
+
+        return result
+
     def get(self, name, query=True, fast=False, **kwargs):
         '''
         Get one or more Instrument parameter values.
@@ -762,8 +1111,9 @@ class Instrument(SharedGObject):
         if type(name) in (types.ListType, types.TupleType):
             changed = {}
             result = {}
+            values = self._get_values(name, query, **kwargs)
             for key in name:
-                val = self._get_value(key, query, **kwargs)
+                val = values[key]
                 if val is not None:
                     result[key] = val
                     changed[key] = val
@@ -782,25 +1132,17 @@ class Instrument(SharedGObject):
 
     def get_threaded(self, *args, **kwargs):
         '''
-        Perform a get in a separate thread. Run gobject main loop while
+        Perform a get in a worker thread of qt.instruments (see
+        Instruments.get_parallel()). Run gobject main loop while
         executing and return when the get finishes.
         '''
 
         if config.get('threading_warning', True):
             logging.warning('Using threading functions could result in QTLab becoming unstable!')
 
-        thread = calltimer.ThreadCall(self.get, *args, **kwargs)
-
-        # In python 2.6 the function is called is_alive
-        try:
-            isalive = thread.is_alive
-        except:
-            isalive = thread.isAlive
-
-        while isalive():
-            qt.flow.run_mainloop(0.005)
-
-        return thread.get_return_value()
+        call = qt.instruments._submit(self.get, *args, **kwargs)
+        qt.flow.run_mainloop_until(call.is_done)
+        return call.get_return_value()
 
     def _key_from_format_map_val(self, dic, value):
         for key, val in dic.iteritems():
@@ -877,17 +1219,14 @@ class Instrument(SharedGObject):
 
         return value
 
-    def _set_value(self, name, value, **kwargs):
+    def _check_set_value(self, name, value):
         '''
-        Private wrapper function to set a value.
+        Check whether parameter <name> can be set to <value> and perform
+        type casting if necessary.
 
-        Input:  (1) name of parameter (string)
-                (2) value of parameter (whatever type the parameter supports).
-                    Type casting is performed if necessary.
-                (3) Optional keyword args that will be passed on.
-        Output: Value returned by the _do_set_<name> function,
-                or result of get in FLAG_GET_AFTER_SET specified.
+        Output: the value to pass to the driver, None if it is not valid.
         '''
+
         if self._parameters.has_key(name):
             p = self._parameters[name]
         else:
@@ -897,9 +1236,6 @@ class Instrument(SharedGObject):
             print 'Instrument does not support setting of %s' % name
             return None
 
-        if 'channel' in p and 'channel' not in kwargs:
-            kwargs['channel'] = p['channel']
-
         # If a format map is available the key should be found.
         if 'format_map' in p:
             newval = self._val_from_option_dict(p['format_map'], value)
@@ -932,45 +1268,60 @@ class Instrument(SharedGObject):
             print 'Trying to set too large value: %s' % value
             return None
 
-        if 'base_name' in p:
-            base_name = p['base_name']
-        else:
-            base_name = name
+        return value
 
-        func = p['set_func']
-        if 'maxstep' in p and p['maxstep'] is not None:
-            curval = p['value']
-            if curval is None:
-                logging.warning('Current value not available, ignoring maxstep')
-                curval = value + 0.01 * p['maxstep']
-
-            delta = curval - value
-            if delta < 0:
-                sign = 1
-            else:
-                sign = -1
+    def _set_value(self, name, value, wait=True, **kwargs):
+        '''
+        Private wrapper function to set a value.
 
-            if 'stepdelay' in p:
-                delay = p['stepdelay']
-            else:
-                delay = 50
+        Input:  (1) name of parameter (string)
+                (2) value of parameter (whatever type the parameter supports).
+                    Type casting is performed if necessary.
+                (3) wait for a ramp to finish (Boolean)
+                (4) Optional keyword args that will be passed on.
+        Output: Value returned by the _do_set_<name> function,
+                or result of get in FLAG_GET_AFTER_SET specified.
+                If the parameter is ramped and wait is False the Ramp
+                object is returned.
+        '''
 
-            while math.fabs(delta) > 0:
-                if math.fabs(delta) > p['maxstep']:
-                    curval += sign * p['maxstep']
-                    delta += sign * p['maxstep']
-                else:
-                    curval = value
-                    delta = 0
+        if len(kwargs) == 0 and name in self._setters:
+            return self._setters[name](value)
 
-                ret = func(curval, **kwargs)
+        value = self._check_set_value(name, value)
+        if value is None:
+            return None
 
-                if delta != 0:
-                    time.sleep(delay / 1000.0)
+        p = self._parameters[name]
+        if 'channel' in p and 'channel' not in kwargs:
+            kwargs['channel'] = p['channel']
 
-        else:
-            ret = func(value, **kwargs)
+        func = self._drv_set[name]
+        if 'maxstep' in p and p['maxstep'] is not None:
+            delay = p.get('stepdelay', None)
+            if delay is None:
+                delay = 50
+
+            ramp = get_ramp_scheduler().start(self, name, value,
+                    p['maxstep'], delay, func, kwargs)
+            if not wait:
+                return ramp
+            if not ramp.wait():
+                return None
+            return p['value']
+
+        ret = func(value, **kwargs)
+        return self._store_set_value(name, value, **kwargs)
 
+    def _store_set_value(self, name, value, **kwargs):
+        '''
+        Store the value of parameter <name> after it has been set.
+        Performs a get if FLAG_GET_AFTER_SET is specified.
+        '''
+
+        p = self._parameters[name]
+        if 'cache_time' in p:
+            p['cache_time'] = None
         if p['flags'] & self.FLAG_GET_AFTER_SET:
             value = self._get_value(name, **kwargs)
 
@@ -981,7 +1332,45 @@ class Instrument(SharedGObject):
         p['value'] = value
         return value
 
-    def set(self, name, value=None, fast=False, **kwargs):
+    def _set_values(self, values, wait=True, **kwargs):
+        '''
+        Private wrapper function to set several values. If the driver
+        implements _do_set_many() it is used to set the parameters that
+        do not need ramping in one go (only if no extra options are
+        specified).
+
+        Input:  (1) dictionary of parameter -> value
+                (2) wait for ramps to finish (Boolean)
+                (3) Optional keyword args that will be passed on.
+        Output: dictionary of parameter -> value as returned by _set_value()
+        '''
+
+        result = {}
+        if len(kwargs) == 0 and hasattr(self, '_do_set_many'):
+            bulk = {}
+            for name, value in values.iteritems():
+                p = self._parameters.get(name)
+                if p is None or p.get('maxstep', None) is not None:
+                    continue
+
+                value = self._check_set_value(name, value)
+                if value is None:
+                    result[name] = None
+                else:
+                    bulk[name] = value
+
+            if len(bulk) > 1:
+                for name in self._do_set_many(bulk):
+                    if name in bulk:
+                        result[name] = self._store_set_value(name, bulk[name])
+
+        for name, value in values.iteritems():
+            if name not in result:
+                result[name] = self._set_value(name, value, wait=wait, **kwargs)
+
+        return result
+
+    def set(self, name, value=None, fast=False, wait=True, **kwargs):
         '''
         Set one or more Instrument parameter values.
 
@@ -994,6 +1383,10 @@ class Instrument(SharedGObject):
             value (any): the value to set
             fast (bool): if True perform as fast as possible, e.g. don't
                 emit a signal to update the GUI.
+            wait (bool): if False don't wait for parameters with a maxstep
+                to reach the value, but return a lib.ramp.Ramp object (a
+                list of them when setting multiple parameters). The ramps
+                run while the main loop runs, e.g. during qt.msleep().
             kwargs: Optional keyword args that will be passed on.
 
         Output: True or False whether the operation succeeded.
@@ -1012,20 +1405,20 @@ class Instrument(SharedGObject):
 
         result = True
         changed = {}
+        ramps = []
         if type(name) == types.DictType:
-            for key, val in name.iteritems():
-                val = self._set_value(key, val, **kwargs)
-                if val is not None:
-                    changed[key] = val
-                else:
-                    result = False
-
+            values = self._set_values(name, wait=wait, **kwargs)
         else:
-            val = self._set_value(name, value, **kwargs)
-            if val is not None:
-                changed[name] = val
-            else:
+            values = {name: self._set_value(name, value, wait=wait, **kwargs)}
+
+        for key, val in values.iteritems():
+            if isinstance(val, Ramp):
+                ramps.append(val)
+            elif val is None:
                 result = False
+            elif self._parameters[key].get('maxstep', None) is None:
+                # A finished ramp has queued the change already
+                changed[key] = val
 
         if Instrument.USE_ACCESS_LOCK:
             self._access_lock.release()
@@ -1033,6 +1426,12 @@ class Instrument(SharedGObject):
         if not fast and len(changed) > 0:
             self._queue_changed(changed)
 
+        if not wait:
+            if type(name) == types.DictType:
+                return ramps
+            elif len(ramps) > 0:
+                return ramps[0]
+
         return result
 
     def update_value(self, name, value):
@@ -1047,7 +1446,7 @@ class Instrument(SharedGObject):
         else:
             return None
 
-        p['value'] = value
+        self._store_value(p, value)
         self._queue_changed({name: value})
 
     def get_argspec_dict(self, a):
@@ -1121,8 +1520,73 @@ class Instrument(SharedGObject):
         Output: None
         '''
         f = getattr(self, funcname)
+        if self._stats_enabled:
+            f = callstats.timed(self._get_call_stats(funcname, 'call'), f)
         f(**kwargs)
 
+    def _get_call_stats(self, name, kind):
+        stats = self._stats.setdefault(name, {})
+        if kind not in stats:
+            stats[kind] = callstats.CallStats()
+        return stats[kind]
+
+    def _wrap_stats(self, name, kind, func):
+        '''Wrap driver function func to record statistics if enabled.'''
+        if func is None or not self._stats_enabled:
+            return func
+        return callstats.timed(self._get_call_stats(name, kind), func)
+
+    def _record_ramp(self, name, dt, nsteps):
+        if self._stats_enabled:
+            self._get_call_stats(name, 'set').add_ramp(dt, nsteps)
+
+    def set_stats_enabled(self, enable):
+        '''
+        Enable or disable recording statistics of the driver calls. The
+        default is config option 'instrument_stats'.
+        '''
+
+        self._stats_enabled = enable
+        for name in self._parameters:
+            self._compile_accessors(name)
+
+    def get_stats_enabled(self):
+        return self._stats_enabled
+
+    def get_stats(self, names=None):
+        '''
+        Return statistics of the driver calls, if enabled (see
+        set_stats_enabled()).
+
+        Input:
+            names (list of strings): parameters / functions, default all
+
+        Output:
+            dictionary of name -> kind ('get', 'set' or 'call') -> info
+            dictionary with the number of calls ('count') and errors, the
+            latency in seconds ('total', 'min', 'mean', 'p95', 'max'), the
+            bytes transferred ('bytes_read', 'bytes_written', only counted
+            for VISA instruments) and for ramped parameters the number of
+            ramps, steps and the time spent ramping ('ramp_time').
+        '''
+
+        if names is None:
+            names = self._stats.keys()
+        ret = {}
+        for name in names:
+            if name not in self._stats:
+                continue
+            for kind, stats in self._stats[name].iteritems():
+                if stats.count > 0 or stats.ramps > 0:
+                    ret.setdefault(name, {})[kind] = stats.get_info()
+        return ret
+
+    def reset_stats(self):
+        '''Reset the statistics of the driver calls.'''
+        for stats in self._stats.values():
+            for s in stats.values():
+                s.reset()
+
     def lock(self):
         '''
         Lock the instrument; no parameters can be changed until the Instrument
@@ -1183,23 +1647,163 @@ class Instrument(SharedGObject):
             (Instrument.get_type(self), name))
 
     def _listen_parameter_changed_cb(self, sender, changed, \
-            listen_param, update_func):
+            listen_param, update_func, name):
 
         if listen_param not in changed:
             return
 
+        self.invalidate_cache(name)
         update_func()
 
     def _do_emit_changed(self):
-        # was this a bug?
-        self.emit('changed', self._changed)
+        changed = self._changed
         self._changed = {}
         self._changed_hid = None
+        self._changed_last = time.time()
+        self._changed_stats['emitted'] += 1
+
+        if config.get('instrument_changed_subscribe', False):
+            shared = self._filter_subscribed(changed)
+            if len(shared) > 0:
+                self.emit_shared('changed', (shared, ), changed)
+            else:
+                self.emit_shared('changed', None, changed)
+        else:
+            self.emit('changed', changed)
+        return False
+
+    def _schedule_changed(self):
+        if self._changed_interval > 0:
+            wait = self._changed_last + self._changed_interval / 1000.0 - \
+                    time.time()
+            if wait > 0:
+                self._changed_hid = gobject.timeout_add(int(wait * 1000) + 1,
+                        self._do_emit_changed)
+                return
+        self._changed_hid = gobject.idle_add(self._do_emit_changed)
 
     def _queue_changed(self, changed):
+        stats = self._changed_stats
+        stats['queued'] += len(changed)
+        for name in changed:
+            if name in self._changed:
+                stats['coalesced'] += 1
         self._changed.update(changed)
         if self._changed_hid is None:
-            self._changed_hid = gobject.idle_add(self._do_emit_changed)
+            self._schedule_changed()
+
+    def _queue_changed_value(self, name, value):
+        self._changed_stats['queued'] += 1
+        if name in self._changed:
+            self._changed_stats['coalesced'] += 1
+        self._changed[name] = value
+        if self._changed_hid is None:
+            self._schedule_changed()
+
+    def set_changed_interval(self, interval):
+        '''
+        Set the minimum interval in ms between two 'changed' signals of
+        this instrument. Changes within the interval are combined into
+        one signal, for each parameter the last value is sent. Use 0 to
+        emit the signal as soon as possible.
+        '''
+        self._changed_interval = interval
+
+    def get_changed_interval(self):
+        '''Return the minimum interval in ms between 'changed' signals.'''
+        return self._changed_interval
+
+    def subscribe_changed(self, names):
+        '''
+        Subscribe to 'changed' signals of parameters 'names' (string or
+        list of strings). If config option 'instrument_changed_subscribe'
+        is True, remote clients only receive the changes of parameters
+        with at least one subscription. Every subscribe_changed() should
+        be matched by an unsubscribe_changed() call; the subscriptions of
+        a remote client are removed when it disconnects.
+        '''
+
+        if type(names) in (types.StringType, types.UnicodeType):
+            names = [names]
+
+        conn = objsh.helper.get_calling_connection()
+        if conn is not None:
+            _track_subscriptions(self)
+        counts = self._conn_subscriptions.setdefault(conn, {})
+        for name in names:
+            counts[name] = counts.get(name, 0) + 1
+            self._subscriptions[name] = self._subscriptions.get(name, 0) + 1
+
+    def unsubscribe_changed(self, names):
+        '''Remove a subscription made with subscribe_changed().'''
+
+        if type(names) in (types.StringType, types.UnicodeType):
+            names = [names]
+
+        conn = objsh.helper.get_calling_connection()
+        counts = self._conn_subscriptions.get(conn, {})
+        for name in names:
+            if name not in counts:
+                continue
+            counts[name] -= 1
+            if counts[name] == 0:
+                del counts[name]
+            self._remove_subscription(name, 1)
+        if len(counts) == 0 and conn in self._conn_subscriptions:
+            del self._conn_subscriptions[conn]
+
+    def _remove_subscription(self, name, n):
+        n = self._subscriptions.get(name, 0) - n
+        if n > 0:
+            self._subscriptions[name] = n
+        elif name in self._subscriptions:
+            del self._subscriptions[name]
+
+    def _remove_connection_subscriptions(self, conn):
+        '''Remove all subscriptions of connection conn.'''
+        counts = self._conn_subscriptions.pop(conn, {})
+        for name, n in counts.iteritems():
+            self._remove_subscription(name, n)
+
+    def get_subscriptions(self):
+        '''Return a dictionary of parameter -> number of subscriptions.'''
+        return self._subscriptions
+
+    def _filter_subscribed(self, changed, count=True):
+        '''
+        Return the part of dictionary 'changed' that contains subscribed
+        parameters. If count is True the filtered values are added to the
+        statistics.
+        '''
+
+        ret = {}
+        for name, value in changed.iteritems():
+            if name in self._subscriptions:
+                ret[name] = value
+        if count:
+            self._changed_stats['filtered'] += len(changed) - len(ret)
+        return ret
+
+    def get_changed_stats(self):
+        '''
+        Return a dictionary with statistics about the 'changed' signal:
+            queued: number of parameter values queued for the signal
+            emitted: number of signals emitted
+            coalesced: number of values replaced by a newer value before
+                the signal was emitted
+            filtered: number of values not sent to remote clients because
+                nobody subscribed to them
+            suppressed: coalesced + filtered
+        '''
+
+        ret = dict(self._changed_stats)
+        ret['suppressed'] = ret['coalesced'] + ret['filtered']
+        return ret
+
+    def reset_changed_stats(self):
+        '''Reset the 'changed' signal statistics.'''
+        for key in self._changed_stats:
+            self._changed_stats[key] = 0
 
 class InvalidInstrument(Instrument):
     '''
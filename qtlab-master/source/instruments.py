@@ -22,9 +22,11 @@ import types
 import os
 import logging
 import sys
+import time
 import instrument
+from lib import calltimer
 from lib.config import get_config
-from insproxy import Proxy
+from insproxy import Proxy, LazyProxy
 from lib.network.object_sharer import SharedGObject
 
 from lib.misc import get_traceback
@@ -112,6 +114,14 @@ class Instruments(SharedGObject):
         self._instruments = {}
         self._instruments_info = {}
         self._tags = []
+        self._pool = None
+
+        # Lazy instruments, see create()
+        self._pending = {}
+        self._timing = {}
+
+        self._types = None
+        self._types_mtime = None
 
     def __getitem__(self, key):
         return self.get(key)
@@ -154,7 +164,9 @@ class Instruments(SharedGObject):
         Output: Instrument object
         '''
 
-        if isinstance(name, instrument.Instrument) or isinstance(name, Proxy):
+        if isinstance(name, LazyProxy):
+            name = name.get_name()
+        elif isinstance(name, instrument.Instrument) or isinstance(name, Proxy):
             return name
 
         if type(name) == types.TupleType:
@@ -167,9 +179,121 @@ class Instruments(SharedGObject):
                 return self._instruments_info[name]['proxy']
             else:
                 return self._instruments[name]
+        elif name in self._pending:
+            if proxy:
+                return self._pending[name]['proxy']
+            self.realize(name)
+            return self._instruments.get(name, None)
         else:
             return None
 
+    def _get_pool(self):
+        if self._pool is None:
+            # Drivers use gobject (timeouts, signals) in the worker threads
+            gobject.threads_init()
+            nworkers = _config.get('instrument_workers', 4)
+            self._pool = calltimer.WorkerPool(nworkers, name='instruments')
+        return self._pool
+
+    def _get_group(self, ins, names, query):
+        '''
+        Read parameters 'names' of instrument 'ins' while holding its
+        access lock. Runs in a worker thread.
+        '''
+
+        while not ins._access_lock.acquire():
+            logging.warning('Waiting for access lock of %s', ins.get_name())
+        try:
+            return ins._get_values(names, query)
+        finally:
+            ins._access_lock.release()
+
+    def get_parallel(self, items, query=True):
+        '''
+        Get parameters of several instruments concurrently. The reads are
+        done by a pool of worker threads (config 'instrument_workers',
+        default 4); instruments with a different lock class (e.g. on
+        different buses) are read in parallel, instruments that share a
+        lock class are read one after the other. Parameters of the same
+        instrument are read with one get(), so drivers that implement
+        _do_get_many() can query them together. The gobject main loop keeps
+        running and the function returns when all reads have finished.
+
+        Input:
+            items (list of tuples): (instrument, parameter name) pairs, the
+                instrument can be specified by name
+            query (bool): whether to query the instruments or return the
+                last stored values
+
+        Output:
+            list of values in the order of 'items'. If a read failed the
+            first exception is raised after all reads have finished.
+        '''
+
+        import qt
+
+        groups = {}
+        order = []
+        for insname, param in items:
+            ins = self.get(insname, proxy=False)
+            if isinstance(ins, Proxy):
+                ins = self.get(ins.get_name(), proxy=False)
+            if ins is None:
+                raise ValueError('Instrument %r does not exist' % (insname, ))
+
+            lockclass = ins._lock_class
+            if lockclass not in groups:
+                groups[lockclass] = []
+                order.append(lockclass)
+            for entry in groups[lockclass]:
+                if entry[0] is ins:
+                    if param not in entry[1]:
+                        entry[1].append(param)
+                    break
+            else:
+                groups[lockclass].append((ins, [param]))
+
+        def read_group(entries):
+            ret = []
+            for ins, names in entries:
+                try:
+                    ret.append((ins, self._get_group(ins, names, query), None))
+                except Exception, e:
+                    ret.append((ins, None, e))
+            return ret
+
+        calls = [self._submit(read_group, groups[lc]) for lc in order]
+        qt.flow.run_mainloop_until(
+                lambda: len([c for c in calls if not c.is_done()]) == 0)
+
+        values = {}
+        error = None
+        for call in calls:
+            for ins, result, e in call.get_return_value():
+                if e is not None:
+                    logging.error('Parallel get on %s failed: %s',
+                        ins.get_name(), e)
+                    if error is None:
+                        error = e
+                    continue
+                values[ins.get_name()] = result
+                if query:
+                    changed = {}
+                    for key, val in result.iteritems():
+                        if val is not None:
+                            changed[key] = val
+                    if len(changed) > 0:
+                        ins._queue_changed(changed)
+
+        if error is not None:
+            raise error
+
+        ret = []
+        for insname, param in items:
+            ins = self.get(insname, proxy=False)
+            ret.append(values[ins.get_name()][param])
+        return ret
+
     def get_instrument_names(self):
         keys = self._instruments.keys()
         keys.sort()
@@ -181,10 +305,22 @@ class Instruments(SharedGObject):
         '''
         return self._instruments
 
+    def _get_types_mtime(self):
+        ret = [os.path.getmtime(_insdir)]
+        if _user_insdir is not None:
+            ret.append(os.path.getmtime(_user_insdir))
+        return ret
+
     def get_types(self):
         '''
-        Return list of supported instrument types
+        Return list of supported instrument types. The list is cached until
+        a file is added to or removed from the driver directories.
         '''
+
+        mtime = self._get_types_mtime()
+        if self._types is not None and mtime == self._types_mtime:
+            return list(self._types)
+
         ret = []
         filelist = os.listdir(_insdir)
         for path_fn in filelist:
@@ -202,7 +338,9 @@ class Instruments(SharedGObject):
                     ret.append(name)
 
         ret.sort()
-        return ret
+        self._types = ret
+        self._types_mtime = mtime
+        return list(ret)
 
     def type_exists(self, typename):
         driverfn = os.path.join(_insdir, '%s.py' % typename)
@@ -252,23 +390,156 @@ class Instruments(SharedGObject):
 
         return self._tags
 
+    def get_stats(self, names=None):
+        '''
+        Return the statistics of the driver calls of instruments, see
+        Instrument.get_stats(). Statistics are recorded for instruments
+        created with config option 'instrument_stats' set to True, or after
+        calling set_stats_enabled(True) on them.
+
+        Input:  names (list of strings): instruments, default all
+        Output: dictionary of instrument name -> statistics
+        '''
+
+        if names is None:
+            names = self.get_instrument_names()
+        ret = {}
+        for name in names:
+            ins = self._instruments.get(name, None)
+            if ins is not None and ins.get_stats_enabled():
+                ret[name] = ins.get_stats()
+        return ret
+
+    def get_stats_summary(self, n=20):
+        '''
+        Return the n parameters / functions that took most time, as a list
+        of tuples (total time, count, instrument, name, kind).
+        '''
+
+        ret = []
+        for insname, stats in self.get_stats().iteritems():
+            for name, kinds in stats.iteritems():
+                for kind, info in kinds.iteritems():
+                    total = max(info['total'], info['ramp_time'])
+                    ret.append((total, info['count'], insname, name, kind))
+        ret.sort(reverse=True)
+        return ret[:n]
+
+    def reset_stats(self):
+        '''Reset the statistics of all instruments.'''
+        for ins in self._instruments.values():
+            ins.reset_stats()
+
     def _create_invalid_ins(self, name, instype, **kwargs):
         ins = instrument.InvalidInstrument(name, instype, **kwargs)
         self.add(ins, create_args=kwargs)
         self.emit('instrument-added', name)
         return self.get(name)
 
-    def create(self, name, instype, **kwargs):
+    def _set_visa(self, kwargs):
+        visa_driver = kwargs.get('visa', 'pyvisa')
+        import visa
+        visa.set_visa(visa_driver)
+
+    def _construct(self, name, instype, kwargs, reload_driver=True):
+        '''
+        Import the driver and create the Instrument object, without adding
+        it to the list. Can run in a worker thread. If reload_driver is
+        True a driver that was imported before is reloaded.
+
+        Output: Instrument object, or None if creating it failed
+        '''
+
+        # The VISA provider of the instrument, only for this thread
+        import visa
+        try:
+            visa.set_thread_visa(kwargs.get('visa', 'pyvisa'))
+            return self._do_construct(name, instype, kwargs, reload_driver)
+        finally:
+            visa.set_thread_visa(None)
+
+    def _do_construct(self, name, instype, kwargs, reload_driver):
+        start = time.time()
+        loaded = instype in sys.modules
+        module = _get_driver_module(instype)
+        if module is not None and loaded and reload_driver:
+            reload(module)
+        t_import = time.time() - start
+
+        ins = None
+        error = None
+        if module is None:
+            error = 'Driver not available'
+        else:
+            insclass = getattr(module, instype, None)
+            if insclass is None:
+                error = 'Driver does not contain instrument class'
+                logging.error(error)
+            else:
+                try:
+                    ins = insclass(name, **kwargs)
+                except Exception, e:
+                    TB()
+                    logging.error('Error creating instrument %s', name)
+                    error = str(e)
+
+        self._timing[name] = {
+            'type': instype,
+            'import': t_import,
+            'init': time.time() - start - t_import,
+            'error': error,
+        }
+        return ins
+
+    def _submit(self, func, *args, **kwargs):
+        '''
+        Execute func(*args, **kwargs) in a worker thread. The main loop is
+        woken up when it is done, see qt.flow.run_mainloop_until().
+
+        Output: calltimer.PoolCall object
+        '''
+        return self._get_pool().submit(self._run_and_wake, func, args,
+                kwargs)
+
+    def _run_and_wake(self, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            gobject.idle_add(self._call_done)
+
+    def _call_done(self):
+        # Add the lazy instruments started by init_pending()
+        self._check_pending()
+        return False
+
+    def _submit_construct(self, name, instype, kwargs):
+        '''Create an instrument in a worker thread, see _construct().'''
+        return self._submit(self._construct, name, instype, kwargs,
+                reload_driver=False)
+
+    def _add_created(self, name, instype, ins, kwargs):
+        if ins is None:
+            return self._create_invalid_ins(name, instype, **kwargs)
+
+        self.add(ins, create_args=kwargs)
+        self.emit('instrument-added', name)
+        return self.get(name)
+
+    def create(self, name, instype, lazy=None, **kwargs):
         '''
         Create an instrument called 'name' of type 'type'.
 
         Input:  (1) name of the newly created instrument (string)
                 (2) type of instrument (string)
-                (3) optional: keyword arguments.
+                (3) lazy (bool): postpone importing the driver and creating
+                    the instrument until it is first used or until
+                    init_pending() is called. Default is config option
+                    'instruments_lazy' (False)
+                (4) optional: keyword arguments.
                     (1) tags, array of strings representing tags
                     (2) many instruments require address=<address>
 
-        Output: Instrument object (Proxy)
+        Output: Instrument object (Proxy), or LazyProxy if lazy is True
         '''
 
         if not self.type_exists(instype):
@@ -278,31 +549,261 @@ class Instruments(SharedGObject):
         if name in self._instruments:
             logging.warning('Instrument "%s" already exists, removing', name)
             self.remove(name)
+        if name in self._pending:
+            logging.warning('Instrument "%s" already pending, replacing', name)
+            del self._pending[name]
+
+        if lazy is None:
+            lazy = _config.get('instruments_lazy', False)
+        if lazy:
+            self._pending[name] = {
+                'type': instype,
+                'kwargs': kwargs,
+                'proxy': LazyProxy(name, instype),
+                'call': None,
+            }
+            return self._pending[name]['proxy']
+
+        self._set_visa(kwargs)
+        ins = self._construct(name, instype, kwargs)
+        return self._add_created(name, instype, ins, kwargs)
+
+    def _get_bus(self, name, kwargs):
+        '''
+        Return the key of the lock class or bus an instrument will use, to
+        serialize the creation of instruments that share it.
+        '''
 
-        # Set VISA provider
-        visa_driver = kwargs.get('visa', 'pyvisa')
-        import visa
-        visa.set_visa(visa_driver)
+        if 'lockclass' in kwargs:
+            return kwargs['lockclass']
+        address = kwargs.get('address', None)
+        if type(address) in (types.StringType, types.UnicodeType):
+            if address.upper().startswith('GPIB'):
+                return 'GPIB'
+            return address
+        return name
 
-        module = _get_driver_module(instype)
-        if module is None:
-            return self._create_invalid_ins(name, instype, **kwargs)
-        reload(module)
-        insclass = getattr(module, instype, None)
-        if insclass is None:
-            logging.error('Driver does not contain instrument class')
-            return self._create_invalid_ins(name, instype, **kwargs)
+    def create_many(self, items):
+        '''
+        Create several instruments, in parallel where possible. Instruments
+        that share a lock class or bus (all GPIB instruments, or the same
+        address) are created one after the other, the others concurrently
+        by the worker pool (see get_parallel()). An instrument is created
+        after the instruments listed in its 'depends' argument. A failure
+        does not stop the creation of the other instruments.
 
-        try:
-            ins = insclass(name, **kwargs)
-        except Exception, e:
-            TB()
-            logging.error('Error creating instrument %s', name)
-            return self._create_invalid_ins(name, instype, **kwargs)
+        Input:
+            items (list): tuples (name, type) or (name, type, kwargs), where
+                kwargs are the keyword arguments for create(). kwargs can
+                contain 'depends', a list of names of instruments that
+                should be created first.
 
-        self.add(ins, create_args=kwargs)
-        self.emit('instrument-added', name)
-        return self.get(name)
+        Output:
+            dictionary of name -> Instrument object (Proxy), or None if
+            creating the instrument failed. The errors are logged and are
+            available through get_timing().
+        '''
+
+        import qt
+
+        todo = []
+        names = []
+        for item in items:
+            if len(item) == 2:
+                name, instype = item
+                kwargs = {}
+            else:
+                name, instype, kwargs = item
+            kwargs = dict(kwargs)
+            depends = kwargs.pop('depends', [])
+            if type(depends) in (types.StringType, types.UnicodeType):
+                depends = [depends]
+            todo.append((name, instype, kwargs, depends))
+            names.append(name)
+        todo_all = list(todo)
+
+        ret = {}
+        errors = {}
+        running = {}
+        busy = []
+        reloaded = []
+
+        while len(todo) > 0 or len(running) > 0:
+            for entry in todo[:]:
+                name, instype, kwargs, depends = entry
+
+                error = None
+                waiting = False
+                for dep in depends:
+                    if dep in errors:
+                        error = 'Dependency %s failed' % dep
+                    elif dep in names and dep not in ret:
+                        waiting = True
+                    elif dep not in names and self.get(dep) is None:
+                        error = 'Dependency %s does not exist' % dep
+                if not self.type_exists(instype):
+                    error = 'Instrument type %s not supported' % instype
+
+                if error is not None:
+                    todo.remove(entry)
+                    errors[name] = error
+                    ret[name] = None
+                    continue
+
+                bus = self._get_bus(name, kwargs)
+                if waiting or bus in busy:
+                    continue
+
+                todo.remove(entry)
+                if name in self._instruments:
+                    logging.warning('Instrument "%s" already exists, removing', name)
+                    self.remove(name)
+                if name in self._pending:
+                    del self._pending[name]
+                # Reload drivers that were imported before once per batch
+                if instype in sys.modules and instype not in reloaded:
+                    _get_driver_module(instype, do_reload=True)
+                    reloaded.append(instype)
+                call = self._submit_construct(name, instype, kwargs)
+                running[name] = (call, instype, kwargs, bus)
+                busy.append(bus)
+
+            if len(running) == 0:
+                for name, instype, kwargs, depends in todo:
+                    errors[name] = 'Circular dependency'
+                    ret[name] = None
+                break
+
+            # Handle events until a worker is done, it wakes up the loop
+            qt.flow.run_mainloop_until(
+                    lambda: self._any_done(running.values()))
+
+            for name, (call, instype, kwargs, bus) in running.items():
+                if not call.is_done():
+                    continue
+                del running[name]
+                busy.remove(bus)
+                ins = call.get_return_value()
+                proxy = self._add_created(name, instype, ins, kwargs)
+                if ins is None:
+                    errors[name] = self._timing[name]['error']
+                    ret[name] = None
+                else:
+                    ret[name] = proxy
+
+        for name, instype, kwargs, depends in todo_all:
+            if name not in errors:
+                continue
+            logging.error('Unable to create instrument %s: %s',
+                    name, errors[name])
+            if name not in self._timing:
+                self._timing[name] = {'type': instype, 'import': 0,
+                        'init': 0}
+            self._timing[name]['error'] = errors[name]
+        return ret
+
+    def _any_done(self, running):
+        for entry in running:
+            if entry[0].is_done():
+                return True
+        return False
+
+    def is_pending(self, name):
+        '''Return whether lazy instrument 'name' has not been created yet.'''
+        return name in self._pending
+
+    def get_pending_names(self):
+        '''Return the names of the lazy instruments not created yet.'''
+        keys = self._pending.keys()
+        keys.sort()
+        return keys
+
+    def realize(self, name):
+        '''
+        Create lazy instrument 'name' now, or wait for the creation started
+        by init_pending() to finish.
+
+        Input:  name of instrument (string)
+        Output: Instrument object (Proxy), None if it does not exist
+        '''
+
+        if name in self._instruments:
+            return self._instruments_info[name]['proxy']
+        info = self._pending.get(name, None)
+        if info is None:
+            return None
+
+        if info['call'] is None:
+            ins = self._construct(name, info['type'], info['kwargs'],
+                    reload_driver=False)
+        else:
+            import qt
+            qt.flow.run_mainloop_until(info['call'].is_done)
+
+            # Could have been added by _check_pending() in the main loop
+            if name in self._instruments:
+                return self._instruments_info[name]['proxy']
+            ins = info['call'].get_return_value()
+
+        del self._pending[name]
+        return self._add_created(name, info['type'], ins, info['kwargs'])
+
+    def init_pending(self, names=None, wait=False):
+        '''
+        Start creating lazy instruments in the background. The instruments
+        are created in parallel by the worker pool (see get_parallel()) and
+        added to the list from the main loop when they are ready. Using an
+        instrument waits for its creation to finish.
+
+        Input:
+            names (list of strings): instruments to create, default all
+            wait (bool): whether to wait until all of them are created
+        '''
+
+        if names is None:
+            names = self._pending.keys()
+
+        for name in names:
+            info = self._pending.get(name, None)
+            if info is None or info['call'] is not None:
+                continue
+            info['call'] = self._submit_construct(name, info['type'],
+                    info['kwargs'])
+
+        if wait:
+            for name in names:
+                self.realize(name)
+
+    def _check_pending(self):
+        '''Add the lazy instruments whose creation has finished.'''
+        for name, info in self._pending.items():
+            if info['call'] is not None and info['call'].is_done():
+                del self._pending[name]
+                self._add_created(name, info['type'],
+                        info['call'].get_return_value(), info['kwargs'])
+
+    def get_timing(self):
+        '''
+        Return a dictionary of instrument name -> info dictionary with the
+        instrument type, the time in seconds to import the driver ('import'),
+        the time to create the instrument ('init') and the error message if
+        creating it failed ('error').
+        '''
+        return self._timing
+
+    def get_timing_report(self):
+        '''Return a table of the creation times, slowest first.'''
+
+        items = self._timing.items()
+        items.sort(key=lambda x: -(x[1]['import'] + x[1]['init']))
+        lines = ['%-16s %-28s %8s %8s' % ('name', 'type', 'import', 'init')]
+        for name, info in items:
+            line = '%-16s %-28s %7.2fs %7.2fs' % (name, info['type'],
+                info['import'], info['init'])
+            if info.get('error', None) is not None:
+                line += '  failed: %s' % info['error']
+            lines.append(line)
+        return '\n'.join(lines)
 
     def reload_module(self, instype):
         module = _get_driver_module(instype, do_reload=True)
@@ -378,6 +879,8 @@ class Instruments(SharedGObject):
         if self._instruments.has_key(name):
             del self._instruments[name]
             del self._instruments_info[name]
+        if name in self._pending:
+            del self._pending[name]
 
         self.emit('instrument-removed', name)
 
@@ -409,7 +912,16 @@ class Instruments(SharedGObject):
             None
         '''
 
-        self.emit('instrument-changed', sender.get_name(), changes)
+        name = sender.get_name()
+        if _config.get('instrument_changed_subscribe', False):
+            shared = sender._filter_subscribed(changes, count=False)
+            if len(shared) > 0:
+                self.emit_shared('instrument-changed', (name, shared),
+                        name, changes)
+            else:
+                self.emit_shared('instrument-changed', None, name, changes)
+        else:
+            self.emit('instrument-changed', name, changes)
 
 _config = get_config()
 _insdir = _set_insdir()
@@ -0,0 +1,138 @@
+# callstats.py, call count and latency statistics for instrument access
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import bisect
+import threading
+from misc import exact_time
+
+# Upper edges of the latency histogram bins: 1 us to 100 s, 4 bins per
+# decade. The last bin holds everything slower.
+BIN_EDGES = [1e-6 * 10 ** (i / 4.0) for i in range(33)]
+
+# Bytes transferred by VISA instruments, counted per thread
+_transfer = threading.local()
+
+def add_transfer(nread=0, nwritten=0):
+    '''Count bytes read / written by an instrument in the current thread.'''
+    _transfer.read = getattr(_transfer, 'read', 0) + nread
+    _transfer.written = getattr(_transfer, 'written', 0) + nwritten
+
+def get_transfer():
+    '''Return (bytes read, bytes written) in the current thread.'''
+    return getattr(_transfer, 'read', 0), getattr(_transfer, 'written', 0)
+
+class CallStats():
+    '''
+    Statistics of the calls to one function: count, errors, latency
+    (total, min, max and a histogram for percentiles), bytes transferred
+    and, for ramped parameters, the number of ramps and the time spent.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.hist = [0] * (len(BIN_EDGES) + 1)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.ramps = 0
+        self.ramp_steps = 0
+        self.ramp_time = 0.0
+
+    def add(self, dt, nread=0, nwritten=0):
+        '''Add a call that took dt seconds.'''
+        self.count += 1
+        self.total += dt
+        if self.min is None or dt < self.min:
+            self.min = dt
+        if dt > self.max:
+            self.max = dt
+        self.hist[bisect.bisect_left(BIN_EDGES, dt)] += 1
+        self.bytes_read += nread
+        self.bytes_written += nwritten
+
+    def add_ramp(self, dt, nsteps):
+        '''Add a ramp that took dt seconds.'''
+        self.ramps += 1
+        self.ramp_steps += nsteps
+        self.ramp_time += dt
+
+    def get_percentile(self, pct):
+        '''
+        Return an estimate of the pct percentile of the latency: the upper
+        edge of the histogram bin it falls in, limited to the maximum.
+        '''
+
+        if self.count == 0:
+            return None
+        n = 0
+        limit = self.count * pct / 100.0
+        for i, nbin in enumerate(self.hist):
+            n += nbin
+            if n >= limit:
+                break
+        if i < len(BIN_EDGES):
+            return min(BIN_EDGES[i], self.max)
+        return self.max
+
+    def get_info(self):
+        '''Return the statistics as a dictionary.'''
+
+        if self.count > 0:
+            mean = self.total / self.count
+        else:
+            mean = None
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'min': self.min,
+            'mean': mean,
+            'p95': self.get_percentile(95),
+            'max': self.max if self.count > 0 else None,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'ramps': self.ramps,
+            'ramp_steps': self.ramp_steps,
+            'ramp_time': self.ramp_time,
+        }
+
+def timed(stats, func):
+    '''
+    Return a function that calls func and adds the duration and the bytes
+    transferred in the calling thread to CallStats object stats.
+    '''
+
+    def wrapper(*args, **kwargs):
+        nread, nwritten = get_transfer()
+        start = exact_time()
+        try:
+            return func(*args, **kwargs)
+        except:
+            stats.errors += 1
+            raise
+        finally:
+            dt = exact_time() - start
+            nread2, nwritten2 = get_transfer()
+            stats.add(dt, nread2 - nread, nwritten2 - nwritten)
+
+    wrapper.__doc__ = func.__doc__
+    return wrapper
@@ -23,6 +23,7 @@ import gtk
 #gtk.gdk.threads_init()
 
 import threading
+import Queue
 import time
 from misc import exact_time
 
@@ -233,3 +234,91 @@ class ThreadCall(threading.Thread):
 
     def get_return_value(self):
         return self._return_value
+
+class PoolCall():
+    '''
+    Handle to a function call submitted to a WorkerPool.
+    '''
+
+    def __init__(self, func, args, kwargs):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._return_value = None
+        self._error = None
+        self._done = threading.Event()
+
+    def _run(self):
+        try:
+            self._return_value = self._func(*self._args, **self._kwargs)
+        except Exception, e:
+            self._error = e
+        self._done.set()
+
+    def is_done(self):
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        '''Wait until the call finishes, return whether it finished.'''
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def get_error(self):
+        '''Return the exception raised by the function, or None.'''
+        return self._error
+
+    def get_return_value(self):
+        '''Return the result of the call, raises the error if it failed.'''
+        if self._error is not None:
+            raise self._error
+        return self._return_value
+
+class WorkerPool():
+    '''
+    Pool of persistent worker threads that execute submitted calls, to
+    avoid the cost of starting a thread for every call.
+    '''
+
+    def __init__(self, nworkers=4, name='worker'):
+        '''
+        Input:
+            nworkers (int): number of worker threads
+            name (string): prefix for the thread names
+        '''
+
+        self._queue = Queue.Queue()
+        self._threads = []
+        for i in range(max(int(nworkers), 1)):
+            t = threading.Thread(target=self._worker,
+                    name='%s_%d' % (name, i))
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            call = self._queue.get()
+            if call is None:
+                return
+            call._run()
+
+    def get_size(self):
+        '''Return the number of worker threads.'''
+        return len(self._threads)
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Queue func(*args, **kwargs) for execution in a worker thread.
+
+        Output: PoolCall object
+        '''
+
+        call = PoolCall(func, args, kwargs)
+        self._queue.put(call)
+        return call
+
+    def stop(self):
+        '''Stop the worker threads after the queued calls are done.'''
+        for t in self._threads:
+            self._queue.put(None)
+        self._threads = []
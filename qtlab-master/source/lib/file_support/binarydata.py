@@ -0,0 +1,232 @@
+'''
+Binary data file format (extension .qtb), an alternative to the .dat text
+format of Data objects that can be memory-mapped.
+
+Layout (all integers little endian):
+
+    offset  size    contents
+    0       8       magic 'QTLABBIN'
+    8       4       uint32, format version (1)
+    12      4       uint32, number of columns
+    16      8       uint64, offset of the data body
+    24      ...     JSON encoded header, padded with spaces up to the body
+
+The JSON header is a dictionary containing the dimension info
+('dimensions'), the comments ('comment'), the sizes of the completed
+blocks ('block_sizes'), 'filename' and 'timestamp'. The header is written
+when the file is created and again when it is closed; rows after the last
+complete block form the last block. Space is reserved after the header so
+that it can usually be updated in place.
+
+The body consists of raw float64 (little endian) values in row-major order.
+The number of rows follows from the file size; an incomplete last row
+(e.g. after a crash) is ignored.
+'''
+
+import os
+import struct
+import logging
+import numpy
+
+try:
+    import json
+except:
+    import simplejson as json
+
+MAGIC = 'QTLABBIN'
+VERSION = 1
+EXT = '.qtb'
+DTYPE = numpy.dtype('<f8')
+
+_PREFIX = struct.Struct('<8sIIQ')
+_ALIGN = 4096
+
+def _json_default(obj):
+    '''Convert objects that are not JSON serializable, e.g. instruments.'''
+    if hasattr(obj, 'get_name'):
+        return obj.get_name()
+    elif isinstance(obj, numpy.generic):
+        return obj.item()
+    else:
+        return str(obj)
+
+def _encode_str(obj):
+    '''Convert unicode strings in decoded JSON data to str.'''
+    if isinstance(obj, unicode):
+        try:
+            return str(obj)
+        except UnicodeEncodeError:
+            return obj
+    elif isinstance(obj, list):
+        return [_encode_str(i) for i in obj]
+    elif isinstance(obj, dict):
+        return dict([(_encode_str(k), _encode_str(v)) for k, v in obj.iteritems()])
+    else:
+        return obj
+
+def is_binary_file(filepath):
+    '''Return whether filepath is a binary data file.'''
+
+    if os.path.splitext(filepath)[1] == EXT:
+        return True
+    try:
+        f = open(filepath, 'rb')
+        magic = f.read(len(MAGIC))
+        f.close()
+    except IOError:
+        return False
+    return magic == MAGIC
+
+class BinaryDataFile():
+    '''
+    Class to read, write and append to binary data files.
+
+    The object behaves like a file object for writing the data body: data
+    written through write() is appended after the header.
+    '''
+
+    def __init__(self, filepath, mode='r'):
+        '''
+        Open a binary data file.
+
+        Input:
+            filepath (string): the file
+            mode (string): 'r' to read, 'w' to create a new file, 'a' to
+                append to an existing file.
+        '''
+
+        if mode not in ('r', 'w', 'a'):
+            raise ValueError('Invalid mode %r' % mode)
+
+        self.name = filepath
+        self._mode = mode
+        self._info = {}
+        self._ncols = 0
+        self._offset = 0
+
+        if mode == 'w':
+            self._file = open(filepath, 'w+b')
+            return
+
+        if mode == 'r':
+            self._file = open(filepath, 'rb')
+        else:
+            self._file = open(filepath, 'r+b')
+        self._read_header()
+
+        if mode == 'a':
+            # Drop incomplete last row
+            self._file.truncate(self._offset + self.get_nrows() * self._rowsize())
+            self._file.seek(0, os.SEEK_END)
+
+    def _rowsize(self):
+        return self._ncols * DTYPE.itemsize
+
+    def _read_header(self):
+        self._file.seek(0)
+        prefix = self._file.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError('File %s too short for binary data file' % self.name)
+
+        magic, version, ncols, offset = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError('File %s is not a binary data file' % self.name)
+        if version > VERSION:
+            raise ValueError('Unsupported binary data file version %d' % version)
+
+        header = self._file.read(offset - _PREFIX.size)
+        self._info = _encode_str(json.loads(header.rstrip(' ')))
+        self._ncols = ncols
+        self._offset = offset
+
+    def get_info(self):
+        '''Return the header info dictionary.'''
+        return self._info
+
+    def get_ncols(self):
+        return self._ncols
+
+    def get_nrows(self):
+        '''Return the number of complete rows in the file.'''
+
+        if self._ncols == 0:
+            return 0
+        size = os.fstat(self._file.fileno()).st_size
+        return max(size - self._offset, 0) / self._rowsize()
+
+    def write_header(self, info, ncols):
+        '''
+        Write the header. This is done in place if the reserved space is
+        large enough, otherwise the data body is moved.
+        '''
+
+        if self._ncols not in (0, ncols) and self.get_nrows() > 0:
+            raise ValueError('Unable to change number of columns of binary data file')
+
+        header = json.dumps(info, default=_json_default)
+        needed = _PREFIX.size + len(header)
+
+        if self._offset == 0:
+            offset = self._reserve(needed)
+        elif needed <= self._offset:
+            offset = self._offset
+        else:
+            offset = self._reserve(needed)
+            self._move_body(offset)
+
+        self._file.seek(0)
+        self._file.write(_PREFIX.pack(MAGIC, VERSION, ncols, offset))
+        self._file.write(header.ljust(offset - _PREFIX.size))
+        self._file.seek(0, os.SEEK_END)
+
+        self._info = info
+        self._ncols = ncols
+        self._offset = offset
+
+    def _reserve(self, size):
+        '''Return header size with room to grow, aligned to _ALIGN.'''
+        size = 2 * size
+        return (size + _ALIGN - 1) / _ALIGN * _ALIGN
+
+    def _move_body(self, offset):
+        logging.info('Moving data in %s to make room for header', self.name)
+
+        bodysize = self.get_nrows() * self._rowsize()
+        chunksize = 1 << 24
+        pos = bodysize
+        while pos > 0:
+            n = min(chunksize, pos)
+            pos -= n
+            self._file.seek(self._offset + pos)
+            chunk = self._file.read(n)
+            self._file.seek(offset + pos)
+            self._file.write(chunk)
+
+    def write(self, data):
+        '''Append raw data to the body.'''
+        self._file.write(data)
+
+    def append(self, rows):
+        '''Append rows (2D array-like) to the body.'''
+        self._file.write(numpy.asarray(rows, dtype=DTYPE).tostring())
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+
+    def get_data(self):
+        '''
+        Return the complete rows as a read-only numpy.memmap.
+        '''
+
+        self.flush()
+        nrows = self.get_nrows()
+        if nrows == 0:
+            return numpy.zeros((0, self._ncols), dtype=DTYPE)
+
+        return numpy.memmap(self.name, dtype=DTYPE, mode='r',
+                offset=self._offset, shape=(nrows, self._ncols))
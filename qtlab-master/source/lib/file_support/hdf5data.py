@@ -0,0 +1,261 @@
+'''
+HDF5 data file format (extension .hdf5) for Data objects, requires h5py.
+
+Layout:
+
+    /data               2D data set (rows x columns), chunked and resizable
+                        along the rows; rows are appended while measuring.
+        attrs:
+            filename, timestamp
+            comment     list of comment lines
+    /block_sizes        1D data set (resizable) with the sizes of the
+                        completed blocks, the rows of block n follow those
+                        of block n - 1. Appended to at every new block.
+    /dimensions/<n>     empty group per column n (zero-based, zero-padded),
+                        the dimension info is stored in its attributes.
+
+The header (attributes and dimensions) is written when the file is created
+and when it is closed. Older files store the block sizes in a 'block_sizes'
+attribute of /data, these can still be read.
+
+The interface is the same as that of binarydata.BinaryDataFile, so the
+Data class can use either one.
+'''
+
+import os
+import logging
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+EXT = '.hdf5'
+DTYPE = numpy.dtype('f8')
+SIGNATURE = '\x89HDF\r\n\x1a\n'
+
+CHUNK_ROWS = 1024
+CHUNK_BLOCKS = 256
+
+def _to_attr(val):
+    '''Convert a value to something that can be stored as attribute.'''
+    if val is None:
+        return ''
+    elif hasattr(val, 'get_name'):
+        return val.get_name()
+    elif isinstance(val, (bool, int, long, float, str, numpy.generic)):
+        return val
+    elif isinstance(val, unicode):
+        return val.encode('utf-8')
+    elif isinstance(val, (list, tuple, numpy.ndarray)):
+        try:
+            arr = numpy.asarray(val)
+            if arr.dtype.kind in 'biuf':
+                return arr
+        except ValueError:
+            pass
+        return [str(i) for i in val]
+    else:
+        return str(val)
+
+def _from_attr(val):
+    '''Convert an attribute value to a python type.'''
+    if isinstance(val, numpy.ndarray):
+        if val.dtype.kind in 'SO':
+            return [str(i) for i in val]
+        return val.tolist()
+    elif isinstance(val, numpy.generic):
+        return val.item()
+    elif isinstance(val, unicode):
+        try:
+            return str(val)
+        except UnicodeEncodeError:
+            return val
+    return val
+
+def is_hdf5_file(filepath):
+    '''Return whether filepath is a HDF5 file.'''
+
+    if os.path.splitext(filepath)[1] in (EXT, '.h5'):
+        return True
+    try:
+        f = open(filepath, 'rb')
+        sig = f.read(len(SIGNATURE))
+        f.close()
+    except IOError:
+        return False
+    return sig == SIGNATURE
+
+class HDF5DataFile():
+    '''
+    Class to read, write and append to HDF5 data files.
+    '''
+
+    def __init__(self, filepath, mode='r', compression=None):
+        '''
+        Open a HDF5 data file.
+
+        Input:
+            filepath (string): the file
+            mode (string): 'r' to read, 'w' to create a new file, 'a' to
+                append to an existing file.
+            compression (string): compression filter for new files, e.g.
+                'gzip' or 'lzf', default None
+        '''
+
+        if h5py is None:
+            raise ImportError('h5py is required for HDF5 data files')
+        if mode not in ('r', 'w', 'a'):
+            raise ValueError('Invalid mode %r' % mode)
+
+        self.name = filepath
+        self._mode = mode
+        self._compression = compression
+        self._info = {}
+        self._data = None
+
+        if mode == 'w':
+            self._file = h5py.File(filepath, 'w')
+            return
+
+        if mode == 'r':
+            self._file = h5py.File(filepath, 'r')
+        else:
+            self._file = h5py.File(filepath, 'r+')
+        self._read_header()
+
+    def _read_header(self):
+        if 'data' not in self._file:
+            raise ValueError('File %s is not a HDF5 data file' % self.name)
+
+        self._data = self._file['data']
+        info = {}
+        for k, v in self._data.attrs.iteritems():
+            info[str(k)] = _from_attr(v)
+
+        dims = []
+        if 'dimensions' in self._file:
+            group = self._file['dimensions']
+            for key in sorted(group.keys()):
+                dim = {}
+                for k, v in group[key].attrs.iteritems():
+                    dim[str(k)] = _from_attr(v)
+                dims.append(dim)
+        info['dimensions'] = dims
+        if 'block_sizes' in self._file:
+            info['block_sizes'] = self._file['block_sizes'][...].tolist()
+        if not isinstance(info.get('comment', []), list):
+            info['comment'] = [info['comment']]
+
+        self._info = info
+
+    def get_info(self):
+        '''Return the header info dictionary.'''
+        return self._info
+
+    def get_ncols(self):
+        if self._data is None:
+            return 0
+        return self._data.shape[1]
+
+    def get_nrows(self):
+        if self._data is None:
+            return 0
+        return self._data.shape[0]
+
+    def _create_data(self, ncols):
+        if self._data is not None:
+            if self.get_nrows() > 0:
+                raise ValueError('Unable to change number of columns of HDF5 data file')
+            del self._file['data']
+
+        self._data = self._file.create_dataset('data', shape=(0, ncols),
+                maxshape=(None, ncols), dtype=DTYPE,
+                chunks=(CHUNK_ROWS, max(ncols, 1)),
+                compression=self._compression)
+
+    def write_header(self, info, ncols):
+        '''
+        Write the header info: dimension info to the attributes of the
+        groups in /dimensions, the rest to the attributes of /data.
+        '''
+
+        if self._data is None or self.get_ncols() != ncols:
+            self._create_data(ncols)
+
+        attrs = self._data.attrs
+        for k, v in info.iteritems():
+            if k in ('dimensions', 'block_sizes'):
+                continue
+            if k == 'comment':
+                v = [str(i) for i in v]
+            attrs[k] = _to_attr(v)
+
+        if 'dimensions' in self._file:
+            del self._file['dimensions']
+        group = self._file.create_group('dimensions')
+        ndigits = len(str(max(len(info.get('dimensions', [])) - 1, 0)))
+        for i, dim in enumerate(info.get('dimensions', [])):
+            dimgroup = group.create_group(str(i).zfill(ndigits))
+            for k, v in dim.iteritems():
+                dimgroup.attrs[k] = _to_attr(v)
+
+        if 'block_sizes' in attrs:
+            del attrs['block_sizes']
+        sizes = info.get('block_sizes', [])
+        dset = self._get_block_sizes()
+        dset.resize((len(sizes), ))
+        if len(sizes) > 0:
+            dset[:] = sizes
+
+        self._info = info
+
+    def _get_block_sizes(self):
+        if 'block_sizes' not in self._file:
+            self._file.create_dataset('block_sizes', shape=(0, ),
+                    maxshape=(None, ), dtype='i8', chunks=(CHUNK_BLOCKS, ))
+        return self._file['block_sizes']
+
+    def add_block(self, size):
+        '''
+        Append the size of a completed block to /block_sizes, without
+        rewriting the rest of the header.
+        '''
+
+        dset = self._get_block_sizes()
+        nblocks = len(dset)
+        dset.resize((nblocks + 1, ))
+        dset[nblocks] = size
+
+    def append(self, rows):
+        '''Append rows (2D array-like) to the data set.'''
+
+        rows = numpy.asarray(rows, dtype=DTYPE)
+        if rows.ndim == 1:
+            rows = rows.reshape((1, len(rows)))
+        if self._data is None:
+            self._create_data(rows.shape[1])
+
+        start = self.get_nrows()
+        self._data.resize((start + len(rows), self.get_ncols()))
+        self._data[start:] = rows
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._data = None
+
+    def get_data(self):
+        '''
+        Return the data as numpy array.
+        '''
+
+        if self._data is None:
+            return numpy.zeros((0, 0), dtype=DTYPE)
+
+        return self._data[...]
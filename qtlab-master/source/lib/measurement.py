@@ -47,7 +47,10 @@ class Measurement(gobject.GObject):
         if name in qt.data:
             self._data = qt.data['name']
         else:
-            self._data = Data()
+            data_kwargs = {}
+            if 'file_format' in kwargs:
+                data_kwargs['file_format'] = kwargs['file_format']
+            self._data = Data(**data_kwargs)
 
     def get_data(self):
         return self._data
@@ -220,11 +223,15 @@ class Measurement(gobject.GObject):
         return extra_delay
 
     def _do_measurements(self):
+        # Read the instruments concurrently, then call the functions
+        items = [(m['ins'], m['var']) for m in self._measurements
+                if 'ins' in m]
+        values = qt.instruments.get_parallel(items)
+
         data = []
         for m in self._measurements:
             if 'ins' in m:
-                ins = m['ins']
-                data.append(ins.get(m['var']))
+                data.append(values.pop(0))
             elif 'func' in m:
                 func = m['func']
                 data.append(func())
@@ -21,25 +21,240 @@ try:
 except:
     import pickle
 import socket
+import errno
 import copy
 import random
 import inspect
 import time
 import gobject
 import types
+import threading
+import struct
+import collections
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 PORT = 12002
 BUFSIZE = 8192
 
+# Numpy arrays of at least this many bytes are sent as raw data after the
+# pickled packet instead of being pickled themselves.
+ARRAY_MIN_SIZE = 4096
+
 class RemoteException(Exception):
     pass
 
+class _ArrayRef():
+    '''
+    Placeholder for a numpy array that is sent as raw data. Offset is the
+    position of the data in the raw part of the packet.
+    '''
+
+    def __init__(self, offset, dtype, shape):
+        self.offset = offset
+        self.dtype = dtype
+        self.shape = shape
+
+class _RecvBuffer():
+    '''
+    Receive buffer of a connection. Data is received into a bytearray
+    between a read and a write position; consumed data is only moved or
+    the bytearray grown when the free space runs out, so buffering takes
+    O(n) time.
+    '''
+
+    SIZE = 65536
+
+    def __init__(self):
+        self.data = bytearray(self.SIZE)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, n):
+        '''Make room for at least n bytes after the write position.'''
+
+        if len(self.data) - self.end >= n:
+            return
+
+        navail = self.end - self.start
+        if self.start >= navail and navail + n <= len(self.data):
+            self.data[:navail] = self.data[self.start:self.end]
+        else:
+            data = bytearray(max(2 * len(self.data), navail + n))
+            data[:navail] = self.data[self.start:self.end]
+            self.data = data
+        self.start = 0
+        self.end = navail
+
+    def recv_into(self, conn):
+        '''Receive data from socket conn, returns the number of bytes.'''
+
+        self.reserve(BUFSIZE)
+        view = memoryview(self.data)[self.end:]
+        try:
+            n = conn.recv_into(view)
+        finally:
+            del view
+        self.end += n
+        return n
+
+    def add(self, data):
+        self.reserve(len(data))
+        self.data[self.end:self.end+len(data)] = data
+        self.end += len(data)
+
+    def peek(self, n):
+        return str(self.data[self.start:self.start+n])
+
+    def skip(self, n):
+        self.start += n
+        if self.start == self.end:
+            self.clear()
+
+    def take(self, n):
+        ret = memoryview(self.data)[self.start:self.start+n].tobytes()
+        self.skip(n)
+        return ret
+
+    def copy_to(self, buf, pos, n):
+        '''Move n bytes to bytearray buf at position pos.'''
+        view = memoryview(buf)
+        view[pos:pos+n] = memoryview(self.data)[self.start:self.start+n]
+        del view
+        self.skip(n)
+
+    def clear(self):
+        self.start = 0
+        self.end = 0
+        if len(self.data) > 4 * self.SIZE:
+            self.data = bytearray(self.SIZE)
+
+class _SendQueue():
+    '''
+    Send queue of a connection. A partially sent item is sent further
+    through a memoryview at an offset, so it is not copied.
+    '''
+
+    def __init__(self):
+        self.items = collections.deque()
+        self.offset = 0
+        self.nbytes = 0
+        self.dropped = 0
+
+    def append(self, item):
+        self.items.append(item)
+        self.nbytes += len(item)
+
+    def get_data(self):
+        '''Return the unsent part of the first item.'''
+        if self.offset > 0:
+            return memoryview(self.items[0])[self.offset:]
+        return self.items[0]
+
+    def sent(self, n):
+        '''Remove n sent bytes of the first item.'''
+        self.offset += n
+        self.nbytes -= n
+        if self.offset >= len(self.items[0]):
+            self.items.popleft()
+            self.offset = 0
+            return True
+        return False
+
+class CallFuture():
+    '''
+    Handle to a remote call made with ObjectSharer.call_async() or
+    ObjectSharer.call_batch_async(). The reply is received by the main
+    loop, or while waiting for this or any other call on the connection.
+    '''
+
+    def __init__(self, sharer, conn, batch=False):
+        self._sharer = sharer
+        self._conn = conn
+        self._batch = batch
+        self._callid = None
+        self._done = False
+        self._timed_out = False
+        self._return_value = None
+        self._callbacks = []
+
+    def _set_result(self, val):
+        if self._timed_out:
+            logging.warning('Received late reply for call %d', self._callid)
+        if self._batch and type(val) is types.ListType:
+            val = [self._sharer._resolve_return(v) for v in val]
+        self._return_value = val
+        self._done = True
+        for func in self._callbacks:
+            func(self)
+        self._callbacks = []
+
+    def is_done(self):
+        return self._done
+
+    def add_callback(self, func):
+        '''Call func(future) when the reply has been received.'''
+        if self._done:
+            func(self)
+        else:
+            self._callbacks.append(func)
+
+    def wait(self, timeout=None):
+        '''
+        Receive data until the reply arrives or <timeout> seconds
+        (default ObjectSharer.TIMEOUT) have passed. Returns whether the
+        reply was received.
+        '''
+
+        if not self._done:
+            if timeout is None:
+                timeout = self._sharer.TIMEOUT
+            self._sharer._wait_for(self._conn, self.is_done, timeout)
+        return self._done
+
+    def get_error(self):
+        '''
+        Return the exception of the remote function, for a batch the
+        first one, or None.
+        '''
+
+        if self._batch and type(self._return_value) is types.ListType:
+            for val in self._return_value:
+                if isinstance(val, Exception):
+                    return val
+        elif isinstance(self._return_value, Exception):
+            return self._return_value
+        return None
+
+    def get_return_value(self, timeout=None):
+        '''
+        Wait for the reply and return it, for a batch the list of return
+        values. Raises an exception if the remote function failed; returns
+        None if the call timed out.
+        '''
+
+        if not self.wait(timeout):
+            logging.warning('Blocking call %d timed out', self._callid)
+            self._timed_out = True
+            return None
+
+        err = self.get_error()
+        if err is not None:
+            raise Exception('Remote error: %s' % str(err))
+        return self._return_value
+
 class ObjectSharer():
     '''
     The object sharer containing both client and server functions.
     '''
 
     TIMEOUT = 2
+    SEND_QUEUE_LIMIT = 16 * 1024 * 1024
     server = None
 
     def __init__(self):
@@ -53,7 +268,6 @@ class ObjectSharer():
         self._last_hid = 0
         self._last_call_id = 0
         self._return_cbs = {}
-        self._return_vals = {}
 
         self._client_timeout = 60
 
@@ -62,9 +276,27 @@ class ObjectSharer():
         self._callbacks_name = {}
         self._event_callbacks = {}
 
+        # Signal subscriptions: on the client side the number of callbacks
+        # per (conn, objname, signame), on the server side the connections
+        # per (objname, signame) and the connections that use them.
+        self._subscribed_hids = {}
+        self._subscription_count = {}
+        self._subscriptions = {}
+        self._filtered_conns = set()
+        self._calling_conn = None
+        self._main_thread = threading.currentThread()
+        self._signals_sent = 0
+        self._signals_filtered = 0
+
         # Buffers to store partly received packets
         self._buffers = {}
+        self._raw_buffers = {}
         self._send_queue = {}
+        self._send_lock = threading.RLock()
+        self._send_hids = {}
+        self._transports = {}
+        self._send_queue_limit = self.SEND_QUEUE_LIMIT
+        self._dropped_signals = 0
 
     def set_client_timeout(self, timeout):
         '''
@@ -83,11 +315,24 @@ class ObjectSharer():
             return None
         client = ObjectProxy(conn, info)
         self._clients.append(client)
+
+        # Only receive signals we connected to
+        self.call(conn, 'root', 'set_signal_filter', True,
+            callback=self._subscription_reply_cb)
         name = client.get_instance_name()
         logging.info('Added client %r, name %s', client.get_id(), name)
         self._do_event_callbacks('connect', client)
         return client
 
+    def register_transport(self, conn, transport):
+        '''
+        Register that connection 'conn' is served by a transport with its
+        own I/O thread (see share_thread.py). The transport flushes the send
+        queue, and blocking calls wait by handling the data it received
+        through transport.dispatch() instead of reading the socket.
+        '''
+        self._transports[conn] = transport
+
     def get_client_for_socket(self, conn):
         for c in self.clients:
             if c.get_proxy_socket() == conn:
@@ -104,7 +349,9 @@ class ObjectSharer():
         '''
         Register callback cb for event. Event is one of:
         - connect: client connected
-        - disconnect: client disconnected
+        - disconnected: client disconnected
+        - connection-closed: a connection was closed, called with the
+          connection (also for peers that were not added as client)
         '''
 
         if event in self._event_callbacks:
@@ -127,6 +374,26 @@ class ObjectSharer():
 
         if conn in self._send_queue:
             del self._send_queue[conn]
+        if conn in self._send_hids:
+            gobject.source_remove(self._send_hids.pop(conn))
+        if conn in self._transports:
+            del self._transports[conn]
+
+        self._filtered_conns.discard(conn)
+        for conns in self._subscriptions.values():
+            conns.discard(conn)
+        for key in self._subscription_count.keys():
+            if key[0] == conn:
+                del self._subscription_count[key]
+        for hid, key in self._subscribed_hids.items():
+            if key[0] == conn:
+                del self._subscribed_hids[hid]
+        if conn in self._buffers:
+            del self._buffers[conn]
+        if conn in self._raw_buffers:
+            del self._raw_buffers[conn]
+
+        self._do_event_callbacks('connection-closed', conn)
 
     def get_clients(self):
         return self._clients
@@ -254,12 +521,88 @@ class ObjectSharer():
 
         return self.find_remote_object(objname)
 
+    def _extract_arrays(self, obj, buffers, depth=0):
+        '''
+        Replace numpy arrays of at least ARRAY_MIN_SIZE bytes in obj (and
+        in the tuples, lists and dicts it contains) by _ArrayRef
+        placeholders. The array data is appended to <buffers> as
+        memoryviews, so it is sent without copying.
+        '''
+
+        # Subclasses (e.g. masked arrays) and structured arrays are pickled,
+        # the raw data does not describe them completely
+        if type(obj) is numpy.ndarray:
+            if obj.nbytes < ARRAY_MIN_SIZE or obj.dtype.hasobject or \
+                    obj.dtype.fields is not None:
+                return obj
+            obj = numpy.ascontiguousarray(obj)
+            offset = sum([len(b) for b in buffers])
+            buffers.append(memoryview(obj.reshape(-1).view(numpy.uint8)))
+            return _ArrayRef(offset, obj.dtype.str, obj.shape)
+
+        if depth > 4:
+            return obj
+        if type(obj) in (types.TupleType, types.ListType):
+            ret = [self._extract_arrays(o, buffers, depth + 1) for o in obj]
+            if type(obj) is types.TupleType:
+                ret = tuple(ret)
+            return ret
+        if type(obj) is types.DictType:
+            ret = {}
+            for key, val in obj.iteritems():
+                ret[key] = self._extract_arrays(val, buffers, depth + 1)
+            return ret
+        return obj
+
+    def _restore_arrays(self, obj, data, offset, depth=0):
+        '''
+        Replace _ArrayRef placeholders in obj by arrays that use the raw
+        data in bytearray <data>, starting at <offset>, without copying.
+        '''
+
+        if isinstance(obj, _ArrayRef):
+            dtype = numpy.dtype(obj.dtype)
+            count = 1
+            for n in obj.shape:
+                count *= n
+            ar = numpy.frombuffer(data, dtype, count, offset + obj.offset)
+            return ar.reshape(obj.shape)
+
+        if depth > 4:
+            return obj
+        if type(obj) in (types.TupleType, types.ListType):
+            ret = [self._restore_arrays(o, data, offset, depth + 1) \
+                    for o in obj]
+            if type(obj) is types.TupleType:
+                ret = tuple(ret)
+            return ret
+        if type(obj) is types.DictType:
+            ret = {}
+            for key, val in obj.iteritems():
+                ret[key] = self._restore_arrays(val, data, offset, depth + 1)
+            return ret
+        return obj
+
     def _pickle_packet(self, info, data):
+        '''
+        Encode a packet. Returns the pickled string, or a tuple
+        (pickled string, list of buffers) if large numpy arrays are sent
+        as raw data.
+        '''
+
+        buffers = []
+        if numpy is not None:
+            data = self._extract_arrays(data, buffers)
+
         try:
-            retdata = pickle.dumps((info, data))
+            retdata = pickle.dumps((info, data), pickle.HIGHEST_PROTOCOL)
         except Exception, e:
             msg = 'Unable to encode object: %s' % str(e)
-            retdata = pickle.dumps((info, msg))
+            retdata = pickle.dumps((info, msg), pickle.HIGHEST_PROTOCOL)
+            buffers = []
+
+        if len(buffers) > 0:
+            return (retdata, buffers)
         return retdata
 
     def _unpickle_packet(self, data):
@@ -275,6 +618,38 @@ class ObjectSharer():
         retdata = self._pickle_packet(retinfo, retval)
         self.send_packet(conn, retdata)
 
+    def _get_buffer(self, conn):
+        buf = self._buffers.get(conn, None)
+        if buf is None:
+            buf = _RecvBuffer()
+            self._buffers[conn] = buf
+        return buf
+
+    def recv(self, conn):
+        '''
+        Receive the data available on connection 'conn' with recv_into()
+        and process complete packets. The data of a packet with raw array
+        data is received directly into the bytearray of the packet.
+
+        Output: the number of bytes received, 0 if the connection was
+        closed.
+        '''
+
+        raw = self._raw_buffers.get(conn, None)
+        if raw is not None:
+            view = memoryview(raw[0])[raw[1]:]
+            try:
+                n = conn.recv_into(view)
+            finally:
+                del view
+            raw[1] += n
+        else:
+            n = self._get_buffer(conn).recv_into(conn)
+
+        if n > 0:
+            self._process_buffer(conn)
+        return n
+
     def handle_data(self, conn, data):
         '''
         Handle incoming data from a connection and produce packets in the
@@ -282,36 +657,78 @@ class ObjectSharer():
         immediately.
         '''
 
-        if conn not in self._buffers:
-            self._buffers[conn] = ''
+        self._get_buffer(conn).add(data)
+        self._process_buffer(conn)
 
-        self._buffers[conn] = self._buffers[conn] + data
+    def _process_buffer(self, conn):
+        '''
+        Decode and handle the complete packets in the receive buffer of
+        a connection. Buffer state is looked up again after each packet,
+        because handling it may receive data from the same connection.
+        '''
 
-        # Decode complete packets
-        while len(self._buffers[conn]) >= 6:
-            b = self._buffers[conn]
+        while True:
+            raw = self._raw_buffers.get(conn, None)
+            if raw is not None:
+                # Packet with raw array data, filled by recv()
+                buf, pos, plen = raw
+                rbuf = self._buffers[conn]
+                n = min(len(rbuf), len(buf) - pos)
+                if n > 0:
+                    rbuf.copy_to(buf, pos, n)
+                    raw[1] = pos = pos + n
+                if pos < len(buf):
+                    return
+
+                del self._raw_buffers[conn]
+                try:
+                    packet = self._unpickle_packet(str(buf[:plen]))
+                    packet = self._restore_arrays(packet, buf, plen)
+                except Exception, e:
+                    logging.warning('Unable to decode packet with array data: %s', e)
+                    continue
+                self.handle_packet(conn, packet)
+                continue
+
+            rbuf = self._buffers.get(conn, None)
+            if rbuf is None or len(rbuf) < 6:
+                return
 
-            if b[0] != 'Q' or b[1] != 'T':
-                self._buffers[conn] = ''
+            magic = rbuf.peek(2)
+            if magic == 'QB':
+                if len(rbuf) < 10:
+                    return
+                plen, rawlen = struct.unpack('>II', rbuf.take(10)[2:])
+                self._raw_buffers[conn] = [bytearray(plen + rawlen), 0, plen]
+                continue
+
+            if magic != 'QT':
+                rbuf.clear()
                 logging.warning('Packet magic missing, dumping data')
-                return None
+                return
 
-            datalen = (ord(b[2]) << 24) + (ord(b[3]) << 16) + (ord(b[4]) << 8)  + ord(b[5])
-            if len(b) < datalen + 6:
+            datalen = struct.unpack('>I', rbuf.peek(6)[2:])[0]
+            if len(rbuf) < datalen + 6:
                 logging.debug('Incomplete packet received')
-                return None
-
-            packet = b[6:6+datalen]
-            self._buffers[conn] = b[6+datalen:]
+                return
 
+            rbuf.skip(6)
+            packet = rbuf.take(datalen)
             try:
                 packet = self._unpickle_packet(packet)
             except Exception, e:
                 logging.warning('Unable to unpickle packet')
-                return
+                continue
 
             self.handle_packet(conn, packet)
 
+    def _resolve_return(self, val):
+        if type(val) == types.StringType and val.startswith('sharedname:'):
+            sn = val[11:]
+            logging.debug('Received shared object reference, finding %s', sn)
+            val = helper.find_object(sn)
+        return val
+
     def handle_packet(self, conn, packet):
         '''
         Process an incoming packet
@@ -329,53 +746,62 @@ class ObjectSharer():
 
             func = self._return_cbs[callid]
             del self._return_cbs[callid]
-
-            if type(callinfo) == types.StringType and callinfo.startswith('sharedname:'):
-                sn = callinfo[11:]
-                logging.debug('Received shared object reference, finding %s', sn)
-                callinfo = helper.find_object(sn)
-
-            func(callinfo)
+            func(self._resolve_return(callinfo))
             return
 
-        elif info[0] not in ('call', 'signal'):
+        elif info[0] not in ('call', 'signal', 'batch'):
             logging.warning('Invalid request: %r, %r', info, callinfo)
             return False
 
-        (objname, funcname, args, kwargs) = callinfo
+        prev_conn = self._calling_conn
+        self._calling_conn = conn
+        try:
+            if info[0] == 'batch':
+                ret = [self._run_call(*c) for c in callinfo]
+            else:
+                ret = self._run_call(*callinfo)
+        finally:
+            self._calling_conn = prev_conn
+
+        if info[0] == 'signal':
+            # No need to send return
+            return
+
+        self._send_return(conn, info[1], ret)
+
+    def _run_call(self, objname, funcname, args, kwargs):
+        '''
+        Call a function of a local object for a remote caller. Returns the
+        return value to send back, or the exception if the call failed.
+        '''
+
         logging.debug('Handling: %s.%s(%r, %r)', objname, funcname, args, kwargs)
         if objname not in self._objects:
             msg = 'Object %s not available' % objname
             logging.warning(msg)
-            if info[0] != 'signal':
-                self._send_return(conn, info[1], ValueError(msg))
-            return None
+            return ValueError(msg)
 
         obj = self._objects[objname]
-        func = getattr(obj, funcname)
         try:
+            func = getattr(obj, funcname)
             ret = func(*args, **kwargs)
         except Exception, e:
             import traceback
             tb = traceback.format_exc(15)
             ret = RemoteException('%s\n%s' % (e, tb))
 
-        if info[0] == 'signal':
-            # No need to send return
-            return
-
         if isinstance(ret, SharedObject):
             sn = root.get_instance_name() + ':' + ret.get_shared_name()
             logging.debug('Returning a shared object reference: %s', sn)
             ret = 'sharedname:' + sn
 
-        self._send_return(conn, info[1], ret)
+        return ret
 
     def _do_send_raw(self, conn, data):
         try:
             ret = conn.send(data)
         except socket.error, e:
-            if e.errno not in (10035, ):
+            if e.errno not in (10035, errno.EAGAIN, errno.EWOULDBLOCK):
                 logging.warning('Send exception (%s), assuming client disconnected', e)
                 self._client_disconnected(conn)
                 return -1
@@ -388,117 +814,281 @@ class ObjectSharer():
         Process send queue on a per connection basis.
         '''
 
-        for conn in self._send_queue.keys():
-            datalist = self._send_queue[conn]
-            while len(datalist) > 0:
-                nsent = self._do_send_raw(conn, datalist[0])
+        self._send_lock.acquire()
+        try:
+            self._do_process_send_queue()
+        finally:
+            self._send_lock.release()
+        return True
 
-                # Ok
-                if nsent == len(datalist[0]):
-                    del datalist[0]
+    def _do_process_send_queue(self):
+        for conn, queue in self._send_queue.items():
+            while len(queue.items) > 0:
+                nsent = self._do_send_raw(conn, queue.get_data())
 
                 # Failed, signals disconnection so remove send queue
-                elif nsent == -1:
+                if nsent == -1:
                     if conn in self._send_queue:
                         del self._send_queue[conn]
                     break
 
-                # Partially sent
-                else:
-                    datalist[0] = datalist[0][nsent:]
+                # Partially sent, wait until the socket is writable
+                if not queue.sent(nsent):
+                    self._watch_send(conn)
                     break
 
-        return True
-
-    def send_packet(self, conn, data):
-        dlen = len(data)
-        if dlen > 0xffffffffL:
-            logging.error('Trying to send too long packet: %d', dlen)
-            return -1
+    def flush_send_queue(self, conn):
+        '''
+        Send as much of the send queue of connection 'conn' as the socket
+        accepts. Used by transports with their own I/O thread; errors are
+        only reported, the transport has the main thread close the
+        connection.
 
-        tosend = 'QT%c%c%c%c' % ((dlen&0xff000000)>>24, \
-            (dlen&0x00ff0000)>>16, (dlen&0x0000ff00)>>8, (dlen&0x000000ff))
-        tosend += data
+        Output: False if sending failed
+        '''
 
-        if conn not in self._send_queue:
-            self._send_queue[conn] = []
-        self._send_queue[conn].append(tosend)
+        self._send_lock.acquire()
+        try:
+            queue = self._send_queue.get(conn, None)
+            while queue is not None and len(queue.items) > 0:
+                try:
+                    nsent = conn.send(queue.get_data())
+                except socket.error, e:
+                    if e.errno in (10035, errno.EAGAIN, errno.EWOULDBLOCK):
+                        return True
+                    logging.warning('Send exception (%s), closing connection', e)
+                    return False
+                if not queue.sent(nsent):
+                    break
+            return True
+        finally:
+            self._send_lock.release()
+
+    def _watch_send(self, conn):
+        transport = self._transports.get(conn, None)
+        if transport is not None:
+            transport.wake()
+        elif conn not in self._send_hids:
+            self._send_hids[conn] = gobject.io_add_watch(conn,
+                    gobject.IO_OUT, self._send_ready_cb)
+
+    def _send_ready_cb(self, conn, condition):
         self._process_send_queue()
+        queue = self._send_queue.get(conn, None)
+        if queue is not None and queue.nbytes > 0:
+            return True
+        if conn in self._send_hids:
+            del self._send_hids[conn]
+        return False
+
+    def set_send_queue_limit(self, nbytes):
+        '''
+        Set the high-water mark of the send queue of a connection. While
+        more than <nbytes> bytes are waiting for a slow client, signals to
+        that client are dropped instead of queued. Calls and replies are
+        always queued.
+        '''
+        self._send_queue_limit = nbytes
 
-    def _call_cb(self, callid, val):
-        if callid in self._return_vals:
-            logging.warning('Received late reply for call %d', callid)
-            del self._return_vals[callid]
-        else:
-            self._return_vals[callid] = val
+    def get_send_queue_limit(self):
+        return self._send_queue_limit
 
-    def call(self, conn, objname, funcname, *args, **kwargs):
+    def get_send_queue_size(self, conn=None):
         '''
-        Call a function through connection 'conn'
+        Return the number of bytes waiting to be sent to connection 'conn',
+        or to all connections if conn is None.
         '''
 
-        cb = kwargs.pop('callback', None)
-        is_signal = kwargs.pop('signal', False)
-        timeout = kwargs.pop('timeout', self.TIMEOUT)
-        blocking = (cb is None and not is_signal)
+        if conn is not None:
+            queue = self._send_queue.get(conn, None)
+            if queue is None:
+                return 0
+            return queue.nbytes
+        return sum([q.nbytes for q in self._send_queue.values()])
 
-        if not is_signal:
-            self._last_call_id += 1
-            callid = self._last_call_id
-            if cb is not None:
-                self._return_cbs[callid] = cb
-            else:
-                self._return_cbs[callid] = lambda val: self._call_cb(callid, val)
+    def get_dropped_signals(self):
+        '''Return the number of signals dropped for slow clients.'''
+        return self._dropped_signals
 
-            info = ('call', callid)
+    def send_packet(self, conn, data, signal=False):
+        '''
+        Queue a packet for sending. Data is a pickled string, or a tuple
+        (pickled string, list of buffers) from _pickle_packet(); the
+        buffers are queued as they are and sent after the pickled data.
+        If signal is True the packet is dropped when the send queue of
+        the connection is above the limit.
+        '''
+
+        if type(data) is types.TupleType:
+            data, buffers = data
+            rawlen = sum([len(b) for b in buffers])
         else:
-            cb = None
-            info = ('signal', )
+            buffers = []
+            rawlen = 0
 
-        logging.debug('Calling %s.%s(%r, %r), info=%r, blocking=%r', objname, funcname, args, kwargs, info, blocking)
+        dlen = len(data)
+        if dlen > 0xffffffffL or rawlen > 0xffffffffL:
+            logging.error('Trying to send too long packet: %d', dlen + rawlen)
+            return -1
 
-        callinfo = (objname, funcname, args, kwargs)
-        cmd = self._pickle_packet(info, callinfo)
-        start_time = time.time()
-        self.send_packet(conn, cmd)
+        if len(buffers) > 0:
+            tosend = ['QB' + struct.pack('>II', dlen, rawlen) + data]
+            tosend.extend(buffers)
+        else:
+            tosend = ['QT' + struct.pack('>I', dlen) + data]
 
-        if not blocking:
-            return
+        # Instruments may be created in worker threads, keep packets intact
+        self._send_lock.acquire()
+        try:
+            queue = self._send_queue.get(conn, None)
+            if queue is None:
+                queue = _SendQueue()
+                self._send_queue[conn] = queue
+
+            if queue.nbytes > self._send_queue_limit:
+                if signal:
+                    if queue.dropped == 0:
+                        logging.warning('Client not keeping up (%d bytes queued), dropping signals',
+                            queue.nbytes)
+                    queue.dropped += 1
+                    self._dropped_signals += 1
+                    return 0
+            elif queue.dropped > 0:
+                logging.warning('Dropped %d signals for slow client',
+                    queue.dropped)
+                queue.dropped = 0
+
+            for item in tosend:
+                queue.append(item)
+            self._process_send_queue()
+        finally:
+            self._send_lock.release()
+
+    def _new_call_id(self, cb):
+        self._send_lock.acquire()
+        try:
+            self._last_call_id += 1
+            callid = self._last_call_id
+            self._return_cbs[callid] = cb
+        finally:
+            self._send_lock.release()
+        return callid
 
-        # Wait for return
-        while time.time() - start_time < timeout:
-            if callid in self._return_vals:
+    def _wait_for(self, conn, done, timeout):
+        '''
+        Receive and send data on connection 'conn' until done() returns
+        True or <timeout> seconds have passed. Replies to other calls and
+        signals received meanwhile are handled as well.
+        '''
+
+        import select
+        end_time = time.time() + timeout
+        while not done():
+            remaining = end_time - time.time()
+            if remaining <= 0:
                 break
 
+            transport = self._transports.get(conn, None)
+            if transport is not None:
+                transport.dispatch(min(remaining, 0.1))
+                if conn not in self._transports:
+                    break
+                continue
+
             # Don't depend on a main loop to receive data while blocking
-            import select
-            lists = select.select([conn], [], [], 0.1)
+            if self.get_send_queue_size(conn) > 0:
+                wlist = [conn]
+            else:
+                wlist = []
+            lists = select.select([conn], wlist, [], min(remaining, 0.1))
+            if len(lists[1]) > 0:
+                self._process_send_queue()
             if len(lists[0]) > 0:
                 try:
-                    data = conn.recv(BUFSIZE)
-                except:
+                    n = self.recv(conn)
+                except socket.error:
                     # Cope with strange windows errors?
                     time.sleep(0.002)
                     continue
 
-                if len(data) == 0:
+                if n == 0:
                     self._client_disconnected(conn)
-                    return
-                self.handle_data(conn, data)
-            else:
-                time.sleep(0.002)
+                    break
 
-        if callid in self._return_vals:
-            ret = self._return_vals[callid]
-            del self._return_vals[callid]
-            if isinstance(ret, Exception):
-                raise Exception('Remote error: %s' % str(ret))
-            return ret
+    def call(self, conn, objname, funcname, *args, **kwargs):
+        '''
+        Call a function through connection 'conn'. Blocks until the reply
+        arrives, unless a callback or signal=True is specified.
+        '''
+
+        cb = kwargs.pop('callback', None)
+        is_signal = kwargs.pop('signal', False)
+        timeout = kwargs.pop('timeout', self.TIMEOUT)
+
+        if cb is None and not is_signal:
+            future = self.call_async(conn, objname, funcname, *args, **kwargs)
+            return future.get_return_value(timeout)
+
+        if not is_signal:
+            info = ('call', self._new_call_id(cb))
         else:
-            logging.warning('Blocking call %d timed out', callid)
-            self._return_vals[callid] = None    # Mark as timed out
+            info = ('signal', )
+        self._send_call(conn, info, objname, funcname, args, kwargs)
 
-        return None
+    def _send_call(self, conn, info, objname, funcname, args, kwargs):
+        logging.debug('Calling %s.%s(%r, %r), info=%r', objname, funcname, args, kwargs, info)
+
+        callinfo = (objname, funcname, args, kwargs)
+        cmd = self._pickle_packet(info, callinfo)
+        self.send_packet(conn, cmd, signal=(info[0] == 'signal'))
+
+    def call_async(self, conn, objname, funcname, *args, **kwargs):
+        '''
+        Call a function through connection 'conn' without waiting for the
+        reply. Any number of calls can be in flight on a connection.
+
+        Output: CallFuture
+        '''
+
+        future = CallFuture(self, conn)
+        future._callid = self._new_call_id(future._set_result)
+        self._send_call(conn, ('call', future._callid), objname, funcname,
+                args, kwargs)
+        return future
+
+    def call_batch_async(self, conn, calls):
+        '''
+        Send several calls through connection 'conn' in one packet. They
+        are executed in order by the remote side, which returns all
+        results in one reply.
+
+        Input:
+            calls (list): tuples (objname, funcname, args) or
+                (objname, funcname, args, kwargs)
+
+        Output: CallFuture, its return value is the list of results
+        '''
+
+        callinfo = []
+        for c in calls:
+            if len(c) == 3:
+                c = (c[0], c[1], c[2], {})
+            callinfo.append((c[0], c[1], tuple(c[2]), c[3]))
+
+        future = CallFuture(self, conn, batch=True)
+        future._callid = self._new_call_id(future._set_result)
+        info = ('batch', future._callid)
+        logging.debug('Calling batch of %d, info=%r', len(callinfo), info)
+        self.send_packet(conn, self._pickle_packet(info, callinfo))
+        return future
+
+    def call_batch(self, conn, calls, timeout=None):
+        '''
+        Perform several calls in one round trip, see call_batch_async().
+        Returns the list of results; raises an exception if any of the
+        calls failed.
+        '''
+        return self.call_batch_async(conn, calls).get_return_value(timeout)
 
     def connect(self, objname, signame, callback, *args, **kwargs):
         '''
@@ -533,13 +1123,112 @@ class ObjectSharer():
                     del self._callbacks_name[name][index]
                     break
 
+        if hid in self._subscribed_hids:
+            key = self._subscribed_hids.pop(hid)
+            self._subscription_count[key] -= 1
+            if self._subscription_count[key] == 0:
+                del self._subscription_count[key]
+                self.call(key[0], 'root', 'unsubscribe_signal', key[1],
+                    key[2], callback=self._subscription_reply_cb)
+
+    def subscribe(self, conn, objname, signame, hid):
+        '''
+        Ask the other side of connection 'conn' to send signal <signame>
+        of object <objname>, for callback <hid> from connect(). The
+        subscription ends when the callback is disconnected.
+        '''
+
+        key = (conn, objname, signame)
+        self._subscribed_hids[hid] = key
+        n = self._subscription_count.get(key, 0)
+        self._subscription_count[key] = n + 1
+        if n == 0:
+            self.call(conn, 'root', 'subscribe_signal', objname, signame,
+                callback=self._subscription_reply_cb)
+
+    def _subscription_reply_cb(self, val):
+        # Older peers do not know about subscriptions and send everything
+        if isinstance(val, Exception):
+            logging.debug('Signal subscription not supported: %s', val)
+
+    def get_calling_connection(self):
+        '''Return the connection of the remote call being handled.'''
+        return self._calling_conn
+
+    def set_signal_filter(self, conn, enable):
+        '''
+        Send only the signals that connection 'conn' subscribed to
+        (enable=True), or all signals.
+        '''
+        if enable:
+            self._filtered_conns.add(conn)
+        else:
+            self._filtered_conns.discard(conn)
+
+    def add_subscription(self, conn, objname, signame):
+        key = (objname, signame)
+        if key not in self._subscriptions:
+            self._subscriptions[key] = set()
+        self._subscriptions[key].add(conn)
+
+    def remove_subscription(self, conn, objname, signame):
+        key = (objname, signame)
+        if key in self._subscriptions:
+            self._subscriptions[key].discard(conn)
+            if len(self._subscriptions[key]) == 0:
+                del self._subscriptions[key]
+
+    def get_subscriptions(self):
+        '''
+        Return a dictionary 'objname.signame' -> number of connections
+        subscribed to that signal.
+        '''
+        ret = {}
+        for (objname, signame), conns in self._subscriptions.iteritems():
+            ret['%s.%s' % (objname, signame)] = len(conns)
+        return ret
+
+    def get_signal_stats(self):
+        '''
+        Return the number of signal packets sent, filtered because the
+        client did not subscribe, and dropped because the client was too
+        slow.
+        '''
+        return {
+            'sent': self._signals_sent,
+            'filtered': self._signals_filtered,
+            'dropped': self._dropped_signals,
+        }
+
     def emit_signal(self, objname, signame, *args, **kwargs):
+        # Signals emitted in other threads are sent from the main loop
+        if threading.currentThread() is not self._main_thread:
+            gobject.idle_add(self._idle_emit_signal, objname, signame,
+                    args, kwargs)
+            return
+
         logging.debug('Emitting %s(%r, %r) for %s to %d clients',
                 signame, args, kwargs, objname, len(self._clients))
 
-        kwargs['signal'] = True
+        # Pickle once for all interested clients
+        subscribers = self._subscriptions.get((objname, signame), ())
+        cmd = None
         for client in self._clients:
-            client.receive_signal(objname, signame, *args, **kwargs)
+            conn = client.get_connection()
+            if conn in self._filtered_conns and conn not in subscribers:
+                self._signals_filtered += 1
+                continue
+
+            if cmd is None:
+                callinfo = ('root', 'receive_signal',
+                    (objname, signame) + args, kwargs)
+                cmd = self._pickle_packet(('signal', ), callinfo)
+            self._signals_sent += 1
+            self.send_packet(conn, cmd, signal=True)
+
+    def _idle_emit_signal(self, objname, signame, args, kwargs):
+        self.emit_signal(objname, signame, *args, **kwargs)
+        return False
 
     def receive_signal(self, objname, signame, *args, **kwargs):
         logging.debug('Received signal %s(%r, %r) from %s',
@@ -688,6 +1377,19 @@ class SharedGObject(gobject.GObject, SharedObject):
         else:
             return gobject.GObject.emit(self, signal, *args, **kwargs)
 
+    def emit_shared(self, signal, shared_args, *args):
+        '''
+        Emit signal with arguments *args to local handlers and with the
+        arguments in tuple shared_args to remote clients. If shared_args
+        is None the signal is not sent to remote clients.
+        '''
+        if shared_args is not None:
+            SharedObject.emit(self, signal, None, *shared_args)
+        if self._do_idle_emit:
+            gobject.idle_add(self._idle_emit, signal, *args)
+        else:
+            return gobject.GObject.emit(self, signal, *args)
+
     def disconnect(self, ghid):
         if ghid not in self.__hid_map:
             return
@@ -720,6 +1422,11 @@ class _FunctionCall():
             self._cached_result = ret
         return ret
 
+    def call_async(self, *args, **kwargs):
+        '''Call the remote function without waiting, returns a CallFuture.'''
+        return helper.call_async(self._conn, self._objname, self._funcname,
+                *args, **kwargs)
+
 class ObjectProxy():
     '''
     Client side object proxy.
@@ -744,11 +1451,25 @@ class ObjectProxy():
         return self.__conn
 
     def connect(self, signame, func):
-        return helper.connect(self.__name, signame, func)
+        hid = helper.connect(self.__name, signame, func)
+        helper.subscribe(self.__conn, self.__name, signame, hid)
+        return hid
 
     def disconnect(self, hid):
         return helper.disconnect(hid)
 
+    def call_batch(self, calls, timeout=None):
+        '''
+        Call several functions of the remote object in one round trip.
+
+        Input:
+            calls (list): tuples (funcname, args) or (funcname, args, kwargs)
+
+        Output: list of return values
+        '''
+        calls = [(self.__name, ) + tuple(c) for c in calls]
+        return helper.call_batch(self.__conn, calls, timeout=timeout)
+
     def get_proxy_client(self):
         '''Return the client where this proxy is pointing to'''
         return helper.get_client_for_socket(self.__conn)
@@ -796,6 +1517,19 @@ class RootObject(SharedObject):
     def receive_signal(self, objname, signame, *args, **kwargs):
         helper.receive_signal(objname, signame, *args, **kwargs)
 
+    def set_signal_filter(self, enable):
+        '''Only send the signals the caller subscribed to.'''
+        helper.set_signal_filter(helper.get_calling_connection(), enable)
+
+    def subscribe_signal(self, objname, signame):
+        '''Send signal <signame> of object <objname> to the caller.'''
+        helper.add_subscription(helper.get_calling_connection(),
+            objname, signame)
+
+    def unsubscribe_signal(self, objname, signame):
+        helper.remove_subscription(helper.get_calling_connection(),
+            objname, signame)
+
     def list_objects(self):
         return self._objects.keys()
 
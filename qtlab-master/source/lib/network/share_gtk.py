@@ -17,6 +17,18 @@ class Handler(tcpservergtk.GlibTCPHandler):
             data = objsh.helper.handle_data(self.socket, data)
         return True
 
+    def _handle_recv(self, sock, condition):
+        # Let the object sharer receive into its own buffers
+        try:
+            n = objsh.helper.recv(self.socket)
+        except socket.error, e:
+            return True
+
+        if n == 0:
+            self._handle_hup()
+            return False
+        return True
+
 _flush_queue_hid = None
 
 def setup_glib_flush_queue():
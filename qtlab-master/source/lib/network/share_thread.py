@@ -0,0 +1,331 @@
+# share_thread.py, object sharer transport with socket I/O in its own thread
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import object_sharer as objsh
+import socket
+import errno
+import select
+import threading
+import collections
+import logging
+import time
+import re
+
+RECV_SIZE = 65536
+
+def _make_wakeup_pair():
+    '''Return a connected pair of sockets (no socketpair() on Windows).'''
+
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sock1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock1.connect(listener.getsockname())
+    sock2, addr = listener.accept()
+    listener.close()
+    return sock1, sock2
+
+class ThreadTransport():
+    '''
+    Transport for the object sharer that performs all socket I/O in its
+    own thread. A single select() loop accepts connections, receives the
+    data of all connections and flushes the send queues when sockets
+    become writable.
+
+    Received data is handled in the main thread, through a queue guarded
+    by a lock and a socket pair to signal new items. With bridge='gobject'
+    the queue is processed from a gobject idle callback. With bridge=None
+    nothing depends on a gobject or GTK main loop: the program calls
+    dispatch() to handle the data, which allows headless instances and
+    monitoring clients. Closed connections are also handled in the main
+    thread, the I/O thread only reports them.
+    '''
+
+    def __init__(self, bridge='gobject'):
+        self._bridge = bridge
+        if bridge == 'gobject':
+            import gobject
+            gobject.threads_init()
+
+        self._conns = {}
+        self._listeners = []
+        self._allowed_ips = []
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._idle_pending = False
+        self._stop = False
+
+        self._wake_recv, self._wake_send = _make_wakeup_pair()
+        self._wake_recv.setblocking(0)
+        self._notify_recv, self._notify_send = _make_wakeup_pair()
+        self._notify_recv.setblocking(0)
+        self._notify_send.setblocking(0)
+
+        self._thread = threading.Thread(target=self._run,
+                name='object_sharer_io')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def listen(self, host='', port=objsh.PORT):
+        '''Accept connections on (host, port).'''
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(5)
+        sock.setblocking(0)
+        self._lock.acquire()
+        self._listeners.append(sock)
+        self._lock.release()
+        self.wake()
+
+    def add_allowed_ip(self, ip_regexp):
+        self._allowed_ips.append(re.compile(ip_regexp))
+
+    def allow_client(self, ip):
+        for regexp in self._allowed_ips:
+            if regexp.match(ip):
+                return True
+        return False
+
+    def connect(self, host, port=objsh.PORT):
+        '''
+        Connect to an object sharer server and add it as a client.
+
+        Output: the client root object proxy, or None
+        '''
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((host, port))
+        self._add_connection(sock, (host, port))
+        return objsh.helper.add_client(sock, self)
+
+    def _add_connection(self, sock, addr):
+        sock.setblocking(0)
+        objsh.helper.register_transport(sock, self)
+        self._lock.acquire()
+        self._conns[sock] = addr
+        self._lock.release()
+        self.wake()
+
+    def close(self):
+        '''Stop the I/O thread and close all sockets.'''
+
+        self._stop = True
+        self.wake()
+        self._thread.join(2)
+        for sock in self._listeners + self._conns.keys():
+            sock.close()
+        for sock in (self._wake_recv, self._wake_send, self._notify_recv,
+                self._notify_send):
+            sock.close()
+        self._listeners = []
+        self._conns = {}
+
+    def wake(self):
+        '''Interrupt select() to update the socket lists.'''
+        try:
+            self._wake_send.send('x')
+        except socket.error:
+            pass
+
+    def _run(self):
+        while not self._stop:
+            self._lock.acquire()
+            listeners = list(self._listeners)
+            conns = self._conns.keys()
+            self._lock.release()
+
+            wlist = [c for c in conns if objsh.helper.get_send_queue_size(c) > 0]
+            rlist = [self._wake_recv] + listeners + conns
+            try:
+                rlist, wlist, elist = select.select(rlist, wlist, [], 1.0)
+            except (select.error, socket.error), e:
+                # A socket was closed by another thread
+                self._remove_closed()
+                continue
+
+            for sock in rlist:
+                if sock is self._wake_recv:
+                    try:
+                        sock.recv(4096)
+                    except socket.error:
+                        pass
+                elif sock in listeners:
+                    self._accept(sock)
+                else:
+                    self._recv(sock)
+
+            for sock in wlist:
+                if not objsh.helper.flush_send_queue(sock):
+                    self._close_connection(sock)
+
+    def _remove_closed(self):
+        self._lock.acquire()
+        closed = []
+        for sock in self._conns.keys():
+            try:
+                sock.fileno()
+                select.select([sock], [], [], 0)
+            except (select.error, socket.error):
+                closed.append(sock)
+        self._lock.release()
+
+        for sock in closed:
+            self._close_connection(sock)
+
+    def _close_connection(self, sock):
+        '''Stop serving sock and let the main thread clean up.'''
+
+        self._lock.acquire()
+        if sock not in self._conns:
+            self._lock.release()
+            return
+        del self._conns[sock]
+        self._lock.release()
+        self._post(('close', sock))
+
+    def _accept(self, listener):
+        try:
+            sock, addr = listener.accept()
+        except socket.error, e:
+            return
+        if not self.allow_client(addr[0]):
+            logging.warning('Not allowing connection from %s', addr)
+            sock.close()
+            return
+
+        logging.info('Allowing connection from %s', addr)
+        self._add_connection(sock, addr)
+        self._post(('accept', sock))
+
+    def _recv(self, sock):
+        try:
+            data = sock.recv(RECV_SIZE)
+        except socket.error, e:
+            if e.errno in (10035, errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            logging.warning('Receive error (%s), closing connection', e)
+            data = ''
+
+        if len(data) == 0:
+            self._close_connection(sock)
+        else:
+            self._post(('data', sock, data))
+
+    def _post(self, item):
+        self._lock.acquire()
+        try:
+            self._queue.append(item)
+            if self._bridge == 'gobject' and not self._idle_pending:
+                import gobject
+                self._idle_pending = True
+                gobject.idle_add(self._idle_dispatch)
+        finally:
+            self._lock.release()
+
+        # If the socket buffer is full a wakeup is pending anyway
+        try:
+            self._notify_send.send('x')
+        except socket.error:
+            pass
+
+    def _pop(self):
+        self._lock.acquire()
+        try:
+            if len(self._queue) > 0:
+                return self._queue.popleft()
+            return None
+        finally:
+            self._lock.release()
+
+    def _idle_dispatch(self):
+        self._lock.acquire()
+        self._idle_pending = False
+        self._lock.release()
+        self.dispatch()
+        return False
+
+    def dispatch(self, timeout=0):
+        '''
+        Handle received data and new or closed connections in the calling
+        thread, waiting at most <timeout> seconds for something to arrive.
+
+        Output: the number of events handled
+        '''
+
+        n = 0
+        while True:
+            try:
+                self._notify_recv.recv(4096)
+            except socket.error:
+                pass
+
+            item = self._pop()
+            if item is None:
+                if n > 0 or timeout <= 0:
+                    return n
+                select.select([self._notify_recv], [], [], timeout)
+                timeout = 0
+                continue
+
+            n += 1
+            if item[0] == 'data':
+                objsh.helper.handle_data(item[1], item[2])
+            elif item[0] == 'accept':
+                objsh.helper.add_client(item[1], self)
+            elif item[0] == 'close':
+                objsh.helper._client_disconnected(item[1])
+                item[1].close()
+
+    def run(self):
+        '''Handle events until close() is called, for headless use.'''
+        while not self._stop:
+            self.dispatch(1)
+
+_transport = None
+
+def get_transport(bridge='gobject'):
+    global _transport
+    if _transport is None:
+        _transport = ThreadTransport(bridge)
+    return _transport
+
+def start_server(host='', port=objsh.PORT, bridge='gobject'):
+    try:
+        transport = get_transport(bridge)
+        transport.add_allowed_ip('127.0.0.1')
+        transport.listen(host, port)
+        objsh.SharedObject.server = transport
+        return True
+    except Exception, e:
+        logging.warning('Failed to start sharing server: %s', str(e))
+        return False
+
+def start_client(host, port=objsh.PORT, nretry=1, bridge='gobject'):
+    while nretry > 0:
+        try:
+            return get_transport(bridge).connect(host, port)
+        except Exception, e:
+            logging.warning('Failed to start sharing client: %s', str(e))
+            nretry -= 1
+            if nretry > 0:
+                logging.info('Retrying in 2 seconds...')
+                time.sleep(2)
+    return False
@@ -55,3 +55,15 @@ class QtQtlabHandler(QtTCPHandler):
         if len(data) > 0:
             data = helper.handle_data(self.socket, data)
         return True
+
+    def _handle_recv(self, sock, condition):
+        # Let the object sharer receive into its own buffers
+        try:
+            n = helper.recv(self.socket)
+        except socket.error, e:
+            return True
+
+        if n == 0:
+            self._handle_hup()
+            return False
+        return True
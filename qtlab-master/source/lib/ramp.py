@@ -0,0 +1,270 @@
+# ramp.py, ramp instrument parameters without blocking
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import gobject
+import logging
+
+from misc import exact_time
+
+class Ramp():
+    '''
+    Ramp of an instrument parameter with a maximum step size and a delay
+    between the steps. The steps are performed from gobject timeouts, so
+    the main loop stays responsive and several ramps can run at the same
+    time. Ramps are created by Instrument.set(); use wait() or
+    qt.flow.measurement_idle() (qt.msleep) to let them progress.
+    '''
+
+    def __init__(self, ins, name, value, maxstep, delay, func, kwargs):
+        '''
+        Input:
+            ins (Instrument): the instrument
+            name (string): the parameter
+            value: the final value
+            maxstep (float): maximum step size
+            delay (float): delay between steps in ms
+            func (function): function to set a value, called as
+                func(value, **kwargs)
+            kwargs (dict): extra arguments for func
+        '''
+
+        self._ins = ins
+        self._name = name
+        self._value = value
+        self._maxstep = float(maxstep)
+        self._delay = delay
+        self._func = func
+        self._kwargs = kwargs
+
+        self._hid = None
+        self._status = 'running'
+        self._error = None
+        self._nsteps = 0
+        self._callbacks = []
+        self._start_time = exact_time()
+
+        self._curval = ins.get_parameter_options(name)['value']
+
+    def __repr__(self):
+        return "Ramp of %s.%s to %s (%s)" % \
+            (self._ins.get_name(), self._name, self._value, self._status)
+
+    def get_instrument(self):
+        return self._ins
+
+    def get_name(self):
+        '''Return the name of the ramped parameter.'''
+        return self._name
+
+    def get_target(self):
+        '''Return the final value of the ramp.'''
+        return self._value
+
+    def get_value(self):
+        '''Return the last value that was set.'''
+        return self._curval
+
+    def get_status(self):
+        '''Return status, one of 'running', 'done', 'aborted', 'error'.'''
+        return self._status
+
+    def get_nsteps(self):
+        '''Return the number of steps performed so far.'''
+        return self._nsteps
+
+    def is_done(self):
+        '''Return whether the ramp has finished, was aborted or failed.'''
+        return self._status != 'running'
+
+    def add_callback(self, func):
+        '''Call func(ramp) when the ramp has finished.'''
+        if self.is_done():
+            func(self)
+        else:
+            self._callbacks.append(func)
+
+    def start(self):
+        '''Perform the first step and schedule the rest.'''
+
+        if self._curval is None:
+            logging.warning('Current value not available, ignoring maxstep')
+            self._curval = self._value
+        elif self._curval == self._value:
+            self._ins._store_set_value(self._name, self._value,
+                    **self._kwargs)
+            self._ins._queue_changed_value(self._name, self._value)
+            self._finish('done')
+            return
+
+        if self._step() and self._status == 'running':
+            self._hid = gobject.timeout_add(int(self._delay), self._step)
+
+    def _step(self):
+        delta = self._value - self._curval
+        if delta > self._maxstep:
+            curval = self._curval + self._maxstep
+        elif delta < -self._maxstep:
+            curval = self._curval - self._maxstep
+        else:
+            curval = self._value
+
+        try:
+            self._func(curval, **self._kwargs)
+        except Exception, e:
+            logging.error('Error while ramping %s.%s: %s',
+                self._ins.get_name(), self._name, e)
+            self._error = e
+            self._finish('error')
+            return False
+
+        self._curval = curval
+        self._nsteps += 1
+        self._ins.get_parameter_options(self._name)['value'] = curval
+
+        if curval == self._value:
+            self._ins._store_set_value(self._name, self._value,
+                    **self._kwargs)
+            self._ins._queue_changed_value(self._name, self._value)
+            self._finish('done')
+            return False
+
+        return True
+
+    def _finish(self, status):
+        self._status = status
+        if self._hid is not None:
+            gobject.source_remove(self._hid)
+            self._hid = None
+
+        self._ins._record_ramp(self._name, exact_time() - self._start_time,
+                self._nsteps)
+
+        get_ramp_scheduler()._remove(self)
+        for func in self._callbacks:
+            func(self)
+        self._callbacks = []
+
+    def abort(self):
+        '''
+        Stop the ramp at the current value.
+        '''
+
+        if self.is_done():
+            return
+
+        logging.info('Aborting ramp of %s.%s at %s',
+            self._ins.get_name(), self._name, self._curval)
+        self._ins._queue_changed_value(self._name, self._curval)
+        self._finish('aborted')
+
+    def wait(self):
+        '''
+        Wait until the ramp finishes, while handling events. Raises the
+        exception of the driver if setting a value failed.
+
+        Output: True if the ramp completed, False if it was aborted.
+        '''
+
+        from qtflow import get_flowcontrol
+        flow = get_flowcontrol()
+        # Not measurement_idle(), that emits a signal every time
+        delay = min(self._delay / 1000.0, 0.01)
+        while not self.is_done():
+            flow.check_abort()
+            flow.run_mainloop(delay)
+
+        if self._status == 'error':
+            raise self._error
+        return self._status == 'done'
+
+class RampScheduler():
+    '''
+    Keeps track of the running ramps. Starting a new ramp of a parameter
+    aborts a ramp of the same parameter that is still running. All ramps
+    are aborted when a stop is requested through qt.flow.
+    '''
+
+    def __init__(self):
+        self._ramps = {}
+        self._flow = None
+
+    def _connect_flow(self):
+        '''Abort the ramps on a stop-request, once a ramp is started.'''
+        if self._flow is None:
+            from qtflow import get_flowcontrol
+            self._flow = get_flowcontrol()
+            self._flow.connect('stop-request', self._stop_request_cb)
+
+    def start(self, ins, name, value, maxstep, delay, func, kwargs):
+        '''
+        Create and start a Ramp, see Ramp.__init__() for the arguments.
+        Returns the Ramp object.
+        '''
+
+        self._connect_flow()
+        key = (ins.get_name(), name)
+        if key in self._ramps:
+            self._ramps[key].abort()
+
+        ramp = Ramp(ins, name, value, maxstep, delay, func, kwargs)
+        self._ramps[key] = ramp
+        ramp.start()
+        return ramp
+
+    def _remove(self, ramp):
+        key = (ramp.get_instrument().get_name(), ramp.get_name())
+        if self._ramps.get(key, None) is ramp:
+            del self._ramps[key]
+
+    def get_ramps(self):
+        '''Return the list of running ramps.'''
+        return self._ramps.values()
+
+    def abort_all(self):
+        '''Abort all running ramps.'''
+        for ramp in self._ramps.values():
+            ramp.abort()
+
+    def wait_all(self, ramps=None):
+        '''
+        Wait until all ramps in <ramps> (default: all running ramps)
+        have finished.
+
+        Output: True if all ramps completed, False if any was aborted.
+        '''
+
+        if ramps is None:
+            ramps = self._ramps.values()
+
+        ret = True
+        for ramp in ramps:
+            if not ramp.wait():
+                ret = False
+        return ret
+
+    def _stop_request_cb(self, sender):
+        self.abort_all()
+
+try:
+    _ramp_scheduler
+except NameError:
+    _ramp_scheduler = None
+
+def get_ramp_scheduler():
+    global _ramp_scheduler
+    if _ramp_scheduler is None:
+        _ramp_scheduler = RampScheduler()
+    return _ramp_scheduler
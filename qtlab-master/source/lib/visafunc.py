@@ -17,6 +17,7 @@
 
 import time
 import logging
+import numpy
 try:
     from visa import *
     from pyvisa import vpp43
@@ -68,3 +69,126 @@ def read_all(visains):
 
     return buf
 
+
+def get_block_header(data):
+    '''
+    Parse the header of a binary block in data: an IEEE 488.2 definite
+    length block '#<n><length><bytes>', an indefinite length block
+    '#0<bytes>' or an HP block '#A<2 byte big-endian length><bytes>'.
+
+    Output: (offset of the first data byte, number of data bytes). For an
+        indefinite length block the length is None.
+    '''
+
+    start = data.find('#')
+    if start < 0 or len(data) < start + 2:
+        raise ValueError('No binary block header found')
+
+    c = data[start + 1]
+    if c == 'A':
+        if len(data) < start + 4:
+            raise ValueError('Incomplete binary block header')
+        return start + 4, (ord(data[start + 2]) << 8) + ord(data[start + 3])
+    elif not c.isdigit():
+        raise ValueError('Invalid binary block header %r' % data[:start + 2])
+
+    ndigits = int(c)
+    if ndigits == 0:
+        return start + 2, None
+    if len(data) < start + 2 + ndigits:
+        raise ValueError('Incomplete binary block header')
+    return start + 2 + ndigits, int(data[start + 2:start + 2 + ndigits])
+
+def _block_header_complete(data):
+    '''Return whether data contains the complete binary block header.'''
+
+    start = data.find('#')
+    if start < 0 or len(data) < start + 2:
+        return False
+    c = data[start + 1]
+    if c == 'A':
+        return len(data) >= start + 4
+    elif c.isdigit():
+        return len(data) >= start + 2 + int(c)
+    return True
+
+def parse_binary_block(data, dtype='>f8'):
+    '''
+    Return the contents of the binary block in string data (see
+    get_block_header()) as numpy array, without copying the data.
+
+    Input:
+        data (string): the response of the instrument
+        dtype (numpy dtype or string): type of the values including the
+            byte order, e.g. '>f8' (big-endian 64 bit float, the default of
+            FORM:BORD NORM) or '<f4' (little-endian 32 bit float, as sent
+            after FORM:BORD SWAP).
+
+    Output: read-only numpy array
+    '''
+
+    dtype = numpy.dtype(dtype)
+    offset, length = get_block_header(data)
+    if length is None:
+        length = len(data) - offset
+        if data.endswith('\n'):
+            length -= 1
+    elif len(data) < offset + length:
+        raise ValueError('Incomplete binary block: %d of %d bytes' % \
+                (len(data) - offset, length))
+
+    return numpy.frombuffer(data, dtype=dtype,
+            count=length // dtype.itemsize, offset=offset)
+
+def read_binary_block(visains, dtype='>f8'):
+    '''
+    Read a binary block from visa instrument visains and return it as numpy
+    array, see parse_binary_block(). Keeps reading until the complete
+    block has been received, the block can contain the termination
+    character.
+    '''
+
+    # Not all visa providers implement read_raw()
+    if hasattr(visains, 'read_raw'):
+        read = visains.read_raw
+    else:
+        read = visains.read
+    data = read()
+
+    # The header can be split over several reads as well
+    while not _block_header_complete(data):
+        chunk = read()
+        if len(chunk) == 0:
+            break
+        data += chunk
+
+    offset, length = get_block_header(data)
+    if length is not None:
+        chunks = [data]
+        n = len(data)
+        while n < offset + length:
+            chunk = read()
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+            n += len(chunk)
+        if len(chunks) > 1:
+            data = ''.join(chunks)
+
+    return parse_binary_block(data, dtype)
+
+def ask_binary_block(visains, cmd, dtype='>f8'):
+    '''
+    Send query cmd to visa instrument visains and return the binary block
+    it replies with as numpy array, see read_binary_block().
+    '''
+
+    visains.write(cmd)
+    return read_binary_block(visains, dtype)
+
+def parse_ascii_values(data, sep=','):
+    '''
+    Return the values in string data, separated by sep, as numpy float
+    array. Much faster than float() on every value.
+    '''
+    return numpy.fromstring(data, dtype=numpy.float64, sep=sep)
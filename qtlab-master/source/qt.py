@@ -22,6 +22,9 @@ msleep = flow.measurement_idle
 mstart = flow.measurement_start
 mend = flow.measurement_end
 
+from lib.ramp import get_ramp_scheduler
+ramps = get_ramp_scheduler()
+
 from plot import Plot2D, Plot3D
 try:
     from plot import plot_file
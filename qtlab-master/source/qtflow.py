@@ -120,6 +120,17 @@ class FlowControl(SharedGObject):
         if delay > dt and wait:
             time.sleep(delay - dt)
 
+    def run_mainloop_until(self, func):
+        '''
+        Handle events until func() returns True. Sleeps while there are no
+        events, so func() should become True after an event, for example
+        one added with gobject.idle_add() by another thread.
+        '''
+        gtk.gdk.threads_enter()
+        while not func():
+            gtk.main_iteration_do(True)
+        gtk.gdk.threads_leave()
+
     def measurement_idle(self, delay=0.0, exact=False, emit_interval=1):
         '''
         Indicate that the measurement is idle and handle events.
@@ -18,6 +18,9 @@
 import logging
 import socket
 import select
+import threading
+from lib import callstats
+from lib.config import get_config
 
 try:
     from pyvisa import SerialInstrument
@@ -29,7 +32,10 @@ _drivers = (
     'prologix_ethernet'
 )
 
-def set_visa(name):
+# Provider selected for the current thread by set_thread_visa()
+_thread_visa = threading.local()
+
+def _get_instrument_func(name):
     if name not in _drivers:
         raise ValueError('Unknown VISA provider: %s', name)
 
@@ -38,13 +44,85 @@ def set_visa(name):
             from pyvisa import visa as module
         else:
             module = __import__(name)
-        global instrument
-        instrument = module.instrument
+        return module.instrument
     except:
         logging.warning('Unable to load visa driver %s', name)
+        return None
+
+def set_visa(name):
+    global _instrument
+    func = _get_instrument_func(name)
+    if func is not None:
+        _instrument = func
 
 set_visa('pyvisa')
 
+def set_thread_visa(name):
+    '''
+    Select the VISA provider for instruments created in the calling thread,
+    e.g. while creating instruments in parallel. With name=None the
+    provider set with set_visa() is used again.
+    '''
+
+    if name is None:
+        _thread_visa.instrument = None
+    else:
+        _thread_visa.instrument = _get_instrument_func(name)
+
+def instrument(*args, **kwargs):
+    '''
+    Create an instrument with the selected VISA provider. If config option
+    'instrument_stats' is True the transferred bytes are counted for the
+    instrument statistics.
+    '''
+
+    func = getattr(_thread_visa, 'instrument', None)
+    if func is None:
+        func = _instrument
+    ins = func(*args, **kwargs)
+    if get_config().get('instrument_stats', False):
+        ins = CountingInstrument(ins)
+    return ins
+
+class CountingInstrument(object):
+    '''
+    Wrapper around a visa instrument that counts the bytes written and
+    read, see lib.callstats.
+    '''
+
+    def __init__(self, ins):
+        self.__dict__['_ins'] = ins
+
+    def __getattr__(self, name):
+        return getattr(self._ins, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._ins, name, value)
+
+    def write(self, message, *args, **kwargs):
+        callstats.add_transfer(nwritten=len(message))
+        return self._ins.write(message, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        ret = self._ins.read(*args, **kwargs)
+        callstats.add_transfer(nread=len(ret))
+        return ret
+
+    def read_raw(self, *args, **kwargs):
+        ret = self._ins.read_raw(*args, **kwargs)
+        callstats.add_transfer(nread=len(ret))
+        return ret
+
+    def ask(self, message, *args, **kwargs):
+        callstats.add_transfer(nwritten=len(message))
+        ret = self._ins.ask(message, *args, **kwargs)
+        callstats.add_transfer(nread=len(ret))
+        return ret
+
+    def ask_for_values(self, message, *args, **kwargs):
+        callstats.add_transfer(nwritten=len(message))
+        return self._ins.ask_for_values(message, *args, **kwargs)
+
 class TcpIpInstrument:
     '''
     Class to mimic visa instrument for TCP/IP connected text-based devices.
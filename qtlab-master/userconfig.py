@@ -24,6 +24,10 @@ config['allowed_ips'] = (
 # Start instrument server to share with instruments with remote QTLab?
 config['instrument_server'] = False
 
+## Handle network I/O for the GUI and remote clients in a separate thread
+## instead of in the GTK main loop
+#config['network_thread'] = True
+
 ## This sets a default location for data-storage
 #config['datadir'] = 'd:/data'
 
@@ -54,6 +58,41 @@ config['scriptdirs'] = [
 #sys.path.append('d:/folder1')
 #sys.path.append('d:/folder2')
 
+## When to flush data files to disk: 'always' (default), 'points',
+## 'interval' or 'block'. Use e.g. 'interval' for network-mounted data dirs.
+#config['data_flush'] = 'interval'
+#config['data_flush_points'] = 100
+#config['data_flush_interval'] = 1.0
+#config['data_flush_max_age'] = 10.0
+
+## Default format for data files: 'text' (.dat), 'binary' (.qtb) or
+## 'hdf5' (.hdf5, requires h5py)
+#config['data_file_format'] = 'binary'
+#config['data_hdf5_compression'] = 'gzip'
+
+## Format and write data files in a separate thread
+#config['data_async_write'] = True
+#config['data_write_queue_size'] = 1000
+## Set to False to let new_block() return without waiting for the writer
+#config['data_drain_on_block'] = False
+
+## Minimum interval (ms) between 'changed' signals of an instrument, changes
+## in between are combined. With instrument_changed_subscribe remote
+## clients only receive parameters they subscribed to.
+#config['instrument_changed_interval'] = 100
+#config['instrument_changed_subscribe'] = True
+
+## Create instruments only when they are first used (default False), see
+## qt.instruments.create(..., lazy=True) and qt.instruments.init_pending()
+#config['instruments_lazy'] = True
+
+## Record call counts, latency and transferred bytes of instrument drivers,
+## see ins.get_stats() and qt.instruments.get_stats()
+#config['instrument_stats'] = True
+
+## Number of worker threads for qt.instruments.get_parallel()
+#config['instrument_workers'] = 4
+
 # Whether to start the GUI automatically
 config['startgui'] = True
 